@@ -1,24 +1,91 @@
 (() => {
   "use strict";
 
-  // --- EXPANDED DATASET FOR TOP 10 GLOBAL ECONOMIES ---
+  // --- QUOTE TABLES ---
+  // Rates, FTA rules and the clearance heuristic come from quote-bundle.json,
+  // generated by `trade_compliance.py --rules trade-agreements.csv
+  // --export-bundle quote-bundle.json`, so the page prices exactly like the
+  // Python engine. Regenerate it whenever the rate tables or rules change;
+  // it is fetched once, after first paint.
+  const BUNDLE_URL = 'quote-bundle.json';
+  const BUNDLE_FORMAT = 'trade-compliance-quotes';
+  const BUNDLE_VERSION = 1;
+  // Freight estimate per mode, as a share of shipment value (a form input, not a rate table)
+  const FREIGHT_RATES = { air: 0.12, sea: 0.06 };
+  // Handling hours per mode, added to the engine's customs clearance estimate
+  const TRANSIT_HOURS = { air: 24, sea: 72 };
+  // Countries offered in the form, in display order. An origin the bundle does not
+  // name (no rule mentions it) prices as "*"; destinations must be in the bundle.
   const COUNTRIES = [
     { id: 'usa', name: 'USA' }, { id: 'china', name: 'China' }, { id: 'japan', name: 'Japan' },
     { id: 'germany', name: 'Germany' }, { id: 'uk', name: 'UK' }, { id: 'france', name: 'France' },
     { id: 'india', name: 'India' }, { id: 'italy', name: 'Italy' }, { id: 'brazil', name: 'Brazil' },
     { id: 'canada', name: 'Canada' }
   ];
-  const CURRENCIES = { usa: 'USD', china: 'CNY', japan: 'JPY', germany: 'EUR', uk: 'GBP', france: 'EUR', india: 'INR', italy: 'EUR', brazil: 'BRL', canada: 'CAD' };
-  const TAX_RATES = { usa: 0.10, china: 0.13, japan: 0.10, germany: 0.19, uk: 0.20, france: 0.20, india: 0.18, italy: 0.22, brazil: 0.25, canada: 0.05 };
-  const BASE_DUTY_RATES = {
-    electronics: 0.05, machinery: 0.07, automotive: 0.10, pharmaceuticals: 0.03, textiles: 0.12, food: 0.15
-  };
-  // Free Trade Agreements (FTAs) reduce duty rates. Value is the new multiplier. 0 = no duty.
-  const TRADE_AGREEMENTS = {
-    'canada-usa': 0, 'usa-canada': 0, // USMCA
-    'germany-france': 0, 'germany-italy': 0, 'france-germany': 0, 'france-italy': 0, 'italy-france': 0, 'italy-germany': 0, // EU
-    'uk-japan': 0.5, 'japan-uk': 0.5 // UK-Japan CEPA
-  };
+
+  let bundlePromise = null;
+
+  function loadBundle() {
+    if (!bundlePromise) {
+      bundlePromise = fetch(BUNDLE_URL)
+        .then(response => {
+          if (!response.ok) throw new Error(`${BUNDLE_URL}: HTTP ${response.status}`);
+          return response.json();
+        })
+        .then(indexBundle);
+    }
+    return bundlePromise;
+  }
+
+  function indexBundle(bundle) {
+    if (bundle.format !== BUNDLE_FORMAT || bundle.version !== BUNDLE_VERSION) {
+      throw new Error(`${BUNDLE_URL}: expected ${BUNDLE_FORMAT} version ${BUNDLE_VERSION}`);
+    }
+    const index = names => new Map(names.map((name, i) => [name, i]));
+    bundle.originIndex = index(bundle.origins);
+    bundle.destinationIndex = index(bundle.destinations);
+    bundle.categoryIndex = index(bundle.categories);
+    return bundle;
+  }
+
+  // TradeCompliance.cost_values() over the bundle, unrounded; null for an unknown destination or category
+  function quote(bundle, origin, destination, category, value, shipping) {
+    const d = bundle.destinationIndex.get(destination);
+    const c = bundle.categoryIndex.get(category);
+    if (d === undefined || c === undefined) return null;
+    const o = bundle.originIndex.get(origin) ?? 0; // 0 = "*", any other origin
+    const nCat = bundle.categories.length;
+    const [breaks, segments] = bundle.plans[bundle.routes[(o * bundle.destinations.length + d) * nCat + c]];
+    let band = 0;
+    while (band < breaks.length && breaks[band] <= value) band++; // a route has only a few breakpoints
+    const [multiplier, surcharge, ruleHours] = bundle.segments[segments[band]];
+
+    const dutyRate = bundle.duty[d * nCat + c] * multiplier + surcharge;
+    const taxRate = bundle.tax[d];
+    const importDuty = value * dutyRate;
+    const tax = (value + importDuty + shipping) * taxRate;
+
+    // estimate_clearance_hours(), same operations in the same order
+    const model = bundle.clearance;
+    const dutyPct = value > 0 ? (importDuty / value) * 100 : 0;
+    let hours = model.base;
+    hours += Math.min(Math.max(dutyPct * model.duty_factor, 0), model.duty_cap);
+    hours += taxRate * model.tax_hours;
+    hours += bundle.category_hours[c];
+    hours += ruleHours;
+
+    return {
+      currency: bundle.currency[d],
+      dutyRate: dutyRate,
+      importDuty: importDuty,
+      taxRate: taxRate,
+      tax: tax,
+      complianceFee: value * bundle.fee,
+      totalLandedCost: value + importDuty + tax + shipping,
+      clearanceHours: Math.trunc(Math.max(model.min, Math.min(hours, model.max))),
+      hasFta: multiplier !== 1
+    };
+  }
 
   // --- MODEL ---
   class GlobalTradeModel {
@@ -31,44 +98,25 @@
       this.shippingMode = shippingMode;
     }
 
-    getDutyRate() {
-      const agreementKey = `${this.origin}-${this.destination}`;
-      const baseRate = BASE_DUTY_RATES[this.category] ?? 0.08;
-      
-      if (TRADE_AGREEMENTS.hasOwnProperty(agreementKey)) {
-        return baseRate * TRADE_AGREEMENTS[agreementKey];
-      }
-      return baseRate;
-    }
-    
-    calculate() {
-      const dutyRate = this.getDutyRate();
-      const taxRate = TAX_RATES[this.destination] ?? 0.15;
-      const currency = CURRENCIES[this.destination] ?? 'USD';
-
-      // Shipping cost & time vary by mode
-      const shippingBaseCost = this.value * (this.shippingMode === 'air' ? 0.12 : 0.06);
-      const shippingCost = shippingBaseCost + (Math.random() * 100); // Add variability
-      const clearanceHours = 24 + (this.shippingMode === 'air' ? 24 : 72) + (dutyRate * 100) + (this.value / 5000);
-
-      const importDuty = this.value * dutyRate;
-      const taxableValue = this.value + shippingCost + this.insurance;
-      const tax = (taxableValue + importDuty) * taxRate;
-      const totalLandedCost = this.value + shippingCost + this.insurance + importDuty + tax;
+    calculate(bundle) {
+      const shippingCost = this.value * (FREIGHT_RATES[this.shippingMode] ?? FREIGHT_RATES.sea);
+      const logisticsCost = shippingCost + this.insurance;
+      const costs = quote(bundle, this.origin, this.destination, this.category, this.value, logisticsCost);
+      if (!costs) return null;
 
       return {
         origin: this.origin,
         destination: this.destination,
-        currency: currency,
+        currency: costs.currency,
         shipmentValue: this.value,
-        totalLandedCost: totalLandedCost,
-        importDuty: importDuty,
-        tax: tax,
-        logisticsCost: shippingCost + this.insurance,
-        dutyRate: dutyRate,
-        taxRate: taxRate,
-        clearanceHours: Math.round(clearanceHours),
-        hasFta: TRADE_AGREEMENTS.hasOwnProperty(`${this.origin}-${this.destination}`)
+        totalLandedCost: costs.totalLandedCost,
+        importDuty: costs.importDuty,
+        tax: costs.tax,
+        logisticsCost: logisticsCost,
+        dutyRate: costs.dutyRate,
+        taxRate: costs.taxRate,
+        clearanceHours: costs.clearanceHours + (TRANSIT_HOURS[this.shippingMode] ?? TRANSIT_HOURS.sea),
+        hasFta: costs.hasFta
       };
     }
   }
@@ -76,16 +124,28 @@
   // --- UI & APPLICATION LOGIC ---
   function el(id) { return document.getElementById(id); }
 
-  function populateDropdowns() {
+  function label(id) {
+    const country = COUNTRIES.find(c => c.id === id);
+    return country ? country.name : id.charAt(0).toUpperCase() + id.slice(1);
+  }
+
+  function populateDropdowns(bundle) {
     const originSelect = el('origin');
     const destSelect = el('destination');
-    COUNTRIES.forEach(country => {
-      originSelect.add(new Option(country.name, country.id));
-      destSelect.add(new Option(country.name, country.id));
-    });
+    const categorySelect = el('category');
+    // COUNTRIES order first, then any others the bundle names
+    const ordered = (ids, all) => COUNTRIES.map(c => c.id).filter(id => all || ids.includes(id))
+      .concat(ids.filter(id => !COUNTRIES.some(c => c.id === id)));
+    const origins = ordered(bundle.origins.slice(1), true);
+    const destinations = ordered(bundle.destinations, false);
+    origins.forEach(id => originSelect.add(new Option(label(id), id)));
+    destinations.forEach(id => destSelect.add(new Option(label(id), id)));
+    if (categorySelect && !categorySelect.options.length) {
+      bundle.categories.forEach(id => categorySelect.add(new Option(label(id), id)));
+    }
     // Set default values that are not the same
-    originSelect.value = 'usa';
-    destSelect.value = 'germany';
+    destSelect.value = destinations.includes('germany') ? 'germany' : destinations[0];
+    originSelect.value = destSelect.value !== 'usa' ? 'usa' : origins.find(id => id !== 'usa');
   }
 
   function runAnalysis() {
@@ -124,13 +184,22 @@
         }
     }, 600);
 
-    setTimeout(() => {
+    const delay = new Promise(resolve => setTimeout(resolve, 3500)); // Simulate 3.5 seconds of processing
+    Promise.all([loadBundle(), delay])
+      .then(([bundle]) => {
+        const results = model.calculate(bundle);
+        if (results) {
+          renderDashboard(results);
+        } else {
+          alert("No rates for this destination and category.");
+        }
+      })
+      .catch(err => alert(`Quote tables unavailable: ${err.message}`))
+      .finally(() => {
         clearInterval(statusInterval);
         processingOverlay.style.display = 'none';
-        const results = model.calculate();
-        renderDashboard(results);
         analyzeBtn.disabled = false;
-    }, 3500); // Simulate 3.5 seconds of processing
+      });
   }
 
   function formatMoney(value, currency) {
@@ -173,8 +242,10 @@
   }
 
   function wire() {
-    populateDropdowns();
     el('analyzeBtn').addEventListener('click', runAnalysis);
+    loadBundle()
+      .then(populateDropdowns)
+      .catch(err => console.error(`Quote tables unavailable: ${err.message}`));
   }
 
   document.addEventListener("DOMContentLoaded", wire);
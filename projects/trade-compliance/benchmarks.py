@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+benchmarks.py
+
+Reproducible benchmarks for trade_compliance.py hot paths.
+- synthetic shipment generators (1k / 100k / 10M rows, fixed seed)
+- rows/s, per-call latency percentiles and peak RSS per case
+- CLI cold-start time
+- JSON results that can be compared with a regression threshold
+
+    python benchmarks.py --size medium --save results.json
+    python benchmarks.py --compare base.json results.json --threshold 0.10
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import traceback
+from pathlib import Path
+from queue import Empty
+from typing import Any, Callable, Dict, Iterator, List
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+import trade_compliance as tc  # noqa: E402
+
+SIZES = {"small": 1_000, "medium": 100_000, "large": 10_000_000}
+CATEGORIES = ["textiles", "machinery", "pharmaceuticals", "automotive", "food", "electronics"]
+COUNTRIES = ["italy", "india"]
+GEN_CHUNK = 100_000
+
+
+# --- synthetic data -------------------------------------------------------------
+
+def synthetic_shipments(n: int, seed: int = 42) -> Iterator[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    for _ in range(n):
+        yield {
+            "destination": rnd.choice(COUNTRIES),
+            "origin": rnd.choice(COUNTRIES),
+            "product_category": rnd.choice(CATEGORIES),
+            "shipment_value": round(rnd.uniform(100.0, 250_000.0), 2),
+            "shipping_cost": round(rnd.uniform(0.0, 5_000.0), 2),
+        }
+
+
+def synthetic_columns(n: int, seed: int = 42) -> Iterator[List[list]]:
+    """Column chunks of at most GEN_CHUNK rows, in calculate_costs_batch() order."""
+    it = synthetic_shipments(n, seed)
+    while n > 0:
+        rows = [next(it) for _ in range(min(n, GEN_CHUNK))]
+        n -= len(rows)
+        yield [[r[k] for r in rows] for k in ("destination", "origin", "product_category",
+                                              "shipment_value", "shipping_cost")]
+
+
+# --- measurement ------------------------------------------------------------------
+
+def _percentiles(samples_ns: List[int]) -> Dict[str, float]:
+    if not samples_ns:
+        return {}
+    samples_ns.sort()
+    pick = lambda q: samples_ns[min(len(samples_ns) - 1, int(q * len(samples_ns)))] / 1e3
+    return {"p50_us": pick(0.50), "p90_us": pick(0.90), "p99_us": pick(0.99), "max_us": samples_ns[-1] / 1e3}
+
+
+def _timed_calls(fn: Callable, args_iter, sample_every: int = 1) -> tuple:
+    """Run fn(*args) for each args; return (calls, seconds, latency samples in ns)."""
+    samples, calls = [], 0
+    clock = time.perf_counter_ns
+    start = clock()
+    for args in args_iter:
+        if calls % sample_every == 0:
+            t = clock()
+            fn(*args)
+            samples.append(clock() - t)
+        else:
+            fn(*args)
+        calls += 1
+    return calls, (clock() - start) / 1e9, samples
+
+
+def bench_scalar_costs(n: int) -> Dict[str, Any]:
+    def call(d, o, c, v, s):
+        tc.TradeCompliance(d, o, c, v, s).calculate_costs()
+    args = (tuple(r.values()) for r in synthetic_shipments(n))
+    calls, secs, samples = _timed_calls(call, args, max(1, n // 100_000))
+    return {"rows": calls, "seconds": secs, **_percentiles(samples)}
+
+
+def bench_clearance_hours(n: int) -> Dict[str, Any]:
+    items = [tc.TradeCompliance(*r.values()) for r in synthetic_shipments(min(n, GEN_CHUNK))]
+    args = ((items[i % len(items)],) for i in range(n))
+    call = lambda t: t.estimate_clearance_hours(t.shipment_value * 0.05, 0.2)
+    calls, secs, samples = _timed_calls(call, args, max(1, n // 100_000))
+    return {"rows": calls, "seconds": secs, **_percentiles(samples)}
+
+
+def bench_duty_lookup(n: int) -> Dict[str, Any]:
+    rnd = random.Random(7)
+    schedule = tc.TariffSchedule()
+    for dest in COUNTRIES:
+        for _ in range(min(n, 200_000)):
+            code = str(rnd.randrange(10**9, 10**10))
+            schedule.add(dest, code[:rnd.choice((2, 4, 6, 8, 10))], rnd.randrange(300) / 1000)
+    codes = [str(rnd.randrange(10**9, 10**10)) for _ in range(min(n, GEN_CHUNK))]
+    args = ((COUNTRIES[i & 1], codes[i % len(codes)]) for i in range(n))
+    calls, secs, samples = _timed_calls(schedule.lookup, args, max(1, n // 100_000))
+    return {"rows": calls, "seconds": secs, **_percentiles(samples)}
+
+
+def bench_batch_costs(n: int) -> Dict[str, Any]:
+    rows, secs, samples = 0, 0.0, []
+    for cols in synthetic_columns(n):
+        t = time.perf_counter_ns()
+        tc.calculate_costs_batch(*cols)
+        samples.append(time.perf_counter_ns() - t)
+        secs += samples[-1] / 1e9
+        rows += len(cols[0])
+    return {"rows": rows, "seconds": secs, **_percentiles(samples)}
+
+
+def _bench_writer(n: int, cls: type) -> Dict[str, Any]:
+    rows, secs = 0, 0.0
+    with open(os.devnull, "w", encoding="utf-8") as fh:
+        writer = cls(fh)
+        for cols in synthetic_columns(n):
+            batch = tc.calculate_costs_batch(*cols)
+            t = time.perf_counter()
+            writer.write(batch)
+            secs += time.perf_counter() - t
+            rows += len(batch)
+        writer.close()
+    return {"rows": rows, "seconds": secs}
+
+
+def bench_write_csv(n: int) -> Dict[str, Any]:
+    """Legacy dict-per-row write_csv()."""
+    rows, secs = 0, 0.0
+    for cols in synthetic_columns(min(n, 1_000_000)):
+        dict_rows = tc.calculate_costs_batch(*cols).to_rows()
+        t = time.perf_counter()
+        tc.write_csv(Path(os.devnull), dict_rows)
+        secs += time.perf_counter() - t
+        rows += len(dict_rows)
+    return {"rows": rows, "seconds": secs}
+
+
+def bench_cli_cold_start(n: int, repeat: int = 7) -> Dict[str, Any]:
+    cmd = [sys.executable, str(HERE / "trade_compliance.py"), "--json"]
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter_ns()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        samples.append(time.perf_counter_ns() - t)
+    return {"rows": repeat, "seconds": sum(samples) / 1e9, **_percentiles(samples)}
+
+
+CASES: Dict[str, Callable[[int], Dict[str, Any]]] = {
+    "scalar_calculate_costs": bench_scalar_costs,
+    "estimate_clearance_hours": bench_clearance_hours,
+    "duty_lookup": bench_duty_lookup,
+    "batch_calculate_costs": bench_batch_costs,
+    "write_csv": bench_write_csv,
+    "csv_batch_writer": lambda n: _bench_writer(n, tc.CsvBatchWriter),
+    "jsonl_batch_writer": lambda n: _bench_writer(n, tc.JsonlBatchWriter),
+    "cli_cold_start": bench_cli_cold_start,
+}
+# Per-row Python paths are capped so a "large" run finishes in minutes
+SCALAR_CAP = 1_000_000
+
+
+class CaseFailed(RuntimeError):
+    """A benchmark case raised, or its process died, in the child."""
+
+
+def _run_case(name: str, n: int, queue):
+    try:
+        if name in ("scalar_calculate_costs", "estimate_clearance_hours", "write_csv"):
+            n = min(n, SCALAR_CAP)
+        result = CASES[name](n)
+        result["rows_per_s"] = result["rows"] / result["seconds"] if result["seconds"] else 0.0
+        # children covers the CLI subprocesses of cli_cold_start
+        result["peak_rss_kb"] = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    except BaseException:
+        # the exception itself may not pickle; its traceback text always does
+        queue.put((False, traceback.format_exc()))
+        raise
+    queue.put((True, result))
+
+
+def run_case(name: str, n: int) -> Dict[str, Any]:
+    """Run one case in a fresh process so peak RSS is per case.
+
+    Raises CaseFailed when the case raises or its process exits without
+    a result (e.g. killed for running out of memory), instead of waiting
+    for a result forever.
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_case, args=(name, n, queue))
+    proc.start()
+    try:
+        while True:
+            # checked before get(): a result put just before exiting is still read
+            exited = proc.exitcode is not None
+            try:
+                ok, result = queue.get(timeout=1.0)
+                break
+            except Empty:
+                if exited:
+                    raise CaseFailed(f"{name}: process exited with code {proc.exitcode} "
+                                     f"and no result") from None
+    finally:
+        proc.join()
+    if not ok:
+        raise CaseFailed(f"{name} failed:\n{result}")
+    return result
+
+
+def run(size: str, cases: List[str]) -> Dict[str, Any]:
+    n = SIZES[size]
+    results = {}
+    for name in cases:
+        results[name] = run_case(name, n)
+        r = results[name]
+        print(f"{name:26s} {r['rows']:>10,} rows  {r['rows_per_s']:>14,.0f} rows/s"
+              f"  p99 {r.get('p99_us', 0):>10,.1f} us  rss {r['peak_rss_kb']:>9,} KB", flush=True)
+    return {
+        "meta": {
+            "size": size,
+            "rows": n,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": getattr(tc._load_numpy(), "__version__", None),
+            "cpu_count": os.cpu_count(),
+            "timestamp": tc.now_iso(),
+        },
+        "results": results,
+    }
+
+
+# --- comparison ---------------------------------------------------------------------
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.10) -> List[str]:
+    """Regression lines: throughput down or p99 latency up by more than threshold."""
+    lines = []
+    for name, b in base["results"].items():
+        n = new["results"].get(name)
+        if n is None:
+            continue
+        checks = [("rows_per_s", b.get("rows_per_s"), n.get("rows_per_s"), -1),
+                  ("p99_us", b.get("p99_us"), n.get("p99_us"), 1)]
+        for metric, old, cur, sign in checks:
+            if not old or cur is None:
+                continue
+            change = (cur - old) / old
+            if sign * change > threshold:
+                lines.append(f"REGRESSION {name}.{metric}: {old:,.1f} -> {cur:,.1f} ({change:+.1%})")
+    return lines
+
+
+def _print_comparison(base: Dict[str, Any], new: Dict[str, Any], threshold: float) -> int:
+    print(f"{'case':26s} {'base rows/s':>14s} {'new rows/s':>14s} {'change':>8s}")
+    for name, b in base["results"].items():
+        n = new["results"].get(name)
+        if n and b.get("rows_per_s"):
+            change = n["rows_per_s"] / b["rows_per_s"] - 1
+            print(f"{name:26s} {b['rows_per_s']:>14,.0f} {n['rows_per_s']:>14,.0f} {change:>+8.1%}")
+    regressions = compare(base, new, threshold)
+    for line in regressions:
+        print(line)
+    if not regressions:
+        print(f"No regressions beyond {threshold:.0%}")
+    return 1 if regressions else 0
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Trade Compliance benchmarks")
+    p.add_argument("--size", choices=list(SIZES), default="small")
+    p.add_argument("--case", action="append", choices=list(CASES), help="run only these cases")
+    p.add_argument("--save", type=str, help="write results JSON")
+    p.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two results files")
+    p.add_argument("--threshold", type=float, default=0.10, help="regression threshold (default: 0.10)")
+    return p
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.compare:
+        base, new = (json.loads(Path(p).read_text(encoding="utf-8")) for p in args.compare)
+        return _print_comparison(base, new, args.threshold)
+    try:
+        results = run(args.size, args.case or list(CASES))
+    except CaseFailed as exc:
+        print(f"error: {exc}", file=sys.stderr)
+        return 1
+    if args.save:
+        tc.write_json(Path(args.save), results)
+        print(f"Wrote results to {args.save}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
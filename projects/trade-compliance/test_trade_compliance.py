@@ -0,0 +1,434 @@
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+import trade_compliance as tc
+
+
+def _without_timestamp(rows):
+    return [{k: v for k, v in row.items() if k != "timestamp"} for row in rows]
+
+
+class BatchTest(unittest.TestCase):
+    ROWS = [  # destination, origin, category, value, shipping
+        ("italy", "india", "food", 100, None),
+        ("India", None, "textiles", 2500.5, 40),
+        ("india", "italy", "", None, 12.25),
+        (None, "india", "electronics", 0.115, ""),
+        ("italy", "germany", "pharmaceuticals", 1e6, 999.99),
+    ]
+
+    def check_matches_scalar(self, rows):
+        expected = [tc.TradeCompliance(destination=d, origin=o, product_category=c, shipment_value=v,
+                                       shipping_cost=s).calculate_costs() for d, o, c, v, s in rows]
+        for numpy in (tc._load_numpy(), None):
+            with self.subTest(numpy=numpy is not None), mock.patch.object(tc, "np", numpy):
+                batch = tc.calculate_costs_batch(*(list(col) for col in zip(*rows)))
+                self.assertEqual(_without_timestamp(batch.to_rows()), _without_timestamp(expected))
+
+    def test_matches_scalar(self):
+        self.check_matches_scalar(self.ROWS)
+
+    def test_missing_amounts_price_as_zero(self):
+        # a file without a shipping column passes a column of None
+        self.check_matches_scalar([row[:4] + (None,) for row in self.ROWS])
+
+    def test_jsonl_rows_with_different_keys(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tariffs.csv")
+            with open(path, "w", encoding="utf-8") as fh:
+                fh.write("destination,hs_code,rate\nindia,85,0.3\n")
+            schedule = tc.TariffSchedule.load(path)
+        rows = [{"destination": "italy", "value": 5},
+                {"destination": "india", "value": 7, "hs_code": "85"},
+                {"destination": "india", "category": "food", "value": 7},
+                {"destination": "india", "product_category": "food", "value": 7, "shipping": 3}]
+        with mock.patch.object(tc, "TARIFF_SCHEDULE", schedule):
+            expected = [tc.TradeCompliance(destination=r["destination"], shipment_value=r["value"],
+                                           product_category=r.get("product_category", r.get("category")),
+                                           shipping_cost=r.get("shipping"), hs_code=r.get("hs_code", ""))
+                        .calculate_costs() for r in rows]
+            priced = tc.price_shipments(rows).to_rows()
+        self.assertEqual(_without_timestamp(priced), _without_timestamp(expected))
+        self.assertEqual([r["duty_rate"] for r in priced], [0.06, 0.3, 0.12, 0.12])
+
+
+class TariffScheduleTest(unittest.TestCase):
+    def test_longest_prefix_wins(self):
+        schedule = tc.TariffSchedule()
+        schedule.add("india", "85", 0.10)
+        schedule.add("India", "8517", 0.05)
+        schedule.add("india", "8517.12", 0.0)
+        lookup = lambda code: schedule.lookup("india", tc._normalize_hs(code))
+        self.assertEqual(lookup("8517.12.00"), 0.0)
+        self.assertEqual(lookup("85179900"), 0.05)
+        self.assertEqual(lookup("8599"), 0.10)
+        self.assertIsNone(lookup("0101"))
+        self.assertIsNone(schedule.lookup("italy", "85"))
+        with mock.patch.object(tc, "TARIFF_SCHEDULE", schedule):
+            self.assertEqual(tc.TradeCompliance("india", hs_code="8517 62").duty_rate(), 0.05)
+            # no matching line: the destination/category rate
+            self.assertEqual(tc.TradeCompliance("india", product_category="food", hs_code="0101").duty_rate(), 0.12)
+
+
+class CompiledRatesTest(unittest.TestCase):
+    def test_round_trip_matches_dict_lookups(self):
+        schedule = tc.TariffSchedule()
+        for dest, code, rate in (("india", "85", 0.1), ("india", "851712", 0.0), ("italy", "0101", 0.2)):
+            schedule.add(dest, code, rate)
+        dests = sorted(tc.TAX_RATES) + ["atlantis"]
+        cats = sorted({c for _, c in tc.DUTY_RATES}) + ["weapons"]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rates.bin")
+            tc.compile_rates(path, schedule)
+            rates = tc.MappedRates(path)
+        self.assertEqual(rates.destinations(), set(tc.TAX_RATES))
+        for d in dests:
+            self.assertEqual(rates.tax(d), tc.TAX_RATES.get(d, 0.0), d)
+            self.assertEqual(rates.currency(d), tc.CURRENCY.get(d, "USD"), d)
+            for c in cats:
+                self.assertEqual(rates.duty(d, c), tc.DUTY_RATES.get((d, c), tc.DEFAULT_DUTY), (d, c))
+            for code in ("85", "8517", "85171299", "0101", "99"):
+                self.assertEqual(rates.lookup(d, code), schedule.lookup(d, code), (d, code))
+        quotes = [tc.TradeCompliance(d, "india", c, 1234.56, 78.9) for d in dests for c in cats]
+        expected = [q.cost_values() for q in quotes]
+        with mock.patch.object(tc, "RATE_FILE", rates):
+            self.assertEqual([q.cost_values() for q in quotes], expected)
+
+
+class QuoteCacheTest(unittest.TestCase):
+    def test_hits_evictions_and_invalidation(self):
+        cache = tc.QuoteCache(maxsize=2)
+        quote = lambda value: tc.TradeCompliance("italy", "india", "food", value, 10).calculate_costs()
+        with mock.patch.object(tc, "QUOTE_CACHE", cache):
+            first = quote(100)
+            self.assertEqual(quote(100), first)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+            quote(200), quote(300)
+            self.assertEqual((len(cache), cache.evictions), (2, 1))
+            with mock.patch.dict(tc.DUTY_RATES, {("italy", "food"): 0.5}):
+                changed = quote(100)
+            self.assertEqual(cache.invalidations, 1)
+            self.assertEqual(changed["duty_rate"], 0.5)
+            self.assertEqual(changed["import_duty"], 50.0)
+            # restoring the table is a change too
+            self.assertEqual(quote(100)["duty_rate"], first["duty_rate"])
+            self.assertEqual(cache.invalidations, 2)
+
+
+class CentsTest(unittest.TestCase):
+    def test_known_answer(self):
+        costs = tc.TradeCompliance("italy", "india", "electronics", 1234.56, 78.9).calculate_costs_cents()
+        self.assertEqual([costs[k] for k in ("shipment_value", "shipping_cost", "duty_rate", "import_duty", "tax_rate",
+                                             "tax", "base_compliance_fee", "total_landed_cost")],
+                         [123456, 7890, 600, 7407, 2200, 30526, 2469, 169279])
+
+    def test_totals_reconcile_on_every_path(self):
+        rows = [(d, "india", c, v / 8 + 0.005, v % 7 * 1.005) for d in ("italy", "india")
+                for c in ("food", "textiles", "electronics") for v in range(0, 400, 7)]
+        expected = [tc.TradeCompliance(*row).cost_values_cents() for row in rows]
+        for values in expected:
+            sv, sc, duty, tax, total = (values[i] for i in (4, 5, 7, 9, 11))
+            self.assertTrue(all(isinstance(v, int) for v in values[4:]))
+            self.assertEqual(total, sv + duty + tax + sc)
+        for numpy in (tc._load_numpy(), None):
+            with self.subTest(numpy=numpy is not None), mock.patch.object(tc, "np", numpy):
+                batch = tc.calculate_costs_batch(*(list(col) for col in zip(*rows)), cents=True)
+                self.assertEqual([tuple(r.values())[1:] for r in batch.to_rows()], expected)
+
+
+class FxRatesTest(unittest.TestCase):
+    def setUp(self):
+        self.fx = tc.FxRates("USD")
+        for day, currency, rate in (("2024-02-01", "EUR", 0.8), ("2024-01-01", "EUR", 0.9),
+                                    ("2024-01-01", "INR", 80.0), ("2024-03-01", "INR", 90.0)):
+            self.fx.add(day, currency, rate)
+
+    def test_as_of_lookup(self):
+        self.assertEqual(self.fx.rate("EUR", "2024-01-31"), 0.9)
+        self.assertEqual(self.fx.rate("EUR", "2024-02-01T08:00:00Z"), 0.8)
+        self.assertEqual(self.fx.rate("EUR", "2025-06-30"), 0.8)
+        self.assertEqual(self.fx.rate("usd", "1999-01-01"), 1.0)
+        with self.assertRaises(ValueError):
+            self.fx.rate("EUR", "2023-12-31")
+        self.assertEqual(self.fx.cross_rate("EUR", "INR", "2024-02-15"), 100.0)
+
+    def test_reporting_columns(self):
+        rows = [("italy", "india", "food", 100.0, 10.0, "2024-01-15"),
+                ("italy", "india", "food", 100.0, 10.0, "2024-02-15"),
+                ("india", "italy", "textiles", 5000.0, 0.0, "2024-03-02")]
+        with mock.patch.object(tc, "FX_RATES", self.fx), mock.patch.object(tc, "REPORTING_CURRENCY", "INR"):
+            expected = [tc.TradeCompliance(*row[:5]).calculate_costs(as_of=row[5]) for row in rows]
+            self.assertEqual([(r["fx_rate"], r["reporting_currency"]) for r in expected],
+                             [(80 / 0.9, "INR"), (100.0, "INR"), (1.0, "INR")])
+            self.assertEqual(expected[1]["reporting_total_landed_cost"],
+                             round(expected[1]["total_landed_cost"] * 100, 2))
+            for numpy in (tc._load_numpy(), None):
+                with self.subTest(numpy=numpy is not None), mock.patch.object(tc, "np", numpy):
+                    cols = [list(col) for col in zip(*rows)]
+                    batch = tc.calculate_costs_batch(*cols[:5], dates=cols[5])
+                    self.assertEqual(_without_timestamp(batch.to_rows()), _without_timestamp(expected))
+
+
+class DedupTest(unittest.TestCase):
+    def test_dedup_matches_full_pricing(self):
+        # "Italy"/"italy" and 100/100.0 are the same input; the hs code and the value tell rows apart
+        rows = [("italy", "india", "food", 100, 10.0, "85"), ("Italy", "india", "food", 100.0, 10, "85"),
+                ("india", "italy", "textiles", 2500.5, None, ""), ("italy", "india", "food", 100, 10.0, "8517"),
+                ("india", "italy", "textiles", 2500.5, None, ""), ("italy", "india", "food", 100.5, 10.0, "85")]
+        schedule = tc.TariffSchedule()
+        schedule.add("italy", "8517", 0.01)
+        stats = tc.DedupStats()
+        with mock.patch.object(tc, "TARIFF_SCHEDULE", schedule):
+            for numpy in (tc._load_numpy(), None):
+                for cents in (False, True):
+                    with self.subTest(numpy=numpy is not None, cents=cents), mock.patch.object(tc, "np", numpy):
+                        columns = [list(col) for col in zip(*rows)]
+                        full = tc.calculate_costs_batch(*columns[:5], hs_codes=columns[5], cents=cents)
+                        batch = tc.calculate_costs_batch(*columns[:5], hs_codes=columns[5], cents=cents, dedup=True)
+                        self.assertIsNone(full.unique)
+                        self.assertEqual(batch.unique, 4)
+                        self.assertEqual(_without_timestamp(batch.to_rows()), _without_timestamp(full.to_rows()))
+                        stats.update(batch)
+        self.assertEqual((stats.rows, stats.unique), (24, 16))
+        self.assertEqual(stats.ratio, 1.5)
+
+
+class RuleSetTest(unittest.TestCase):
+    def setUp(self):
+        self.rules = tc.RuleSet([
+            tc.Rule("fta", 0.5, origin="india", destination="italy", id="eu-india"),
+            tc.Rule("surcharge", 0.02, destination="italy", category="food", min_value=1000),
+            tc.Rule("clearance", 12, category="food", max_value=500, id="small-food"),
+            tc.Rule("surcharge", 0.01, origin="usa"),
+        ])
+        # italy/india/food, then a route only the clearance rule covers
+        self.rows = [("italy", "india", "food", v, 0.0) for v in (100, 500, 999.99, 1000, 5000)]
+        self.rows.append(("germany", "india", "food", 100, 0.0))
+
+    def test_value_bands(self):
+        effects = [self.rules.resolve(o, d, c, v, count=False) for d, o, c, v, _ in self.rows]
+        self.assertEqual([(self.rules.multiplier[s], self.rules.surcharge[s], self.rules.hours[s]) for s in effects],
+                         [(0.5, 0.0, 12.0), (0.5, 0.0, 0.0), (0.5, 0.0, 0.0), (0.5, 0.02, 0.0), (0.5, 0.02, 0.0),
+                          (1.0, 0.0, 12.0)])
+        self.assertEqual(self.rules.plan("india", "italy", "food")[0], [500.0, 1000.0])
+        with mock.patch.object(tc, "RULES", self.rules):
+            quote = tc.TradeCompliance("italy", "india", "food", 1000)
+            self.assertAlmostEqual(quote.duty_rate(), quote.scheduled_duty_rate() * 0.5 + 0.02)
+            small = tc.TradeCompliance("germany", "india", "food", 100)
+            no_rules = small.estimate_clearance_hours(0.0, 0.0, extra_hours=0.0)
+            self.assertEqual(small.estimate_clearance_hours(0.0, 0.0), no_rules + 12)
+        self.assertEqual(self.rules.hits(), {"eu-india": 0, "surcharge:2": 0, "small-food": 0, "surcharge:4": 0})
+
+    def test_hit_counts_on_every_path(self):
+        expected = {"eu-india": 5, "surcharge:2": 2, "small-food": 2, "surcharge:4": 0}
+        with mock.patch.object(tc, "RULES", self.rules):
+            for row in self.rows:
+                tc.TradeCompliance(*row).calculate_costs()
+            self.assertEqual(self.rules.hits(), expected)
+            for numpy in (tc._load_numpy(), None):
+                with self.subTest(numpy=numpy is not None), mock.patch.object(tc, "np", numpy):
+                    self.rules.reset_hits()
+                    tc.calculate_costs_batch(*(list(col) for col in zip(*self.rows)))
+                    self.assertEqual(self.rules.hits(), expected)
+        self.rules.reset_hits()
+        self.rules.merge_hits({"small-food": 3})
+        self.assertEqual(self.rules.hits(), {"eu-india": 0, "surcharge:2": 0, "small-food": 3, "surcharge:4": 0})
+        self.rules.reset_hits()
+        self.assertEqual(set(self.rules.hits().values()), {0})
+
+
+class SimulatorTest(unittest.TestCase):
+    def test_known_answer(self):
+        default, ports = tc.parse_officers("1,b=2")
+        sim = tc.ClearanceSimulator(default, ports)
+        # port a: one officer, each shipment waits for the one before it;
+        # port b: two officers, only the third shipment queues (0.5h -> 2h)
+        sim.feed(["a", "b", "a", "b"], [0.0, 0.0, 1.0, 0.0], [3.0, 2.0, 3.0, 2.0])
+        sim.feed(["b", "a", "b"], [0.5, 2.0, 10.0], [1.0, 3.0, 1.0])
+        self.assertEqual([tuple(row.values()) for row in sim.rows()], [
+            ("a", 1, 3, 9.0, 8.0, 1.0, 0.6667, 2, 2.0, 2.0, 4.0, 4.0, 4.0),
+            ("b", 2, 4, 11.0, 8.73, 0.2727, 0.1364, 1, 0.375, 0.0, 1.5, 1.5, 1.5),
+        ])
+        self.assertEqual(list(next(sim.rows())), list(tc.SIM_FIELDS))
+        with self.assertRaisesRegex(ValueError, "time order"):
+            sim.feed(["a"], [1.5], [1.0])
+
+
+class CrashAfter(Exception):
+    pass
+
+
+def _price_then_crash(limit):
+    """price_shipments() that raises on its (limit + 1)-th call, like a killed run."""
+    real = tc.price_shipments
+    calls = [0]
+
+    def price(*args, **kwargs):
+        calls[0] += 1
+        if calls[0] > limit:
+            raise CrashAfter()
+        return real(*args, **kwargs)
+    return price
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.input = self.path("in.csv")
+        with open(self.input, "w", encoding="utf-8") as fh:
+            fh.write("destination,category,value,shipping\n")
+            for i in range(1000):
+                dest = "atlantis" if i % 97 == 0 else ("italy", "india")[i % 2]
+                fh.write(f"{dest},{('food', 'textiles', 'electronics')[i % 3]},{100 + i}.5,{i % 40}\n")
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def run_cli(self, *argv):
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            return tc.main(["--input", self.input, "--chunk-size", "100", *argv])
+
+    def read(self, name):
+        # drop the per-batch timestamp column
+        with open(self.path(name), encoding="utf-8") as fh:
+            return [line.split(",", 1)[1] for line in fh]
+
+    def check_resume(self, rows, *extra):
+        self.run_cli("--csv", self.path("full.csv"), *extra)
+        full = self.read("full.csv")
+        checkpoint = self.path("ck.json")
+        argv = ["--csv", self.path("part.csv"), "--checkpoint", checkpoint, "--checkpoint-every", "250",
+                "--resume", *(a.replace("full", "part") for a in extra)]
+        with mock.patch.object(tc, "price_shipments", _price_then_crash(6)):
+            with self.assertRaises(CrashAfter):
+                self.run_cli(*argv)
+        self.assertTrue(os.path.exists(checkpoint))
+        self.assertGreater(len(self.read("part.csv")), 1)
+        self.assertEqual(self.run_cli(*argv), 0)
+        self.assertFalse(os.path.exists(checkpoint))
+        self.assertEqual(self.read("part.csv"), full)
+        self.assertEqual(len(full), 1 + rows)
+
+    def test_resume(self):
+        self.check_resume(1000)
+
+    def test_resume_validated_without_rejects(self):
+        self.check_resume(1000 - 11, "--validate")
+
+    def test_resume_with_rejects(self):
+        self.check_resume(1000 - 11, "--rejects", self.path("full.jsonl"))
+        with open(self.path("full.jsonl"), encoding="utf-8") as a, \
+                open(self.path("part.jsonl"), encoding="utf-8") as b:
+            self.assertEqual(a.read(), b.read())
+
+
+class WorkerRatesTest(unittest.TestCase):
+    def test_spawned_workers_use_the_callers_rates(self):
+        spawn = functools.partial(ProcessPoolExecutor, mp_context=multiprocessing.get_context("spawn"))
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "in.csv")
+            with open(src, "w", encoding="utf-8") as fh:
+                fh.write("destination,category,value\n")
+                fh.writelines(f"{('italy', 'india')[i % 2]},food,{100 + i}\n" for i in range(40))
+            outputs = []
+            for workers in ("1", "2"):
+                out = os.path.join(tmp, f"out{workers}.csv")
+                with mock.patch.object(tc, "COMPLIANCE_FEE_RATE", 0.05), \
+                        mock.patch.object(tc, "CATEGORY_CLEARANCE_HOURS", {"food": 48.0}), \
+                        mock.patch("concurrent.futures.ProcessPoolExecutor", spawn), \
+                        contextlib.redirect_stderr(io.StringIO()):
+                    tc.main(["--input", src, "--csv", out, "--workers", workers, "--chunk-size", "10"])
+                with open(out, encoding="utf-8") as fh:
+                    outputs.append([line.split(",", 1)[1] for line in fh])
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn(",5.0,", outputs[1][1])  # fee on a value of 100
+
+
+class RejectRecordTest(unittest.TestCase):
+    def test_record_numbers_skip_blank_lines_with_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "in.csv")
+            with open(src, "w", encoding="utf-8") as fh:
+                fh.write("destination,category,value\nitaly,food,1\natlantis,food,1\n\nitaly,food,-1\n"
+                         "italy,weapons,1\n\n\nitaly,food,2\nmars,food,3\n")
+            records = []
+            for workers in ("1", "2"):
+                rejects = os.path.join(tmp, f"rejects{workers}.jsonl")
+                with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                    tc.main(["--input", src, "--csv", os.path.join(tmp, "out.csv"), "--rejects", rejects,
+                             "--workers", workers, "--chunk-size", "3"])
+                with open(rejects, encoding="utf-8") as fh:
+                    records.append([json.loads(line)["record"] for line in fh])
+            self.assertEqual(records, [[2, 3, 4, 6]] * 2)
+
+    def test_impossible_dates_are_rejected(self):
+        fx = tc.FxRates("EUR")
+        fx.add("2024-01-01", "INR", 90.0)
+        rows = [{"destination": "india", "value": 1, "date": day}
+                for day in ("2024-13-99", "2024-02-30", "2024-02-29", "2024-03-01T10:00:00Z", "15/03/2024")]
+        with mock.patch.object(tc, "FX_RATES", fx):
+            valid, rejected = tc.validate_shipments(rows)
+        self.assertEqual([(record, reasons) for record, reasons, _ in rejected],
+                         [(1, ["invalid_date"]), (2, ["invalid_date"]), (5, ["invalid_date"])])
+        self.assertEqual(len(valid), 2)
+        with self.assertRaises(ValueError):
+            fx.add("2023-02-29", "INR", 91.0)
+
+
+class RollupTest(unittest.TestCase):
+    def test_numpy_and_pure_python_agree(self):
+        shipments = [{"destination": ("italy", "India")[i % 2], "category": ("food", "textiles")[i % 3 > 0],
+                      "value": 100 + i, "date": f"2024-0{1 + i % 3}-15"} for i in range(60)]
+        results = []
+        for numpy in (tc._load_numpy(), None):
+            with mock.patch.object(tc, "np", numpy):
+                batch = tc.price_shipments(shipments)
+                rollup = tc.GroupAggregator(("destination", "currency", "month"))
+                rollup.update(batch, shipments)
+                results.append(list(rollup.rows()))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual({(r["destination"], r["currency"]) for r in results[0]},
+                         {("italy", "EUR"), ("india", "INR")})
+
+
+class QuoteServerTest(unittest.TestCase):
+    def post(self, body: bytes) -> tuple:
+        async def run():
+            server = tc.QuoteServer(port=0)
+            host, port = await server.start()
+            try:
+                reader, writer = await asyncio.open_connection(host, port)
+                writer.write(b"POST /quote HTTP/1.1\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                             % len(body) + body)
+                response = await reader.read()
+                writer.close()
+                return response
+            finally:
+                await server.close()
+        head, _, payload = asyncio.run(run()).partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(payload)
+
+    def test_non_finite_and_negative_amounts_are_rejected(self):
+        for body in (b'{"value": NaN}', b'{"value": "Infinity"}', b'{"value": -5}', b'{"shipping": -1}'):
+            status, payload = self.post(body)
+            self.assertEqual(status, 400, body)
+            self.assertIn("finite, non-negative", payload["error"])
+
+    def test_quote(self):
+        status, payload = self.post(b'{"destination": "india", "value": 1000, "shipping": 50}')
+        self.assertEqual(status, 200)
+        self.assertEqual(payload["total_landed_cost"], 1298.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
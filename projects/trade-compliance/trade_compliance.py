@@ -6,19 +6,126 @@ Minimal, self-contained TradeCompliance module + CLI for demo and download.
 - calculate costs (import duty, tax, shipping, compliance fee, total landed cost)
 - estimate clearance hours (simple heuristic)
 - supports single-run CLI, batch demo, JSON/CSV export
+- columnar batch pricing (NumPy when available, pure Python otherwise)
+- streaming CSV / JSON Lines input (--input), priced in fixed-size chunks
+- multi-process batch pricing (--workers), ordered or --unordered output
+- HS-code tariff schedules with longest-prefix duty lookup (--tariffs)
+- compiled, memory-mapped binary rate files (--compile-rates / --rates)
+- optional LRU quote cache, invalidated whenever the rate tables change
+- compact slotted Shipment records and array-backed ShipmentBatch storage
+- asyncio HTTP quoting service with request micro-batching (--http)
+- stage timers, counters and Prometheus/JSON metrics (--profile, --metrics-out)
+- SQLite book of priced shipments with delta re-pricing (--store, --reprice)
+- lazy, vectorized what-if grids with min/max/argmin reductions (--sweep)
+- streaming, mergeable group-by rollups per destination/category/month (--rollup)
+- exact integer minor-unit (cents) pricing with basis-point rates (--cents)
+- Unix-socket daemon with warm rate tables (--serve); with
+  TRADE_COMPLIANCE_SOCKET set, trade_compliance_client.py forwards single
+  quotes to it and falls back to running in-process when no daemon answers
+- dated FX tables with as-of lookup and reporting-currency columns (--fx-rates)
+- declarative FTA / surcharge / clearance rules compiled to dispatch tables (--rules)
+- discrete-event customs queue simulation per port (--simulate, --officers)
+- checkpointed --input runs that pick up where they stopped (--checkpoint, --resume)
+- column-wise input validation with a reject file of reason codes (--validate, --rejects)
+- compact quote tables for the static web calculator, app.js (--export-bundle)
 """
 
 from __future__ import annotations
 import argparse
+import base64
+import bisect
+import collections
+import contextlib
 import csv
+import hashlib
+import heapq
+import io
+import itertools
 import json
+import math
+import os
+import re
+import struct
+import sys
+import time
+import traceback
+from array import array
 from dataclasses import dataclass, asdict
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Iterable, Iterator, Optional, Sequence
+
+# Socket of a --serve daemon; read by trade_compliance_client.py
+SOCKET_ENV = "TRADE_COMPLIANCE_SOCKET"
+
+# Optional: vectorized batch pricing. Imported by _load_numpy() when the
+# first batch is priced, so single quotes do not pay for it.
+np = None
+_NUMPY_TRIED = False
+
+
+def _load_numpy():
+    """Import NumPy into `np` once; returns None when it is not installed."""
+    global np, _NUMPY_TRIED
+    if not _NUMPY_TRIED:
+        _NUMPY_TRIED = True
+        try:
+            import numpy
+        except ImportError:  # pragma: no cover - falls back to pure Python
+            return None
+        np = numpy
+    return np
+
+# Bumped on every rate-table change; part of rates_version()
+_RATES_VERSION = 0
+
+
+def _rates_changed():
+    global _RATES_VERSION
+    _RATES_VERSION += 1
+
+
+class _VersionedDict(dict):
+    """dict that bumps the rate-table version on mutation (reads stay native)."""
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        _rates_changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        _rates_changed()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        _rates_changed()
+
+    def setdefault(self, key, default=None):
+        _rates_changed()
+        return super().setdefault(key, default)
+
+    def pop(self, *args):
+        _rates_changed()
+        return super().pop(*args)
+
+    def popitem(self):
+        _rates_changed()
+        return super().popitem()
+
+    def clear(self):
+        super().clear()
+        _rates_changed()
+
 
 # Demo rates (replace with authoritative data as needed)
-DUTY_RATES: Dict[tuple, float] = {
+# Category duty of the web calculator's other destinations (they had no per-country rates)
+_BASE_DUTY_RATES = {"textiles": 0.12, "machinery": 0.07, "pharmaceuticals": 0.03,
+                    "automotive": 0.10, "food": 0.15, "electronics": 0.05}
+DUTY_RATES: Dict[tuple, float] = _VersionedDict({
     ("italy", "textiles"): 0.10,
     ("italy", "machinery"): 0.07,
     ("italy", "pharmaceuticals"): 0.05,
@@ -31,17 +138,953 @@ DUTY_RATES: Dict[tuple, float] = {
     ("india", "automotive"): 0.06,
     ("india", "food"): 0.12,
     ("india", "electronics"): 0.05,
-}
-TAX_RATES = {"italy": 0.22, "india": 0.18}
-CURRENCY = {"italy": "EUR", "india": "INR"}
+    **{(dest, cat): rate for dest in ("usa", "china", "japan", "germany", "uk", "france", "brazil", "canada")
+       for cat, rate in _BASE_DUTY_RATES.items()},
+})
+TAX_RATES = _VersionedDict({"italy": 0.22, "india": 0.18, "usa": 0.10, "china": 0.13, "japan": 0.10,
+                            "germany": 0.19, "uk": 0.20, "france": 0.20, "brazil": 0.25, "canada": 0.05})
+CURRENCY = _VersionedDict({"italy": "EUR", "india": "INR", "usa": "USD", "china": "CNY", "japan": "JPY",
+                           "germany": "EUR", "uk": "GBP", "france": "EUR", "brazil": "BRL", "canada": "CAD"})
 DEFAULT_DUTY = 0.05
 COMPLIANCE_FEE_RATE = 0.02
+DEFAULT_CHUNK_SIZE = 50_000
+# Extra clearance hours per product category (used by estimate_clearance_hours)
+CATEGORY_CLEARANCE_HOURS = _VersionedDict({
+    "pharmaceuticals": 24.0,
+    "automotive": 24.0,
+    "machinery": 12.0,
+    "electronics": 4.0,
+})
+# HS-code schedule loaded with load_tariff_schedule(); None = DUTY_RATES only
+TARIFF_SCHEDULE: Optional["TariffSchedule"] = None
+# Compiled rate file loaded with load_rate_file(); replaces the dicts above
+RATE_FILE: Optional["MappedRates"] = None
+# Optional LRU cache used by calculate_costs(); see enable_quote_cache()
+QUOTE_CACHE: Optional["QuoteCache"] = None
+# Compiled FTA/surcharge/clearance rules loaded with load_rules(); None = no rules
+RULES: Optional["RuleSet"] = None
+# Dated exchange rates loaded with load_fx_rates(); None = no reporting columns
+FX_RATES: Optional["FxRates"] = None
+# Currency of the reporting_* columns; None = the FX table's base currency
+REPORTING_CURRENCY: Optional[str] = None
+# Loaded rate/tariff files by (kind, path, mtime, size); only --serve sets it
+_WARM_TABLES: Optional[Dict[tuple, Any]] = None
+# Instrumentation sink; None (the default) keeps every probe a single check
+METRICS: Optional["Metrics"] = None
+# Column order of calculate_costs() results
+COST_FIELDS = (
+    "timestamp", "origin", "destination", "product_category", "currency",
+    "shipment_value", "shipping_cost", "duty_rate", "import_duty", "tax_rate",
+    "tax", "base_compliance_fee", "total_landed_cost", "estimated_clearance_hours",
+)
+# Amounts converted to the reporting currency when FX_RATES is set
+FX_AMOUNTS = ("shipment_value", "shipping_cost", "import_duty", "tax", "base_compliance_fee", "total_landed_cost")
+# Columns appended after COST_FIELDS when FX_RATES is set
+FX_FIELDS = ("reporting_currency", "fx_rate") + tuple(f"reporting_{k}" for k in FX_AMOUNTS)
 
 def _round(v, n=2):
     return round(float(v), n)
 
+# Integer mode (--cents): amounts in minor units, rates in basis points
+MINOR_UNITS = 100
+BASIS_POINTS = 10_000
+
+
+def to_minor_units(amount) -> int:
+    """Amount in cents/paise, halves rounded up."""
+    return math.floor(float(amount or 0.0) * MINOR_UNITS + 0.5)
+
+
+def to_basis_points(rate) -> int:
+    return math.floor(float(rate) * BASIS_POINTS + 0.5)
+
+
+def _div_round(n, d):
+    # n / d rounded half up, in integers; also works elementwise on int arrays
+    return (2 * n + d) // (2 * d)
+
+_NOW = (None, "")
+
 def now_iso():
-    return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    # formatted once per second; same output as utcnow() without microseconds
+    global _NOW
+    t = int(time.time())
+    if t != _NOW[0]:
+        _NOW = (t, datetime.utcfromtimestamp(t).isoformat() + "Z")
+    return _NOW[1]
+
+
+# --- instrumentation ----------------------------------------------------------
+
+class _StageTimer:
+    __slots__ = ("metrics", "name", "rows", "start")
+
+    def __init__(self, metrics: "Metrics", name: str, rows: int):
+        self.metrics = metrics
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add(self.name, time.perf_counter() - self.start, self.rows)
+        return False
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Metrics:
+    """Per-stage timers, row counters and throughput for one run.
+
+    Stages: read (input parsing), factorize, rules, dedup and scatter
+    (with dedup=True), rates (duty/tax/tariff lookups), clearance, round,
+    fx, timestamp, render and write.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, list] = {}
+        self.counters: Dict[str, int] = collections.Counter()
+        self._hooks: List[Any] = []
+
+    def add(self, stage: str, seconds: float, rows: int = 0, calls: int = 1):
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0.0, 0, 0]
+        entry[0] += seconds
+        entry[1] += calls
+        entry[2] += rows
+
+    def lap(self, stage: str, start: float, rows: int = 0) -> float:
+        now = time.perf_counter()
+        self.add(stage, now - start, rows)
+        return now
+
+    def stage(self, name: str, rows: int = 0) -> _StageTimer:
+        return _StageTimer(self, name, rows)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] += n
+
+    def merge(self, snapshot: Dict[str, Any]):
+        """Fold in a snapshot() taken in another process (e.g. a pool worker)."""
+        for name, st in snapshot["stages"].items():
+            self.add(name, st["seconds"], st["rows"], st["calls"])
+        for name, n in snapshot["counters"].items():
+            self.count(name, n)
+        if snapshot.get("rule_hits") and RULES is not None:
+            RULES.merge_hits(snapshot["rule_hits"])
+
+    def subscribe(self, hook):
+        """Call hook(snapshot) from publish(), e.g. after every batch chunk."""
+        self._hooks.append(hook)
+
+    def publish(self):
+        if self._hooks:
+            snap = self.snapshot()
+            for hook in self._hooks:
+                hook(snap)
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        timed = sum(e[0] for e in self.stages.values()) or 1.0
+        rows = self.counters.get("rows", 0)
+        return {
+            "elapsed_seconds": elapsed,
+            "rows": rows,
+            "rows_per_second": rows / elapsed if elapsed else 0.0,
+            "stages": {name: {"seconds": e[0], "calls": e[1], "rows": e[2], "share": e[0] / timed}
+                       for name, e in sorted(self.stages.items(), key=lambda kv: -kv[1][0])},
+            "counters": dict(self.counters),
+            "quote_cache": QUOTE_CACHE.stats() if QUOTE_CACHE is not None else None,
+            "rule_hits": RULES.hits() if RULES is not None else None,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = "trade_compliance") -> str:
+        snap = self.snapshot()
+        out = []
+
+        def metric(name, kind, help_text, samples):
+            out.append(f"# HELP {prefix}_{name} {help_text}")
+            out.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                out.append(f"{prefix}_{name}{labels} {value!r}")
+
+        stages = snap["stages"].items()
+        metric("stage_seconds_total", "counter", "Time spent per pipeline stage.",
+               [(f'{{stage="{n}"}}', st["seconds"]) for n, st in stages])
+        metric("stage_calls_total", "counter", "Timed calls per pipeline stage.",
+               [(f'{{stage="{n}"}}', st["calls"]) for n, st in stages])
+        metric("stage_rows_total", "counter", "Rows processed per pipeline stage.",
+               [(f'{{stage="{n}"}}', st["rows"]) for n, st in stages])
+        metric("events_total", "counter", "Event counters.",
+               [(f'{{event="{n}"}}', v) for n, v in snap["counters"].items()])
+        metric("rows_per_second", "gauge", "Rows priced per second since start.", [("", snap["rows_per_second"])])
+        metric("elapsed_seconds", "gauge", "Seconds since metrics were enabled.", [("", snap["elapsed_seconds"])])
+        cache = snap["quote_cache"]
+        if cache is not None:
+            metric("quote_cache_events_total", "counter", "Quote cache lookups by outcome.",
+                   [(f'{{outcome="{k}"}}', cache[k]) for k in ("hits", "misses", "evictions", "invalidations")])
+            metric("quote_cache_hit_ratio", "gauge", "Quote cache hit ratio.", [("", cache["hit_rate"])])
+        if snap["rule_hits"] is not None:
+            metric("rule_hits_total", "counter", "Evaluations each pricing rule applied to.",
+                   [(f'{{rule="{k}"}}', v) for k, v in snap["rule_hits"].items()])
+        return "\n".join(out) + "\n"
+
+    def dump(self, path: str):
+        """Write JSON for *.json paths, Prometheus text otherwise."""
+        text = self.to_json() if path.endswith(".json") else self.to_prometheus()
+        Path(path).write_text(text, encoding="utf-8")
+
+    def report(self) -> str:
+        snap = self.snapshot()
+        lines = [
+            "Profile",
+            "----------------------------------------",
+            f"{'stage':12s} {'seconds':>10s} {'share':>7s} {'calls':>10s} {'rows':>12s}",
+        ]
+        for name, st in snap["stages"].items():
+            lines.append(f"{name:12s} {st['seconds']:>10.4f} {st['share']:>7.1%} {st['calls']:>10,} {st['rows']:>12,}")
+        lines.append("----------------------------------------")
+        lines.append(f"elapsed {snap['elapsed_seconds']:.4f}s, {snap['rows']:,} rows, "
+                     f"{snap['rows_per_second']:,.0f} rows/s")
+        for name, n in snap["counters"].items():
+            if name != "rows":
+                lines.append(f"{name}: {n:,}")
+        if snap["quote_cache"] is not None:
+            c = snap["quote_cache"]
+            lines.append(f"quote cache: {c['hits']:,} hits, {c['misses']:,} misses, hit rate {c['hit_rate']:.1%}")
+        if snap["rule_hits"]:
+            for rule_id, n in sorted(snap["rule_hits"].items(), key=lambda kv: -kv[1]):
+                if n:
+                    lines.append(f"rule {rule_id}: {n:,} hits")
+        return "\n".join(lines)
+
+
+def enable_metrics() -> Metrics:
+    global METRICS
+    METRICS = Metrics()
+    return METRICS
+
+
+def disable_metrics():
+    global METRICS
+    METRICS = None
+
+
+def stage(name: str, rows: int = 0):
+    """Context manager timing a stage; a shared no-op when metrics are off."""
+    return _NULL_STAGE if METRICS is None else _StageTimer(METRICS, name, rows)
+
+
+def rates_version() -> tuple:
+    """Token that changes whenever any table feeding calculate_costs() changes."""
+    return (_RATES_VERSION, id(DUTY_RATES), id(TAX_RATES), id(CURRENCY), id(CATEGORY_CLEARANCE_HOURS),
+            id(TARIFF_SCHEDULE), id(RATE_FILE), id(RULES), DEFAULT_DUTY, COMPLIANCE_FEE_RATE)
+
+def _normalize_hs(code) -> str:
+    # "8471.30.00" / 84713000 -> "84713000"
+    return "".join(ch for ch in str(code) if ch.isdigit()) if code else ""
+
+
+class TariffSchedule:
+    """Per-destination HS-code duty rates with longest-prefix lookup.
+
+    Each destination maps prefixes (2/4/6/8/10 digits, or any other length)
+    to a rate in a plain dict, and lookup() probes the known prefix lengths
+    longest first, so it costs at most one dict hit per distinct length.
+    """
+
+    def __init__(self):
+        self._rates: Dict[str, Dict[str, float]] = {}
+        self._lengths: Dict[str, tuple] = {}
+
+    def __len__(self) -> int:
+        return sum(len(t) for t in self._rates.values())
+
+    def add(self, destination: str, hs_code, rate: float):
+        code = _normalize_hs(hs_code)
+        if not code:
+            raise ValueError(f"invalid HS code {hs_code!r}")
+        dest = (destination or "italy").lower()
+        self._rates.setdefault(dest, {})[code] = float(rate)
+        lengths = self._lengths.get(dest, ())
+        if len(code) not in lengths:
+            self._lengths[dest] = tuple(sorted(lengths + (len(code),), reverse=True))
+        _rates_changed()
+
+    def lookup(self, destination: str, hs_code: str) -> Optional[float]:
+        """Rate of the longest matching prefix of a normalized code, else None."""
+        table = self._rates.get(destination)
+        if table is None or not hs_code:
+            return None
+        for n in self._lengths[destination]:
+            if n <= len(hs_code):
+                rate = table.get(hs_code[:n])
+                if rate is not None:
+                    return rate
+        return None
+
+    def destinations(self) -> set:
+        return set(self._rates)
+
+    def items(self) -> Iterator[tuple]:
+        for dest, table in self._rates.items():
+            for code, rate in table.items():
+                yield dest, code, rate
+
+    @classmethod
+    def load(cls, path: str, fmt: Optional[str] = None) -> "TariffSchedule":
+        """Read destination,hs_code,rate rows from CSV or JSON Lines."""
+        schedule = cls()
+        for row in _read_records(path, fmt):
+            schedule.add(row.get("destination"), row.get("hs_code"), row["rate"])
+        return schedule
+
+
+def _warm(kind: str, path: str, load):
+    """load(), or the table a --serve daemon already loaded from the same file."""
+    if _WARM_TABLES is None or path == "-":
+        return load()
+    st = os.stat(path)
+    key = (kind, os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    table = _WARM_TABLES.get(key)
+    if table is None:
+        for stale in [k for k in _WARM_TABLES if k[:2] == key[:2]]:
+            del _WARM_TABLES[stale]
+        table = _WARM_TABLES[key] = load()
+    return table
+
+
+def load_tariff_schedule(path: str, fmt: Optional[str] = None) -> TariffSchedule:
+    global TARIFF_SCHEDULE
+    TARIFF_SCHEDULE = _warm(f"tariffs:{fmt}", path, lambda: TariffSchedule.load(path, fmt))
+    _rates_changed()
+    return TARIFF_SCHEDULE
+
+
+# --- compiled rate files ------------------------------------------------------
+#
+# Layout (little-endian, every section 8-byte aligned):
+#   header    magic, version, default duty, string count and section offsets
+#   strings   (offset u32, length u32) index + UTF-8 blob; id 0 is unused
+#   tax       f64[n_strings + 1], NaN where a destination has no tax rate
+#   currency  u32[n_strings + 1], string id of the currency, 0 = none
+#   duty      open-addressing table keyed on dest_id << 32 | category_id
+#   tariffs   (offset u64, bits u32, length mask u32)[n_strings + 1] per
+#             destination, each pointing at a table keyed on
+#             len(prefix) << 60 | int(prefix)
+# A hash table of 2**bits slots stores u64 keys (0 = empty) followed by
+# f64 values and is probed linearly from a Fibonacci hash of the key.
+
+RATE_FILE_MAGIC = b"TCRB"
+RATE_FILE_VERSION = 1
+_RATE_HEADER = struct.Struct("<4sHHdIIQQQQQ")
+_TARIFF_DIR = struct.Struct("<QII")
+_MAX_HS_DIGITS = 15
+
+
+def _hash_slot(key: int, bits: int) -> int:
+    return ((key * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> (64 - bits)
+
+
+def _pack_hash_table(items: Dict[int, float]) -> tuple:
+    bits = max(1, (2 * len(items) - 1).bit_length())
+    mask = (1 << bits) - 1
+    keys = [0] * (mask + 1)
+    values = [0.0] * (mask + 1)
+    for key, value in items.items():
+        i = _hash_slot(key, bits)
+        while keys[i]:
+            i = (i + 1) & mask
+        keys[i] = key
+        values[i] = value
+    return bits, struct.pack(f"<{mask + 1}Q", *keys) + struct.pack(f"<{mask + 1}d", *values)
+
+
+def _probe(keys, values, bits: int, key: int) -> Optional[float]:
+    mask = (1 << bits) - 1
+    i = _hash_slot(key, bits)
+    while True:
+        k = keys[i]
+        if k == key:
+            return values[i]
+        if not k:
+            return None
+        i = (i + 1) & mask
+
+
+def _hs_key(code: str) -> int:
+    return (len(code) << 60) | int(code)
+
+
+def compile_rates(path: str, tariffs: Optional[TariffSchedule] = None) -> int:
+    """Write the current rate tables (plus an optional schedule) to a binary file."""
+    strings: Dict[str, int] = {}
+
+    def intern(v: str) -> int:
+        return strings.setdefault(v, len(strings) + 1)
+
+    duty = {(intern(d) << 32) | intern(c): float(r) for (d, c), r in DUTY_RATES.items()}
+    taxes = {intern(d): float(r) for d, r in TAX_RATES.items()}
+    currencies = {intern(d): intern(c) for d, c in CURRENCY.items()}
+    schedule: Dict[int, Dict[int, float]] = {}
+    for dest, code, rate in (tariffs.items() if tariffs is not None else ()):
+        if len(code) > _MAX_HS_DIGITS:
+            raise ValueError(f"HS code {code!r} longer than {_MAX_HS_DIGITS} digits")
+        schedule.setdefault(intern(dest), {})[_hs_key(code)] = rate
+    n = len(strings)
+
+    body = bytearray(b"\0" * _RATE_HEADER.size)
+
+    def section(data: bytes) -> int:
+        body.extend(b"\0" * (-len(body) % 8))
+        offset = len(body)
+        body.extend(data)
+        return offset
+
+    blob = [s.encode("utf-8") for s in strings]
+    index, pos = [], 0
+    for b in blob:
+        index += [pos, len(b)]
+        pos += len(b)
+    strings_off = section(struct.pack(f"<{2 * n}I", *index) + b"".join(blob))
+    tax_off = section(struct.pack(f"<{n + 1}d", *(taxes.get(i, math.nan) for i in range(n + 1))))
+    currency_off = section(struct.pack(f"<{n + 1}I", *(currencies.get(i, 0) for i in range(n + 1))))
+    duty_bits, duty_table = _pack_hash_table(duty)
+    duty_off = section(duty_table)
+    directory = [(0, 0, 0)] * (n + 1)
+    for dest_id, table in schedule.items():
+        bits, packed = _pack_hash_table(table)
+        lengths = 0
+        for key in table:
+            lengths |= 1 << (key >> 60)
+        directory[dest_id] = (section(packed), bits, lengths)
+    tariff_off = section(b"".join(_TARIFF_DIR.pack(*e) for e in directory))
+    _RATE_HEADER.pack_into(body, 0, RATE_FILE_MAGIC, RATE_FILE_VERSION, duty_bits, DEFAULT_DUTY,
+                           n, len(schedule), strings_off, tax_off, currency_off, duty_off, tariff_off)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(body)
+    os.replace(tmp, path)
+    return len(body)
+
+
+class MappedRates:
+    """Read-only view of a compile_rates() file through mmap.
+
+    Only the small string index is decoded on open; rates are read straight
+    from the mapped pages, so worker processes share one page-cached copy.
+    Also serves as a TARIFF_SCHEDULE when the file carries HS-code lines.
+    """
+
+    def __init__(self, path: str):
+        import mmap
+        self.path = path
+        with open(path, "rb") as fh:
+            self._mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, self._duty_bits, self.default_duty, n, self.tariff_destinations,
+             strings_off, tax_off, currency_off, duty_off, tariff_off) = _RATE_HEADER.unpack_from(self._mm, 0)
+        except struct.error:
+            magic, version = b"", 0
+        if magic != RATE_FILE_MAGIC or version != RATE_FILE_VERSION:
+            raise ValueError(f"{path} is not a version {RATE_FILE_VERSION} compiled rate file")
+        mv = memoryview(self._mm)
+        index = struct.unpack_from(f"<{2 * n}I", self._mm, strings_off)
+        blob = strings_off + 8 * n
+        self._names = [""] + [bytes(mv[blob + index[2 * i]:blob + index[2 * i] + index[2 * i + 1]]).decode("utf-8")
+                              for i in range(n)]
+        self._ids = {name: i for i, name in enumerate(self._names) if i}
+        self._tax = mv[tax_off:tax_off + 8 * (n + 1)].cast("d")
+        self._currency = mv[currency_off:currency_off + 4 * (n + 1)].cast("I")
+        self._duty = self._table(mv, duty_off, self._duty_bits)
+        self._tariffs: Dict[int, tuple] = {}
+        for i in range(1, n + 1):
+            offset, bits, lengths = _TARIFF_DIR.unpack_from(self._mm, tariff_off + _TARIFF_DIR.size * i)
+            if offset:
+                order = tuple(k for k in range(_MAX_HS_DIGITS, 0, -1) if lengths >> k & 1)
+                self._tariffs[i] = self._table(mv, offset, bits) + (bits, order)
+
+    @staticmethod
+    def _table(mv, offset: int, bits: int) -> tuple:
+        size = 8 << bits
+        return mv[offset:offset + size].cast("Q"), mv[offset + size:offset + 2 * size].cast("d")
+
+    def __reduce__(self):
+        # workers re-map the same file instead of receiving a pickled copy
+        return MappedRates, (self.path,)
+
+    def duty(self, destination: str, category: str) -> float:
+        d = self._ids.get(destination)
+        c = self._ids.get(category)
+        if d is not None and c is not None:
+            rate = _probe(*self._duty, self._duty_bits, (d << 32) | c)
+            if rate is not None:
+                return rate
+        return self.default_duty
+
+    def tax(self, destination: str) -> float:
+        d = self._ids.get(destination)
+        rate = self._tax[d] if d is not None else math.nan
+        return 0.0 if rate != rate else rate
+
+    def currency(self, destination: str) -> str:
+        d = self._ids.get(destination)
+        return self._names[self._currency[d]] if d is not None and self._currency[d] else "USD"
+
+    def destinations(self) -> set:
+        """Names with a tax rate, currency, duty or HS-code schedule of their own."""
+        keys = self._duty[0]
+        ids = {k >> 32 for k in keys if k} | set(self._tariffs)
+        ids.update(i for i in range(1, len(self._names)) if self._tax[i] == self._tax[i] or self._currency[i])
+        return {self._names[i] for i in ids}
+
+    def categories(self) -> set:
+        return {self._names[k & 0xFFFFFFFF] for k in self._duty[0] if k}
+
+    def lookup(self, destination: str, hs_code: str) -> Optional[float]:
+        """Same contract as TariffSchedule.lookup()."""
+        entry = self._tariffs.get(self._ids.get(destination))
+        if entry is None or not hs_code or len(hs_code) > _MAX_HS_DIGITS:
+            return None
+        keys, values, bits, order = entry
+        for n in order:
+            if n <= len(hs_code):
+                rate = _probe(keys, values, bits, (n << 60) | int(hs_code[:n]))
+                if rate is not None:
+                    return rate
+        return None
+
+
+def load_rate_file(path: str) -> MappedRates:
+    global RATE_FILE, TARIFF_SCHEDULE
+    RATE_FILE = _warm("rates", path, lambda: MappedRates(path))
+    if RATE_FILE.tariff_destinations:
+        TARIFF_SCHEDULE = RATE_FILE
+    _rates_changed()
+    return RATE_FILE
+
+
+# --- FX conversion ------------------------------------------------------------
+#
+# FX files hold date,currency,rate rows (CSV or JSON Lines), where rate is
+# units of the currency per unit of the table's base currency; an optional
+# base column names it (default FX_BASE). A quote is converted at the
+# latest rate on or before its date, so weekends and holidays need no rows.
+
+FX_BASE = "USD"
+FX_CACHE_SIZE = 65536
+
+
+def _fx_date(value) -> str:
+    # "2024-03-15", "2024-03-15T10:00:00Z", date/datetime -> "2024-03-15"
+    return str(value)[:10] if value else ""
+
+
+class FxRates:
+    """Date-indexed exchange rates against one base currency.
+
+    Each currency keeps its dates sorted (ISO strings order like dates)
+    alongside its rates, so an as-of lookup is a bisect. Cross rates are
+    cached per (from, to, date) until the table changes.
+    """
+
+    def __init__(self, base: str = FX_BASE):
+        self.base = base.upper()
+        self._dates: Dict[str, List[str]] = {}
+        self._rates: Dict[str, List[float]] = {}
+        self._cross: Dict[tuple, float] = {}
+
+    def __len__(self) -> int:
+        return sum(len(d) for d in self._dates.values())
+
+    def currencies(self) -> List[str]:
+        return sorted(set(self._dates) | {self.base})
+
+    def add(self, date, currency: str, rate: float):
+        day = _fx_date(date)
+        code = (currency or "").upper()
+        rate = float(rate)
+        if not day or not code:
+            raise ValueError(f"FX row needs a date and a currency, got {date!r}, {currency!r}")
+        if not _is_date(day):
+            raise ValueError(f"invalid FX date {date!r}")
+        if not rate > 0:
+            raise ValueError(f"invalid {code} rate {rate!r} on {day}")
+        if code == self.base:
+            if rate != 1.0:
+                raise ValueError(f"base currency {code} must have rate 1, got {rate!r}")
+            return
+        dates = self._dates.setdefault(code, [])
+        rates = self._rates.setdefault(code, [])
+        i = bisect.bisect_left(dates, day)
+        if i < len(dates) and dates[i] == day:
+            rates[i] = rate
+        else:  # files are usually sorted, so this is mostly an append
+            dates.insert(i, day)
+            rates.insert(i, rate)
+        self._cross.clear()
+
+    def rate(self, currency: str, date) -> float:
+        """Units of `currency` per unit of base on the latest date <= date."""
+        code = currency.upper()
+        if code == self.base:
+            return 1.0
+        day = _fx_date(date)
+        dates = self._dates.get(code, ())
+        i = bisect.bisect_right(dates, day) - 1
+        if i < 0:
+            raise ValueError(f"no {code} rate on or before {day}")
+        return self._rates[code][i]
+
+    def cross_rate(self, source: str, target: str, date) -> float:
+        """Factor converting `source` amounts to `target` as of `date`."""
+        key = (source, target, date)
+        factor = self._cross.get(key)
+        if factor is None:
+            if len(self._cross) >= FX_CACHE_SIZE:
+                self._cross.clear()
+            factor = self._cross[key] = self.rate(target, date) / self.rate(source, date)
+        return factor
+
+    @classmethod
+    def load(cls, path: str, fmt: Optional[str] = None) -> "FxRates":
+        table = None
+        for row in _read_records(path, fmt):
+            base = (row.get("base") or FX_BASE).upper()
+            if table is None:
+                table = cls(base)
+            elif base != table.base:
+                raise ValueError(f"mixed base currencies {table.base} and {base}")
+            table.add(row.get("date"), row.get("currency"), row["rate"])
+        return table if table is not None else cls()
+
+
+def load_fx_rates(path: str, fmt: Optional[str] = None) -> FxRates:
+    global FX_RATES
+    FX_RATES = _warm(f"fx:{fmt}", path, lambda: FxRates.load(path, fmt))
+    return FX_RATES
+
+
+def set_reporting_currency(code: Optional[str]):
+    global REPORTING_CURRENCY
+    REPORTING_CURRENCY = code.upper() if code else None
+
+
+def reporting_currency() -> Optional[str]:
+    """Currency of the reporting_* columns, or None when FX is off."""
+    if FX_RATES is None:
+        return None
+    return REPORTING_CURRENCY or FX_RATES.base
+
+
+def result_fields() -> tuple:
+    """Columns of calculate_costs() results under the current FX settings."""
+    return COST_FIELDS + FX_FIELDS if FX_RATES is not None else COST_FIELDS
+
+
+def _reporting_values(costs: Dict[str, Any], as_of=None, cents: bool = False) -> Dict[str, Any]:
+    target = reporting_currency()
+    factor = FX_RATES.cross_rate(costs["currency"], target, _fx_date(as_of) or now_iso()[:10])
+    out = {"reporting_currency": target, "fx_rate": factor}
+    for k in FX_AMOUNTS:
+        amount = costs[k] * factor
+        out[f"reporting_{k}"] = math.floor(amount + 0.5) if cents else _round(amount, 2)
+    return out
+
+
+def _reporting_columns(cols: Dict[str, Any], dest_labels, dest_codes,
+                       dates: Optional[Sequence] = None, cents: bool = False) -> Dict[str, Any]:
+    """FX_FIELDS columns of a priced batch; one rate lookup per (destination, date)."""
+    target = reporting_currency()
+    today = now_iso()[:10]
+    n = len(cols["shipment_value"])
+    if dates is None:
+        day_labels, day_codes = [today], (np.zeros(n, dtype=np.intp) if np is not None else [0] * n)
+    else:
+        day_labels, day_codes = _factorize(dates, "", lambda v: _fx_date(v) or today)
+    cross = lambda d, day: FX_RATES.cross_rate(_currency(d), target, day)
+    if np is None:
+        pairs = {k: cross(dest_labels[k[0]], day_labels[k[1]]) for k in set(zip(dest_codes, day_codes))}
+        factor = [pairs[k] for k in zip(dest_codes, day_codes)]
+        out = {"reporting_currency": [target] * n, "fx_rate": factor}
+        for k in FX_AMOUNTS:
+            out[f"reporting_{k}"] = [math.floor(v * f + 0.5) if cents else _round(v * f, 2)
+                                     for v, f in zip(cols[k], factor)]
+        return out
+    width = len(day_labels)
+    pairs, inv = np.unique(np.asarray(dest_codes, dtype=np.intp) * width + day_codes, return_inverse=True)
+    table = np.array([cross(dest_labels[k // width], day_labels[k % width]) for k in pairs.tolist()],
+                     dtype=np.float64)
+    factor = table[inv.reshape(-1)]
+    out = {"reporting_currency": np.full(n, target, dtype=object), "fx_rate": factor}
+    for k in FX_AMOUNTS:
+        amount = np.asarray(cols[k]) * factor
+        out[f"reporting_{k}"] = np.floor(amount + 0.5).astype(np.int64) if cents else _round_array(amount, 2)
+    return out
+
+
+def _with_reporting(cols: Dict[str, Any], dest_labels, dest_codes,
+                    dates: Optional[Sequence] = None, cents: bool = False) -> Dict[str, Any]:
+    if FX_RATES is not None:
+        with stage("fx", len(cols["shipment_value"])):
+            cols.update(_reporting_columns(cols, dest_labels, dest_codes, dates, cents))
+    return cols
+
+
+# --- rule engine -----------------------------------------------------------------
+#
+# Rule files (CSV or JSON Lines) hold one rule per row:
+#
+#   id,kind,origin,destination,category,min_value,max_value,value
+#   usmca,fta,canada,usa,,,,0
+#   food-hv,surcharge,,italy,food,10000,,0.02
+#   pharma,clearance,,india,pharmaceuticals,,,12
+#
+# kind is fta (duty rate multiplier, as in app.js TRADE_AGREEMENTS),
+# surcharge (added to the duty rate) or clearance (added hours). Empty
+# or "*" origin/destination/category match anything; a rule applies when
+# min_value <= shipment value < max_value (either bound optional). The
+# duty rate becomes scheduled_rate * product(fta) + sum(surcharge).
+
+RULE_KINDS = ("fta", "surcharge", "clearance")
+
+
+@dataclass
+class Rule:
+    kind: str
+    value: float
+    origin: str = ""
+    destination: str = ""
+    category: str = ""
+    min_value: Optional[float] = None
+    max_value: Optional[float] = None
+    id: str = ""
+
+    def __post_init__(self):
+        self.kind = (self.kind or "").lower()
+        if self.kind not in RULE_KINDS:
+            raise ValueError(f"unknown rule kind {self.kind!r}; choose from {', '.join(RULE_KINDS)}")
+        self.value = float(self.value)
+        if self.kind == "fta" and self.value < 0:
+            raise ValueError(f"FTA multiplier must not be negative, got {self.value!r}")
+        self.origin, self.destination, self.category = (
+            "" if v in (None, "*") else str(v).strip().lower()
+            for v in (self.origin, self.destination, self.category))
+        self.min_value = None if self.min_value in (None, "") else float(self.min_value)
+        self.max_value = None if self.max_value in (None, "") else float(self.max_value)
+
+    def applies(self, value: float) -> bool:
+        return ((self.min_value is None or self.min_value <= value)
+                and (self.max_value is None or value < self.max_value))
+
+
+class RuleSet:
+    """Rules compiled into flat dispatch tables.
+
+    Rules are indexed by their (origin, destination, category) pattern, so
+    a route collects its candidates with 8 dict probes however many rules
+    there are. The first lookup of a route compiles its value thresholds
+    into sorted breakpoints and one segment per value band, each holding
+    the combined multiplier, surcharge and hours; after that a lookup is
+    a dict hit plus a bisect. Hits are counted per segment and attributed
+    to rules on demand by hits().
+    """
+
+    def __init__(self, rules: Iterable[Rule] = ()):
+        self.rules = list(rules)
+        for i, rule in enumerate(self.rules, 1):
+            if not rule.id:
+                rule.id = f"{rule.kind}:{i}"
+        self._index: Dict[tuple, List[int]] = {}
+        for i, rule in enumerate(self.rules):
+            self._index.setdefault((rule.origin, rule.destination, rule.category), []).append(i)
+        # route -> (breakpoints, segment ids); segment tables are flat lists
+        self._plans: Dict[tuple, tuple] = {}
+        self._segments: Dict[tuple, int] = {}
+        self.multiplier: List[float] = []
+        self.surcharge: List[float] = []
+        self.hours: List[float] = []
+        self._members: List[tuple] = []
+        self._hits: List[int] = []
+        # hits counted in other processes, by rule id
+        self._merged: Dict[str, int] = collections.Counter()
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __getstate__(self):
+        # pool workers start with zeroed counters; their hits come back merged
+        state = self.__dict__.copy()
+        state["_hits"] = [0] * len(self._hits)
+        state["_merged"] = collections.Counter()
+        return state
+
+    def _segment(self, members: tuple) -> int:
+        seg = self._segments.get(members)
+        if seg is None:
+            seg = self._segments[members] = len(self._members)
+            mult, add, hours = 1.0, 0.0, 0.0
+            for i in members:
+                rule = self.rules[i]
+                if rule.kind == "fta":
+                    mult *= rule.value
+                elif rule.kind == "surcharge":
+                    add += rule.value
+                else:
+                    hours += rule.value
+            self.multiplier.append(mult)
+            self.surcharge.append(add)
+            self.hours.append(hours)
+            self._members.append(members)
+            self._hits.append(0)
+        return seg
+
+    def plan(self, origin: str, destination: str, category: str) -> tuple:
+        """(breakpoints, segment ids) of a route, compiled on first use."""
+        key = (origin, destination, category)
+        plan = self._plans.get(key)
+        if plan is not None:
+            return plan
+        found = []
+        for o in (origin, ""):
+            for d in (destination, ""):
+                for c in (category, ""):
+                    found.extend(self._index.get((o, d, c), ()))
+        found.sort()
+        rules = [self.rules[i] for i in found]
+        breaks = sorted({b for r in rules for b in (r.min_value, r.max_value) if b is not None})
+        # a band [breaks[k-1], breaks[k]) is matched by the same rules throughout
+        lows = [-math.inf] + breaks
+        segs = [self._segment(tuple(i for i, r in zip(found, rules) if r.applies(lo))) for lo in lows]
+        plan = self._plans[key] = (breaks, segs)
+        return plan
+
+    def resolve(self, origin: str, destination: str, category: str, value: float, count: bool = True) -> int:
+        """Segment id for one shipment; index multiplier/surcharge/hours with it."""
+        breaks, segs = self.plan(origin, destination, category)
+        seg = segs[bisect.bisect_right(breaks, value)] if breaks else segs[0]
+        if count:
+            self._hits[seg] += 1
+        return seg
+
+    def columns(self, org_labels, org_codes, dest_labels, dest_codes, cat_labels, cat_codes, sv) -> tuple:
+        """Per-row (multiplier, surcharge, hours) columns; counts a hit per row."""
+        if np is None:
+            routes = {k: self.plan(org_labels[k[0]], dest_labels[k[1]], cat_labels[k[2]])
+                      for k in set(zip(org_codes, dest_codes, cat_codes))}
+            segs = []
+            for o, d, c, v in zip(org_codes, dest_codes, cat_codes, sv):
+                breaks, route = routes[o, d, c]
+                segs.append(route[bisect.bisect_right(breaks, v)] if breaks else route[0])
+            for seg in segs:
+                self._hits[seg] += 1
+            return ([self.multiplier[s] for s in segs], [self.surcharge[s] for s in segs],
+                    [self.hours[s] for s in segs])
+        wo, wc = len(org_labels), len(cat_labels)
+        keys = (np.asarray(dest_codes, dtype=np.intp) * wo + org_codes) * wc + cat_codes
+        uniq, inv = np.unique(keys, return_inverse=True)
+        inv = inv.reshape(-1)
+        order = np.argsort(inv, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(np.bincount(inv, minlength=len(uniq)))))
+        segs = np.empty(len(inv), dtype=np.intp)
+        for g, key in enumerate(uniq.tolist()):
+            d, rest = divmod(key, wo * wc)
+            o, c = divmod(rest, wc)
+            breaks, route = self.plan(org_labels[o], dest_labels[d], cat_labels[c])
+            rows = order[starts[g]:starts[g + 1]]
+            if breaks:
+                segs[rows] = np.array(route, dtype=np.intp)[np.searchsorted(breaks, sv[rows], side="right")]
+            else:
+                segs[rows] = route[0]
+        for seg, n in enumerate(np.bincount(segs, minlength=len(self._hits)).tolist()):
+            self._hits[seg] += n
+        return (np.array(self.multiplier)[segs], np.array(self.surcharge)[segs],
+                np.array(self.hours)[segs])
+
+    def hits(self) -> Dict[str, int]:
+        """Rule id -> number of evaluations the rule applied to."""
+        out = dict.fromkeys((r.id for r in self.rules), 0)
+        for members, n in zip(self._members, self._hits):
+            if n:
+                for i in members:
+                    out[self.rules[i].id] += n
+        for rule_id, n in self._merged.items():
+            out[rule_id] = out.get(rule_id, 0) + n
+        return out
+
+    def fingerprint(self) -> str:
+        """Digest of the rules; equal rule lists give equal digests."""
+        text = json.dumps([asdict(r) for r in self.rules], sort_keys=True)
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def merge_hits(self, hits: Dict[str, int]):
+        """Fold in hits() taken in another process (e.g. a pool worker)."""
+        self._merged.update(hits)
+
+    def reset_hits(self):
+        self._hits = [0] * len(self._hits)
+        self._merged.clear()
+
+    @classmethod
+    def load(cls, path: str, fmt: Optional[str] = None) -> "RuleSet":
+        fields = ("kind", "value", "origin", "destination", "category", "min_value", "max_value", "id")
+        rules = []
+        for n, row in enumerate(_read_records(path, fmt), 1):
+            try:
+                rules.append(Rule(**{k: row.get(k) for k in fields if row.get(k) not in (None, "")}))
+            except (TypeError, ValueError) as exc:
+                raise ValueError(f"rule {n}: {exc}") from None
+        return cls(rules)
+
+
+def load_rules(path: str, fmt: Optional[str] = None) -> RuleSet:
+    global RULES
+    RULES = _warm(f"rules:{fmt}", path, lambda: RuleSet.load(path, fmt))
+    RULES.reset_hits()  # a --serve daemon hands the same RuleSet to every request
+    _rates_changed()
+    return RULES
+
+
+def _rule_columns(org_labels, org_codes, dest_labels, dest_codes, cat_labels, cat_codes, sv) -> Optional[tuple]:
+    if RULES is None:
+        return None
+    with stage("rules", len(sv)):
+        return RULES.columns(org_labels, org_codes, dest_labels, dest_codes, cat_labels, cat_codes, sv)
+
+
+def _base_duty_rate(destination: str, category: str) -> float:
+    if RATE_FILE is not None:
+        return RATE_FILE.duty(destination, category)
+    return float(DUTY_RATES.get((destination, category), DEFAULT_DUTY))
+
+
+def _tax_rate(destination: str) -> float:
+    if RATE_FILE is not None:
+        return RATE_FILE.tax(destination)
+    return float(TAX_RATES.get(destination, 0.0))
+
+
+def _currency(destination: str) -> str:
+    if RATE_FILE is not None:
+        return RATE_FILE.currency(destination)
+    return CURRENCY.get(destination, "USD")
 
 @dataclass
 class TradeCompliance:
@@ -50,64 +1093,157 @@ class TradeCompliance:
     product_category: str = "electronics"
     shipment_value: float = 0.0
     shipping_cost: float = 0.0
+    hs_code: str = ""
 
     def __post_init__(self):
         self.destination = (self.destination or "italy").lower()
         self.origin = (self.origin or "india").lower()
         self.product_category = (self.product_category or "electronics").lower()
+        self.hs_code = _normalize_hs(self.hs_code)
+
+    def scheduled_duty_rate(self) -> float:
+        """HS-code schedule rate, else the destination/category rate; no rules."""
+        if self.hs_code and TARIFF_SCHEDULE is not None:
+            rate = TARIFF_SCHEDULE.lookup(self.destination, self.hs_code)
+            if rate is not None:
+                return rate
+        return _base_duty_rate(self.destination, self.product_category)
 
     def duty_rate(self) -> float:
-        return float(DUTY_RATES.get((self.destination, self.product_category), DEFAULT_DUTY))
+        if RULES is None:
+            return self.scheduled_duty_rate()
+        mult, add, _ = self.rule_effects(count=False)
+        return self.scheduled_duty_rate() * mult + add
+
+    def rule_effects(self, count: bool = True) -> tuple:
+        """(FTA multiplier, duty surcharge, clearance hours) from RULES."""
+        if RULES is None:
+            return 1.0, 0.0, 0.0
+        seg = RULES.resolve(self.origin, self.destination, self.product_category,
+                            float(self.shipment_value or 0.0), count)
+        return RULES.multiplier[seg], RULES.surcharge[seg], RULES.hours[seg]
 
     def tax_rate(self) -> float:
-        return float(TAX_RATES.get(self.destination, 0.0))
+        return _tax_rate(self.destination)
 
-    def estimate_clearance_hours(self, import_duty: float, tax_rate: float) -> int:
+    def estimate_clearance_hours(self, import_duty: float, tax_rate: float,
+                                 extra_hours: Optional[float] = None) -> int:
+        """Heuristic clearance time; extra_hours defaults to the RULES adjustment."""
+        if extra_hours is None:
+            extra_hours = self.rule_effects(count=False)[2]
         base = 24.0
-        if self.shipment_value > 0:
-            duty_pct = (import_duty / self.shipment_value) * 100.0
+        sv = float(self.shipment_value or 0.0)  # as cost_values()
+        if sv > 0:
+            duty_pct = (import_duty / sv) * 100.0
         else:
             duty_pct = 0.0
         base += min(max(duty_pct * 0.5, 0.0), 120.0)
         base += tax_rate * 24.0
-        if self.product_category in ("pharmaceuticals", "automotive"):
-            base += 24.0
-        elif self.product_category == "machinery":
-            base += 12.0
-        elif self.product_category == "electronics":
-            base += 4.0
+        base += CATEGORY_CLEARANCE_HOURS.get(self.product_category, 0.0)
+        base += extra_hours
         return int(max(4.0, min(base, 240.0)))
 
-    def calculate_costs(self) -> Dict[str, Any]:
+    def cache_key(self) -> tuple:
+        return (self.destination, self.origin, self.product_category,
+                self.shipment_value, self.shipping_cost, self.hs_code)
+
+    def calculate_costs(self, as_of=None) -> Dict[str, Any]:
+        """Cost breakdown; with FX_RATES set, plus FX_FIELDS at the rates of `as_of` (default today)."""
+        if QUOTE_CACHE is not None:
+            values = QUOTE_CACHE.cost_values(self)
+        else:
+            values = self.cost_values()
+        m = METRICS
+        if m is None:
+            costs = dict(zip(COST_FIELDS, (now_iso(),) + values))
+        else:
+            t = time.perf_counter()
+            ts = now_iso()
+            m.lap("timestamp", t, 1)
+            m.count("rows")
+            costs = dict(zip(COST_FIELDS, (ts,) + values))
+        if FX_RATES is not None:
+            costs.update(_reporting_values(costs, as_of))
+        return costs
+
+    def cost_values(self) -> tuple:
+        """calculate_costs() values in COST_FIELDS order, minus the timestamp."""
+        m = METRICS
+        if m is not None:
+            t = time.perf_counter()
         sv = float(self.shipment_value or 0.0)
         sc = float(self.shipping_cost or 0.0)
-        dr = self.duty_rate()
+        if RULES is None:
+            dr, extra_hours = self.scheduled_duty_rate(), 0.0
+        else:
+            mult, add, extra_hours = self.rule_effects()
+            dr = self.scheduled_duty_rate() * mult + add
         tr = self.tax_rate()
+        if m is not None:
+            t = m.lap("rates", t, 1)
         import_duty = sv * dr
         taxable = sv + import_duty + sc
         tax = taxable * tr
         compliance_fee = sv * COMPLIANCE_FEE_RATE
         total = sv + import_duty + tax + sc
-        clearance = self.estimate_clearance_hours(import_duty, tr)
-        return {
-            "timestamp": now_iso(),
-            "origin": self.origin,
-            "destination": self.destination,
-            "product_category": self.product_category,
-            "currency": CURRENCY.get(self.destination, "USD"),
-            "shipment_value": _round(sv, 2),
-            "shipping_cost": _round(sc, 2),
-            "duty_rate": _round(dr, 4),
-            "import_duty": _round(import_duty, 2),
-            "tax_rate": _round(tr, 4),
-            "tax": _round(tax, 2),
-            "base_compliance_fee": _round(compliance_fee, 2),
-            "total_landed_cost": _round(total, 2),
-            "estimated_clearance_hours": clearance,
-        }
+        clearance = self.estimate_clearance_hours(import_duty, tr, extra_hours)
+        if m is not None:
+            m.lap("clearance", t, 1)
+        return (
+            self.origin,
+            self.destination,
+            self.product_category,
+            _currency(self.destination),
+            _round(sv, 2),
+            _round(sc, 2),
+            _round(dr, 4),
+            _round(import_duty, 2),
+            _round(tr, 4),
+            _round(tax, 2),
+            _round(compliance_fee, 2),
+            _round(total, 2),
+            clearance,
+        )
+
+    def calculate_costs_cents(self, as_of=None) -> Dict[str, Any]:
+        costs = dict(zip(COST_FIELDS, (now_iso(),) + self.cost_values_cents()))
+        if FX_RATES is not None:
+            costs.update(_reporting_values(costs, as_of, cents=True))
+        return costs
+
+    def cost_values_cents(self) -> tuple:
+        """cost_values() in integer minor units, with rates in basis points.
+
+        Every amount is rounded exactly once, and the total is the exact sum
+        of the rounded amounts, so it always reconciles to the cent.
+        """
+        sv = to_minor_units(self.shipment_value)
+        sc = to_minor_units(self.shipping_cost)
+        mult, add, extra_hours = self.rule_effects()
+        dr = to_basis_points(self.scheduled_duty_rate() * mult + add)
+        tr = to_basis_points(self.tax_rate())
+        import_duty = _div_round(sv * dr, BASIS_POINTS)
+        tax = _div_round((sv + import_duty + sc) * tr, BASIS_POINTS)
+        compliance_fee = _div_round(sv * to_basis_points(COMPLIANCE_FEE_RATE), BASIS_POINTS)
+        clearance = self.estimate_clearance_hours(import_duty / MINOR_UNITS, tr / BASIS_POINTS, extra_hours)
+        return (
+            self.origin,
+            self.destination,
+            self.product_category,
+            _currency(self.destination),
+            sv,
+            sc,
+            dr,
+            import_duty,
+            tr,
+            tax,
+            compliance_fee,
+            sv + import_duty + tax + sc,
+            clearance,
+        )
 
-    def to_pretty(self) -> str:
-        d = self.calculate_costs()
+    def to_pretty(self, as_of=None) -> str:
+        d = self.calculate_costs(as_of)
         lines = [
             "Trade Compliance Cost Breakdown",
             "----------------------------------------",
@@ -126,71 +1262,2969 @@ class TradeCompliance:
             f"Est. clearance (h): {d['estimated_clearance_hours']}",
             "----------------------------------------",
         ]
+        if "fx_rate" in d:
+            lines[-1:-1] = [
+                f"FX rate ({d['currency']}->{d['reporting_currency']}): {d['fx_rate']:.6g}",
+                f"Total in {d['reporting_currency']}:       {d['reporting_total_landed_cost']:,}",
+            ]
         return "\n".join(lines)
 
 
-def generate_demo() -> List[Dict[str, Any]]:
-    scenarios = [
-        TradeCompliance("italy", "india", "textiles", 10000, 500),
-        TradeCompliance("italy", "india", "machinery", 50000, 1500),
-        TradeCompliance("india", "italy", "pharmaceuticals", 20000, 800),
-    ]
-    return [s.calculate_costs() for s in scenarios]
+class QuoteCache:
+    """Bounded LRU cache of cost values keyed on normalized inputs.
 
+    Entries are tied to rates_version(): the first lookup after any rate
+    table changes drops the whole cache. Timestamps are never cached.
+    """
 
-def write_json(path: Path, data: Any, pretty: bool = True):
-    with path.open("w", encoding="utf-8") as fh:
-        json.dump(data, fh, indent=2 if pretty else None, ensure_ascii=False)
+    def __init__(self, maxsize: int = 65536):
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self._data: "collections.OrderedDict[tuple, tuple]" = collections.OrderedDict()
+        self._version = rates_version()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
 
+    def __len__(self) -> int:
+        return len(self._data)
 
-def write_csv(path: Path, rows: List[Dict[str, Any]]):
-    if not rows:
-        return
-    fieldnames = list(rows[0].keys())
-    with path.open("w", encoding="utf-8", newline="") as fh:
-        writer = csv.DictWriter(fh, fieldnames=fieldnames)
-        writer.writeheader()
-        for r in rows:
-            writer.writerow(r)
+    def cost_values(self, tc: "TradeCompliance") -> tuple:
+        version = rates_version()
+        if version != self._version:
+            self._data.clear()
+            self._version = version
+            self.invalidations += 1
+        key = tc.cache_key()
+        data = self._data
+        values = data.get(key)
+        if values is not None:
+            data.move_to_end(key)
+            self.hits += 1
+            return values
+        self.misses += 1
+        values = data[key] = tc.cost_values()
+        if len(data) > self.maxsize:
+            data.popitem(last=False)
+            self.evictions += 1
+        return values
 
+    def clear(self):
+        self._data.clear()
 
-def build_parser():
-    p = argparse.ArgumentParser(description="Trade Compliance CLI")
-    p.add_argument("--destination", "-d", choices=["italy", "india"], default="italy")
-    p.add_argument("--origin", "-o", default="india")
-    p.add_argument("--category", "-c", choices=["textiles", "machinery", "pharmaceuticals", "automotive", "food", "electronics"], default="electronics")
-    p.add_argument("--value", "-v", type=float, default=50000.0)
-    p.add_argument("--shipping", "-s", type=float, default=500.0)
-    p.add_argument("--json", action="store_true", help="print JSON to stdout")
-    p.add_argument("--output", "-O", type=str, help="write JSON to file")
-    p.add_argument("--csv", type=str, help="write batch CSV")
-    p.add_argument("--batch", action="store_true", help="run demo batch")
-    return p
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
 
 
-def main(argv=None):
-    p = build_parser()
-    args = p.parse_args(argv)
-    if args.batch:
-        rows = generate_demo()
-        if args.csv:
-            write_csv(Path(args.csv), rows)
-            print(f"Wrote CSV to {args.csv}")
-        if args.output:
-            write_json(Path(args.output), rows)
-            print(f"Wrote JSON to {args.output}")
-        if args.json and not args.output:
-            print(json.dumps(rows, indent=2))
-        return 0
+def enable_quote_cache(maxsize: int = 65536) -> QuoteCache:
+    global QUOTE_CACHE
+    QUOTE_CACHE = QuoteCache(maxsize)
+    return QUOTE_CACHE
+
+
+def disable_quote_cache():
+    global QUOTE_CACHE
+    QUOTE_CACHE = None
+
+
+@dataclass
+class CostBatch:
+    """Columnar calculate_costs() results sharing a single timestamp."""
+    timestamp: str
+    columns: Dict[str, Any]
+    # distinct pricing inputs when priced with dedup=True, else None
+    unique: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self.columns["shipment_value"])
+
+    @property
+    def fields(self) -> tuple:
+        return COST_FIELDS + FX_FIELDS if "fx_rate" in self.columns else COST_FIELDS
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        fields = self.fields
+        cols = [_tolist(self.columns[k]) for k in fields[1:]]
+        for values in zip(*cols):
+            yield dict(zip(fields, (self.timestamp,) + values))
+
+    def to_rows(self) -> List[Dict[str, Any]]:
+        return list(self.rows())
+
+
+def _tolist(col) -> list:
+    return col.tolist() if hasattr(col, "tolist") else list(col)
+
 
-    tc = TradeCompliance(args.destination, args.origin, args.category, args.value, args.shipping)
-    if args.json:
-        print(json.dumps(tc.calculate_costs(), indent=2))
+def _factorize(col, default: str, normalize=None):
+    """Return (labels, codes) with normalized labels, like __post_init__."""
+    if isinstance(col, str):
+        raise TypeError("expected a column of strings, got a single string")
+    if normalize is None:
+        normalize = lambda v: (v or default).lower()
+    if np is not None and isinstance(col, np.ndarray) and col.dtype.kind == "U":
+        uniq, codes = np.unique(col, return_inverse=True)
+        return [normalize(u) for u in uniq.tolist()], codes.reshape(-1)
+    index = {v: i for i, v in enumerate(dict.fromkeys(col))}
+    labels = [normalize(v) for v in index]
+    if np is not None:
+        return labels, np.fromiter(map(index.__getitem__, col), dtype=np.intp, count=len(col))
+    return labels, list(map(index.__getitem__, col))
+
+
+def _float_column(col):
+    if np is None:
+        return [float(v or 0.0) for v in col]
+    if not isinstance(col, np.ndarray) and (None in col or "" in col):
+        # asarray() would make these NaN; the scalar path prices them as 0
+        col = [0.0 if v is None or v == "" else v for v in col]
+    try:
+        return np.asarray(col, dtype=np.float64).reshape(-1)
+    except (TypeError, ValueError):
+        return np.array([float(v or 0.0) for v in col], dtype=np.float64)
+
+
+def _round_array(a, n=2):
+    """np.round() that agrees with _round() (Python round) bit for bit."""
+    scale = 10.0 ** n
+    y = a * scale
+    out = np.round(y) / scale
+    # x * scale can land on the other side of a .5 tie; redo those in Python
+    with np.errstate(invalid="ignore"):
+        frac = y - np.floor(y)
+        near = np.abs(frac - 0.5) <= np.maximum(np.spacing(np.abs(y)) * 4.0, 1e-9)
+    if near.any():
+        idx = np.flatnonzero(near)
+        out[idx] = [round(v, n) for v in a[idx].tolist()]
+    return out
+
+
+def calculate_costs_batch(destinations: Sequence, origins: Sequence, categories: Sequence,
+                          values: Sequence, shipping: Sequence,
+                          hs_codes: Optional[Sequence] = None, cents: bool = False,
+                          dates: Optional[Sequence] = None, dedup: bool = False) -> CostBatch:
+    """Price whole columns at once; numbers match TradeCompliance.calculate_costs().
+
+    With cents=True they match calculate_costs_cents() instead. `dates`
+    picks the FX rates of each row when FX_RATES is set (default today).
+    With dedup=True each distinct input row is priced once and the results
+    are copied back to every row that shares it; the output is the same.
+    """
+    _load_numpy()
+    with stage("factorize", len(values)):
+        dest_labels, dest_codes = _factorize(destinations, "italy")
+        org_labels, org_codes = _factorize(origins, "india")
+        cat_labels, cat_codes = _factorize(categories, "electronics")
+        sv = _float_column(values)
+        sc = _float_column(shipping)
+    if not len(sv) == len(sc) == len(dest_codes) == len(org_codes) == len(cat_codes):
+        raise ValueError("batch columns must all have the same length")
+    hs_idx = None
+    if hs_codes is not None and TARIFF_SCHEDULE is not None:
+        if len(hs_codes) != len(sv):
+            raise ValueError("batch columns must all have the same length")
+        hs_labels, hs_idx = _factorize(hs_codes, "", _normalize_hs)
+    if dates is not None and len(dates) != len(sv):
+        raise ValueError("batch columns must all have the same length")
+    row_dest = dest_codes
+    rules = _rule_columns(org_labels, org_codes, dest_labels, dest_codes, cat_labels, cat_codes, sv)
+    inverse = None
+    if dedup:
+        with stage("dedup", len(sv)):
+            codes = [_canonical_codes(dest_labels, dest_codes), _canonical_codes(org_labels, org_codes),
+                     _canonical_codes(cat_labels, cat_codes)]
+            if hs_idx is not None:
+                codes.append(_canonical_codes(hs_labels, hs_idx))
+            first, inverse = _unique_inputs(codes, sv, sc)
+            dest_codes, org_codes, cat_codes, sv, sc = (_take(c, first) for c in
+                                                        (dest_codes, org_codes, cat_codes, sv, sc))
+            if hs_idx is not None:
+                hs_idx = _take(hs_idx, first)
+            if rules is not None:
+                rules = tuple(_take(c, first) for c in rules)
+    tariff = None
+    if hs_idx is not None:
+        with stage("rates", len(sv)):
+            tariff = _tariff_column(dest_labels, dest_codes, hs_labels, hs_idx)
+    if cents:
+        price = _price_columns_cents
     else:
-        print(tc.to_pretty())
-    if args.output:
-        write_json(Path(args.output), tc.calculate_costs())
-        print(f"Wrote JSON to {args.output}")
+        price = _price_columns if np is not None else _price_columns_py
+    cols = price(dest_labels, dest_codes, org_labels, org_codes, cat_labels, cat_codes, sv, sc, tariff, rules)
+    unique = None
+    if inverse is not None:
+        unique = len(sv)
+        with stage("scatter", len(inverse)):
+            cols = {k: _take(col, inverse) for k, col in cols.items()}
+    return CostBatch(now_iso(), _with_reporting(cols, dest_labels, row_dest, dates, cents), unique)
+
+
+def _take(col, idx):
+    if np is not None and isinstance(col, np.ndarray):
+        return col[idx]
+    return [col[i] for i in idx]
+
+
+def _canonical_codes(labels: List[str], codes):
+    """Codes renumbered so raw values with the same normalized label ("Italy", "italy") match."""
+    canon = {}
+    remap = [canon.setdefault(label, i) for i, label in enumerate(labels)]
+    if len(canon) == len(labels):
+        return codes
+    if np is not None and isinstance(codes, np.ndarray):
+        return np.array(remap, dtype=np.intp)[codes]
+    return [remap[c] for c in codes]
+
+
+def _unique_inputs(codes: List[Sequence], sv, sc) -> tuple:
+    """(first row of each distinct input, distinct input of each row).
+
+    `codes` are the label code columns; rows match when every code and
+    both amounts are equal.
+    """
+    if np is None:
+        index: Dict[tuple, int] = {}
+        first, inverse = [], []
+        for i, key in enumerate(zip(*codes, sv, sc)):
+            k = index.get(key)
+            if k is None:
+                k = index[key] = len(first)
+                first.append(i)
+            inverse.append(k)
+        return first, inverse
+    n = len(sv)
+    keys = np.empty(n, dtype=[("codes", np.int64), ("value", np.float64), ("shipping", np.float64)])
+    dims = tuple(int(c.max()) + 1 if n else 1 for c in codes)
+    keys["codes"] = np.ravel_multi_index(codes, dims) if n else 0
+    keys["value"] = sv
+    keys["shipping"] = sc
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    return first, inverse.reshape(-1)
+
+
+def _tariff_column(dest_labels, dest_codes, hs_labels, hs_idx):
+    """Per-row schedule rate (NaN/None where the schedule has no match)."""
+    lookup = TARIFF_SCHEDULE.lookup
+    if np is None:
+        pairs = {k: lookup(dest_labels[k[0]], hs_labels[k[1]]) for k in set(zip(dest_codes, hs_idx))}
+        return [pairs[k] for k in zip(dest_codes, hs_idx)]
+    width = len(hs_labels)
+    pairs, inv = np.unique(dest_codes * width + hs_idx, return_inverse=True)
+    rates = [lookup(dest_labels[k // width], hs_labels[k % width]) for k in pairs.tolist()]
+    table = np.array([np.nan if r is None else r for r in rates], dtype=np.float64)
+    return table[inv.reshape(-1)]
+
+
+def _price_columns(dest_labels, dest_codes, org_labels, org_codes,
+                   cat_labels, cat_codes, sv, sc, tariff=None, rules=None) -> Dict[str, Any]:
+    n = len(sv)
+    with stage("rates", n):
+        duty_table = np.array([[_base_duty_rate(d, c) for c in cat_labels]
+                               for d in dest_labels], dtype=np.float64).reshape(len(dest_labels), len(cat_labels))
+        tax_table = np.array([_tax_rate(d) for d in dest_labels], dtype=np.float64)
+        dr = duty_table[dest_codes, cat_codes]
+        if tariff is not None:
+            dr = np.where(np.isnan(tariff), dr, tariff)
+        if rules is not None:
+            dr = dr * rules[0] + rules[1]
+        tr = tax_table[dest_codes]
+    hours_table = np.array([CATEGORY_CLEARANCE_HOURS.get(c, 0.0) for c in cat_labels], dtype=np.float64)
+    dest_names = np.array(dest_labels, dtype=object)
+
+    import_duty = sv * dr
+    taxable = sv + import_duty + sc
+    tax = taxable * tr
+    compliance_fee = sv * COMPLIANCE_FEE_RATE
+    total = sv + import_duty + tax + sc
+
+    with stage("clearance", n):
+        duty_pct = np.zeros_like(sv)
+        np.divide(import_duty, sv, out=duty_pct, where=sv > 0)
+        duty_pct *= 100.0
+        base = 24.0 + np.clip(duty_pct * 0.5, 0.0, 120.0)
+        base += tr * 24.0
+        base += hours_table[cat_codes]
+        if rules is not None:
+            base += rules[2]
+        clearance = np.clip(base, 4.0, 240.0).astype(np.int64)
+
+    with stage("round", n):
+        return {
+            "origin": np.array(org_labels, dtype=object)[org_codes],
+            "destination": dest_names[dest_codes],
+            "product_category": np.array(cat_labels, dtype=object)[cat_codes],
+            "currency": np.array([_currency(d) for d in dest_labels], dtype=object)[dest_codes],
+            "shipment_value": _round_array(sv, 2),
+            "shipping_cost": _round_array(sc, 2),
+            "duty_rate": _round_array(dr, 4),
+            "import_duty": _round_array(import_duty, 2),
+            "tax_rate": _round_array(tr, 4),
+            "tax": _round_array(tax, 2),
+            "base_compliance_fee": _round_array(compliance_fee, 2),
+            "total_landed_cost": _round_array(total, 2),
+            "estimated_clearance_hours": clearance,
+        }
+
+
+def _price_columns_py(dest_labels, dest_codes, org_labels, org_codes,
+                      cat_labels, cat_codes, sv, sc, tariff=None, rules=None) -> Dict[str, Any]:
+    cols: Dict[str, list] = {k: [] for k in COST_FIELDS[1:]}
+    with stage("rates", len(sv)):
+        duty = [[_base_duty_rate(d, c) for c in cat_labels] for d in dest_labels]
+        taxes = [_tax_rate(d) for d in dest_labels]
+        currencies = [_currency(d) for d in dest_labels]
+    hours = [CATEGORY_CLEARANCE_HOURS.get(c, 0.0) for c in cat_labels]
+    if tariff is None:
+        tariff = itertools.repeat(None)
+    effects = zip(*rules) if rules is not None else itertools.repeat(None)
+    # one loop does duty, tax, clearance and rounding per row; time it as a whole
+    with stage("price", len(sv)):
+        for di, oi, ci, v, s, hr, eff in zip(dest_codes, org_codes, cat_codes, sv, sc, tariff, effects):
+            dr = duty[di][ci] if hr is None else hr
+            if eff is not None:
+                dr = dr * eff[0] + eff[1]
+            tr = taxes[di]
+            import_duty = v * dr
+            tax = (v + import_duty + s) * tr
+            duty_pct = (import_duty / v) * 100.0 if v > 0 else 0.0
+            base = 24.0 + min(max(duty_pct * 0.5, 0.0), 120.0)
+            base += tr * 24.0
+            base += hours[ci]
+            if eff is not None:
+                base += eff[2]
+            cols["origin"].append(org_labels[oi])
+            cols["destination"].append(dest_labels[di])
+            cols["product_category"].append(cat_labels[ci])
+            cols["currency"].append(currencies[di])
+            cols["shipment_value"].append(round(v, 2))
+            cols["shipping_cost"].append(round(s, 2))
+            cols["duty_rate"].append(round(dr, 4))
+            cols["import_duty"].append(round(import_duty, 2))
+            cols["tax_rate"].append(round(tr, 4))
+            cols["tax"].append(round(tax, 2))
+            cols["base_compliance_fee"].append(round(v * COMPLIANCE_FEE_RATE, 2))
+            cols["total_landed_cost"].append(round(v + import_duty + tax + s, 2))
+            cols["estimated_clearance_hours"].append(int(max(4.0, min(base, 240.0))))
+    return cols
+
+
+def _price_columns_cents(dest_labels, dest_codes, org_labels, org_codes,
+                        cat_labels, cat_codes, sv, sc, tariff=None, rules=None) -> Dict[str, Any]:
+    """Integer kernel behind calculate_costs_batch(cents=True)."""
+    n = len(sv)
+    fee_bp = to_basis_points(COMPLIANCE_FEE_RATE)
+    with stage("rates", n):
+        # with rules, the float rate is adjusted first and converted per row
+        rates = [[_base_duty_rate(d, c) for c in cat_labels] for d in dest_labels]
+        duty = [[to_basis_points(r) for r in row] for row in rates]
+        taxes = [to_basis_points(_tax_rate(d)) for d in dest_labels]
+        currencies = [_currency(d) for d in dest_labels]
+    hours = [CATEGORY_CLEARANCE_HOURS.get(c, 0.0) for c in cat_labels]
+    if np is None:
+        cols: Dict[str, list] = {k: [] for k in COST_FIELDS[1:]}
+        if tariff is None:
+            tariff = itertools.repeat(None)
+        effects = zip(*rules) if rules is not None else itertools.repeat(None)
+        with stage("price", n):
+            for di, oi, ci, v, s, hr, eff in zip(dest_codes, org_codes, cat_codes, sv, sc, tariff, effects):
+                vc, shc = to_minor_units(v), to_minor_units(s)
+                if eff is not None:
+                    dr = to_basis_points((rates[di][ci] if hr is None else hr) * eff[0] + eff[1])
+                else:
+                    dr = duty[di][ci] if hr is None else to_basis_points(hr)
+                tr = taxes[di]
+                import_duty = _div_round(vc * dr, BASIS_POINTS)
+                tax = _div_round((vc + import_duty + shc) * tr, BASIS_POINTS)
+                duty_pct = (import_duty / MINOR_UNITS / v) * 100.0 if v > 0 else 0.0
+                base = 24.0 + min(max(duty_pct * 0.5, 0.0), 120.0)
+                base += (tr / BASIS_POINTS) * 24.0
+                base += hours[ci]
+                if eff is not None:
+                    base += eff[2]
+                values = (org_labels[oi], dest_labels[di], cat_labels[ci], currencies[di], vc, shc, dr,
+                          import_duty, tr, tax, _div_round(vc * fee_bp, BASIS_POINTS), vc + import_duty + tax + shc,
+                          int(max(4.0, min(base, 240.0))))
+                for k, value in zip(COST_FIELDS[1:], values):
+                    cols[k].append(value)
+        return cols
+
+    with stage("rates", n):
+        if rules is not None:
+            drf = np.array(rates, dtype=np.float64).reshape(len(dest_labels), len(cat_labels))[dest_codes, cat_codes]
+            if tariff is not None:
+                drf = np.where(np.isnan(tariff), drf, tariff)
+            dr = np.floor((drf * rules[0] + rules[1]) * BASIS_POINTS + 0.5).astype(np.int64)
+        else:
+            dr = np.array(duty, dtype=np.int64).reshape(len(dest_labels), len(cat_labels))[dest_codes, cat_codes]
+            if tariff is not None:
+                has_tariff = ~np.isnan(tariff)
+                dr[has_tariff] = np.floor(tariff[has_tariff] * BASIS_POINTS + 0.5).astype(np.int64)
+        tr = np.array(taxes, dtype=np.int64)[dest_codes]
+    vc = np.floor(sv * MINOR_UNITS + 0.5).astype(np.int64)
+    shc = np.floor(sc * MINOR_UNITS + 0.5).astype(np.int64)
+    import_duty = _div_round(vc * dr, BASIS_POINTS)
+    tax = _div_round((vc + import_duty + shc) * tr, BASIS_POINTS)
+    with stage("clearance", n):
+        duty_pct = np.zeros(n, dtype=np.float64)
+        np.divide(import_duty / MINOR_UNITS, sv, out=duty_pct, where=sv > 0)
+        duty_pct *= 100.0
+        base = 24.0 + np.clip(duty_pct * 0.5, 0.0, 120.0)
+        base += (tr / BASIS_POINTS) * 24.0
+        base += np.array(hours, dtype=np.float64)[cat_codes]
+        if rules is not None:
+            base += rules[2]
+        clearance = np.clip(base, 4.0, 240.0).astype(np.int64)
+    return {
+        "origin": np.array(org_labels, dtype=object)[org_codes],
+        "destination": np.array(dest_labels, dtype=object)[dest_codes],
+        "product_category": np.array(cat_labels, dtype=object)[cat_codes],
+        "currency": np.array(currencies, dtype=object)[dest_codes],
+        "shipment_value": vc,
+        "shipping_cost": shc,
+        "duty_rate": dr,
+        "import_duty": import_duty,
+        "tax_rate": tr,
+        "tax": tax,
+        "base_compliance_fee": _div_round(vc * fee_bp, BASIS_POINTS),
+        "total_landed_cost": vc + import_duty + tax + shc,
+        "estimated_clearance_hours": clearance,
+    }
+
+
+# --- compact shipment storage ---------------------------------------------------
+
+class Shipment:
+    """Slotted shipment record with TradeCompliance's normalization."""
+
+    __slots__ = ("destination", "origin", "product_category", "shipment_value", "shipping_cost", "hs_code")
+
+    def __init__(self, destination: str = "italy", origin: str = "india", product_category: str = "electronics",
+                 shipment_value: float = 0.0, shipping_cost: float = 0.0, hs_code: str = ""):
+        self.destination = sys.intern((destination or "italy").lower())
+        self.origin = sys.intern((origin or "india").lower())
+        self.product_category = sys.intern((product_category or "electronics").lower())
+        self.shipment_value = shipment_value
+        self.shipping_cost = shipping_cost
+        self.hs_code = _normalize_hs(hs_code)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{k}={getattr(self, k)!r}" for k in self.__slots__)
+        return f"Shipment({fields})"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Shipment):
+            return NotImplemented
+        return all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def to_trade_compliance(self) -> TradeCompliance:
+        return TradeCompliance(*(getattr(self, k) for k in self.__slots__))
+
+    def calculate_costs(self) -> Dict[str, Any]:
+        return self.to_trade_compliance().calculate_costs()
+
+
+class Vocabulary:
+    """Interned labels <-> small integer codes; raw inputs are normalized once."""
+
+    __slots__ = ("labels", "_codes", "_normalize")
+
+    def __init__(self, normalize=str.lower):
+        self.labels: List[str] = []
+        self._codes: Dict[Any, int] = {}
+        self._normalize = normalize
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def code(self, raw) -> int:
+        c = self._codes.get(raw)
+        if c is None:
+            label = sys.intern(self._normalize(raw))
+            c = self._codes.get(label)
+            if c is None:
+                c = self._codes[label] = len(self.labels)
+                self.labels.append(label)
+            self._codes[raw] = c
+        return c
+
+
+class ShipmentBatch:
+    """Struct-of-arrays shipment store.
+
+    Countries, categories and HS codes are kept as small integer codes over
+    interned vocabularies, and amounts as float arrays. A shipment costs
+    about 26 bytes instead of a TradeCompliance instance and its __dict__.
+    """
+
+    def __init__(self):
+        self.countries = Vocabulary()
+        self.categories = Vocabulary()
+        self.hs_codes = Vocabulary(_normalize_hs)
+        self.destination = array("H")
+        self.origin = array("H")
+        self.category = array("H")
+        self.hs = array("I")
+        self.value = array("d")
+        self.shipping = array("d")
+
+    def __len__(self) -> int:
+        return len(self.value)
+
+    def __getitem__(self, i: int) -> Shipment:
+        names = self.countries.labels
+        return Shipment(names[self.destination[i]], names[self.origin[i]],
+                        self.categories.labels[self.category[i]], self.value[i], self.shipping[i],
+                        self.hs_codes.labels[self.hs[i]])
+
+    def __iter__(self) -> Iterator[Shipment]:
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.destination, self.origin, self.category, self.hs, self.value, self.shipping)
+        return sum(a.itemsize * len(a) for a in arrays)
+
+    def append(self, destination: str = "italy", origin: str = "india", product_category: str = "electronics",
+               shipment_value: float = 0.0, shipping_cost: float = 0.0, hs_code: str = ""):
+        self.destination.append(self.countries.code(destination or "italy"))
+        self.origin.append(self.countries.code(origin or "india"))
+        self.category.append(self.categories.code(product_category or "electronics"))
+        self.hs.append(self.hs_codes.code(hs_code or ""))
+        self.value.append(float(shipment_value or 0.0))
+        self.shipping.append(float(shipping_cost or 0.0))
+
+    def extend(self, shipments: Iterable[Dict[str, Any]]):
+        """Append shipment dicts (same column names as --input files)."""
+        for row in shipments:
+            self.append(*(next((row[n] for n in names if n in row), None) for names in INPUT_FIELDS.values()))
+
+    @classmethod
+    def from_file(cls, path: str, fmt: Optional[str] = None) -> "ShipmentBatch":
+        batch = cls()
+        batch.extend(read_shipments(path, fmt))
+        return batch
+
+    def calculate_costs(self) -> CostBatch:
+        """calculate_costs_batch() over the stored codes, without re-factorizing."""
+        _load_numpy()
+        countries = self.countries.labels
+        codes = [self.destination, self.origin, self.category, self.hs]
+        if np is not None:
+            codes = [np.frombuffer(c, dtype=np.uint16 if c.typecode == "H" else np.uint32).astype(np.intp)
+                     for c in codes]
+            sv = np.frombuffer(self.value, dtype=np.float64)
+            sc = np.frombuffer(self.shipping, dtype=np.float64)
+        else:
+            sv, sc = self.value, self.shipping
+        dest, org, cat, hs = codes
+        tariff = None
+        if TARIFF_SCHEDULE is not None and any(self.hs_codes.labels):
+            with stage("rates", len(self)):
+                tariff = _tariff_column(countries, dest, self.hs_codes.labels, hs)
+        price = _price_columns if np is not None else _price_columns_py
+        rules = _rule_columns(countries, org, countries, dest, self.categories.labels, cat, sv)
+        cols = price(countries, dest, countries, org, self.categories.labels, cat, sv, sc, tariff, rules)
+        return CostBatch(now_iso(), _with_reporting(cols, countries, dest))
+
+
+# --- what-if sweeps -----------------------------------------------------------------
+
+@dataclass
+class SweepGrid:
+    """Cartesian product of pricing inputs, priced lazily chunk by chunk.
+
+    Rows run in itertools.product() order over (destination, origin,
+    category, value, shipping); a chunk is built from its flat row indexes,
+    so the grid itself is never materialized.
+    """
+    destinations: Sequence[str] = ("italy",)
+    origins: Sequence[str] = ("india",)
+    categories: Sequence[str] = ("electronics",)
+    values: Sequence[float] = (0.0,)
+    shipping: Sequence[float] = (0.0,)
+
+    def __post_init__(self):
+        self.destinations = [(d or "italy").lower() for d in self.destinations]
+        self.origins = [(o or "india").lower() for o in self.origins]
+        self.categories = [(c or "electronics").lower() for c in self.categories]
+        self.values = [float(v or 0.0) for v in self.values]
+        self.shipping = [float(s or 0.0) for s in self.shipping]
+        if not all(self.shape):
+            raise ValueError("every sweep axis needs at least one value")
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.destinations), len(self.origins), len(self.categories),
+                len(self.values), len(self.shipping))
+
+    def __len__(self) -> int:
+        return math.prod(self.shape)
+
+    def params(self, index: int) -> Dict[str, Any]:
+        """Inputs of row `index`, keyed like INPUT_FIELDS."""
+        axes = (self.destinations, self.origins, self.categories, self.values, self.shipping)
+        picked = []
+        for axis in reversed(axes):
+            index, i = divmod(index, len(axis))
+            picked.append(axis[i])
+        return dict(zip(INPUT_FIELDS, reversed(picked)))
+
+    def batches(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[CostBatch]:
+        n = len(self)
+        if _load_numpy() is not None:
+            values = np.array(self.values, dtype=np.float64)
+            shipping = np.array(self.shipping, dtype=np.float64)
+            for start in range(0, n, chunk_size):
+                dest, org, cat, v, s = np.unravel_index(np.arange(start, min(n, start + chunk_size)), self.shape)
+                yield self._price(dest, org, cat, values[v], shipping[s])
+            return
+        it = itertools.product(*(range(k) for k in self.shape))
+        while True:
+            chunk = list(itertools.islice(it, chunk_size))
+            if not chunk:
+                return
+            dest, org, cat, v, s = zip(*chunk)
+            yield self._price(dest, org, cat, [self.values[i] for i in v], [self.shipping[i] for i in s])
+
+    def _price(self, dest, org, cat, sv, sc) -> CostBatch:
+        price = _price_columns if np is not None else _price_columns_py
+        rules = _rule_columns(self.origins, org, self.destinations, dest, self.categories, cat, sv)
+        cols = price(self.destinations, dest, self.origins, org, self.categories, cat, sv, sc, rules=rules)
+        return CostBatch(now_iso(), _with_reporting(cols, self.destinations, dest))
+
+    def reduce(self, field: str = "total_landed_cost", chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+        """SweepReducer summary of one result column over the whole grid."""
+        reducer = SweepReducer(field)
+        for batch in self.batches(chunk_size):
+            reducer.update(batch)
+        return reducer.result()
+
+
+class SweepReducer:
+    """Running count/min/max/mean of a result column, with argmin/argmax rows."""
+
+    def __init__(self, field: str = "total_landed_cost"):
+        if field not in COST_FIELDS[5:]:
+            raise ValueError(f"cannot reduce over {field!r}")
+        self.field = field
+        self.count = 0
+        self.total = 0.0
+        self.min = self.max = None
+        self.argmin = self.argmax = None
+
+    def update(self, batch: CostBatch):
+        col = batch.columns[self.field]
+        if not len(col):
+            return
+        if np is not None:
+            col = np.asarray(col, dtype=np.float64)
+            lo, hi, total = int(np.argmin(col)), int(np.argmax(col)), float(col.sum())
+        else:
+            lo = min(range(len(col)), key=col.__getitem__)
+            hi = max(range(len(col)), key=col.__getitem__)
+            total = math.fsum(col)
+        # strict comparisons keep the first row on ties, like argmin()
+        if self.min is None or col[lo] < self.min:
+            self.min, self.argmin = float(col[lo]), self._row(batch, lo)
+        if self.max is None or col[hi] > self.max:
+            self.max, self.argmax = float(col[hi]), self._row(batch, hi)
+        self.count += len(col)
+        self.total += total
+
+    @staticmethod
+    def _row(batch: CostBatch, i: int) -> Dict[str, Any]:
+        row = {k: batch.columns[k][i] for k in COST_FIELDS[1:]}
+        return {k: v.item() if hasattr(v, "item") else v for k, v in row.items()}
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            "field": self.field,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else None,
+            "argmin": self.argmin,
+            "argmax": self.argmax,
+        }
+
+
+def parse_sweep_axis(spec: str) -> tuple:
+    """'category=food,textiles' or 'value=1000:50000:500' -> (field, values).
+
+    Field names are the INPUT_FIELDS names or aliases. Numeric ranges are
+    start:stop:step with stop included when it falls on the grid.
+    """
+    name, sep, text = spec.partition("=")
+    field = next((f for f, names in INPUT_FIELDS.items() if name.strip().lower() in names), None)
+    if not sep or field is None or field == "hs_code":
+        raise ValueError(f"bad sweep axis {spec!r}; expected AXIS=VALUES, AXIS one of "
+                         "destination, origin, category, value, shipping")
+    if field in ("shipment_value", "shipping_cost"):
+        if ":" in text:
+            try:
+                start, stop, step = (float(x) for x in text.split(":"))
+            except ValueError:
+                raise ValueError(f"bad range in {spec!r}; expected start:stop:step") from None
+            if step <= 0 or stop < start:
+                raise ValueError(f"bad range in {spec!r}; step must be positive and stop >= start")
+            count = int((stop - start) / step + 1e-9) + 1
+            return field, [round(start + i * step, 10) for i in range(count)]
+        try:
+            return field, [float(x) for x in text.split(",")]
+        except ValueError:
+            raise ValueError(f"bad number in {spec!r}") from None
+    return field, [x.strip() for x in text.split(",") if x.strip()]
+
+
+def generate_demo() -> List[Dict[str, Any]]:
+    scenarios = [
+        TradeCompliance("italy", "india", "textiles", 10000, 500),
+        TradeCompliance("italy", "india", "machinery", 50000, 1500),
+        TradeCompliance("india", "italy", "pharmaceuticals", 20000, 800),
+    ]
+    return [s.calculate_costs() for s in scenarios]
+
+
+def write_json(path: Path, data: Any, pretty: bool = True):
+    with path.open("w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=2 if pretty else None, ensure_ascii=False)
+
+
+def write_csv(path: Path, rows: Iterable[Dict[str, Any]]):
+    it = iter(rows)
+    first = next(it, None)
+    if first is None:
+        return
+    with path.open("w", encoding="utf-8", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=list(first.keys()))
+        writer.writeheader()
+        writer.writerow(first)
+        writer.writerows(it)
+
+
+# --- static quote bundle -------------------------------------------------------------
+#
+# quote_bundle() flattens what calculate_costs() reads into one JSON
+# document for the web calculator (app.js): tax, currency and duty as
+# vectors indexed by destination and category, and for every (origin,
+# destination, category) route its compiled RULES plan as value
+# breakpoints plus segment ids. A quote in the browser is then a few
+# array lookups and a scan of the route's handful of breakpoints, and
+# the page carries no rate tables of its own.
+
+QUOTE_BUNDLE_FORMAT = "trade-compliance-quotes"
+QUOTE_BUNDLE_VERSION = 1
+# estimate_clearance_hours() as data; keep the two in step
+CLEARANCE_MODEL = {"base": 24.0, "duty_factor": 0.5, "duty_cap": 120.0, "tax_hours": 24.0,
+                   "min": 4.0, "max": 240.0}
+# an origin no rule names, so its plan holds only the wildcard-origin rules
+_OTHER_ORIGIN = "\0"
+
+
+def quote_bundle() -> Dict[str, Any]:
+    """Current rate tables and RULES in the layout app.js evaluates.
+
+    Route r = (o * len(destinations) + d) * len(categories) + c indexes
+    `routes`, giving a plan [breakpoints, segment ids]; the segment of a
+    value v is ids[number of breakpoints <= v], and `segments` holds its
+    [FTA multiplier, duty surcharge, clearance hours]. origins[0] is "*",
+    any origin not listed. HS-code schedules are left out: the calculator
+    prices by category. `rates` is a digest of everything else.
+    """
+    dests, cats = (sorted(labels) for labels in known_labels())
+    named = {r.origin for r in RULES.rules} - {""} if RULES is not None else set()
+    origins = ["*"] + sorted(named | set(dests))
+    plans: List[list] = []
+    plan_ids: Dict[tuple, int] = {}
+    segments: List[list] = []
+    # RULES segments differ by member rules; the bundle only needs distinct effects
+    seg_ids: Dict[tuple, int] = {}
+    routes = []
+    for o in origins:
+        for d in dests:
+            for c in cats:
+                if RULES is None:
+                    breaks, effects = [], [(1.0, 0.0, 0.0)]
+                else:
+                    breaks, segs = RULES.plan(_OTHER_ORIGIN if o == "*" else o, d, c)
+                    effects = [(RULES.multiplier[s], RULES.surcharge[s], RULES.hours[s]) for s in segs]
+                for effect in effects:
+                    if effect not in seg_ids:
+                        seg_ids[effect] = len(segments)
+                        segments.append(list(effect))
+                key = (tuple(breaks), tuple(seg_ids[effect] for effect in effects))
+                if key not in plan_ids:
+                    plan_ids[key] = len(plans)
+                    plans.append([list(key[0]), list(key[1])])
+                routes.append(plan_ids[key])
+    bundle = {
+        "format": QUOTE_BUNDLE_FORMAT,
+        "version": QUOTE_BUNDLE_VERSION,
+        "origins": origins,
+        "destinations": dests,
+        "categories": cats,
+        "currency": [_currency(d) for d in dests],
+        "tax": [_tax_rate(d) for d in dests],
+        "duty": [_base_duty_rate(d, c) for d in dests for c in cats],
+        "fee": COMPLIANCE_FEE_RATE,
+        "category_hours": [CATEGORY_CLEARANCE_HOURS.get(c, 0.0) for c in cats],
+        "clearance": CLEARANCE_MODEL,
+        "routes": routes,
+        "plans": plans,
+        "segments": segments,
+    }
+    text = json.dumps(bundle, sort_keys=True, allow_nan=False)
+    bundle["rates"] = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+    return bundle
+
+
+def export_quote_bundle(path: str) -> int:
+    """Write quote_bundle() as compact JSON; return its size in bytes."""
+    data = json.dumps(quote_bundle(), separators=(",", ":"), allow_nan=False).encode("utf-8") + b"\n"
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+    return len(data)
+
+
+# --- streaming file input ---------------------------------------------------
+
+# Accepted input column names for each calculate_costs_batch() column
+INPUT_FIELDS = {
+    "destination": ("destination",),
+    "origin": ("origin",),
+    "product_category": ("product_category", "category"),
+    "shipment_value": ("shipment_value", "value"),
+    "shipping_cost": ("shipping_cost", "shipping"),
+    "hs_code": ("hs_code", "hs"),
+}
+
+
+def _input_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    if path == "-":
+        return "jsonl"
+    suffix = Path(path).suffix.lower()
+    if suffix == ".csv":
+        return "csv"
+    if suffix in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    raise ValueError(f"cannot infer input format of {path!r}; pass --input-format")
+
+
+def read_shipments(path: str, fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Yield shipment dicts from a CSV or JSON Lines file ("-" for stdin)."""
+    return _read_records(path, fmt)
+
+
+def _read_records(path: str, fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    fmt = _input_format(path, fmt)
+    fh = sys.stdin if path == "-" else open(path, "r", encoding="utf-8", newline="")
+    try:
+        if fmt == "csv":
+            yield from csv.DictReader(fh)
+        else:
+            for line in fh:
+                if line.strip():
+                    yield json.loads(line)
+    finally:
+        if fh is not sys.stdin:
+            fh.close()
+
+
+class InputCursor:
+    """Records of a CSV/JSONL input plus the byte offset just past them.
+
+    The file is read in binary and split on b"\\n", so `offset` is exact
+    at every record boundary and a later run can seek straight back to it.
+    A CSV header is read once; resuming mid-file passes it in as
+    `fieldnames`.
+    """
+
+    def __init__(self, path: str, fmt: Optional[str] = None, offset: int = 0,
+                 fieldnames: Optional[List[str]] = None):
+        self.fmt = _input_format(path, fmt)
+        if path == "-":
+            if offset:
+                raise ValueError("cannot seek in stdin input")
+            self.fh = sys.stdin.buffer
+        else:
+            self.fh = open(path, "rb")
+            self.fh.seek(offset)
+        self.offset = offset
+        if self.fmt == "csv" and fieldnames is None:
+            header = self.fh.readline()
+            self.offset += len(header)
+            fieldnames = next(csv.reader([header.decode("utf-8")]), [])
+        self.fieldnames = fieldnames
+        # offset just past the last record whose results are safely written
+        self.committed = self.offset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        if self.fh is not sys.stdin.buffer:
+            self.fh.close()
+
+    def _lines(self) -> Iterator[str]:
+        for raw in self.fh:
+            self.offset += len(raw)
+            yield raw.decode("utf-8")
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        # csv.reader pulls only the lines of the record it returns, so
+        # offset is never ahead of the last record yielded
+        if self.fmt == "csv":
+            yield from csv.DictReader(self._lines(), fieldnames=self.fieldnames)
+        else:
+            for line in self._lines():
+                if line.strip():
+                    yield json.loads(line)
+
+    def raw_chunks(self, chunk_size: int) -> Iterator[tuple]:
+        """(fmt, fieldnames, lines, end offset) per chunk of physical lines, unparsed."""
+        lines = self._lines()
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield self.fmt, self.fieldnames, chunk, self.offset
+
+
+_NO_VALUE = object()
+
+
+def _has_key(rows: List[Dict[str, Any]], name: str) -> bool:
+    return any(map(dict.__contains__, rows, itertools.repeat(name)))
+
+
+def _column(rows: List[Dict[str, Any]], names: Sequence[str]) -> Optional[list]:
+    """Each row's value under the first of `names` it has; None if no row has any.
+
+    Resolved per row, as in ShipmentBatch.extend(): JSONL objects need not
+    share keys. CSV rows do, and take the fast path.
+    """
+    name = next((n for n in names if n in rows[0]), None) if rows else None
+    if name is not None:
+        col = list(map(dict.get, rows, itertools.repeat(name), itertools.repeat(_NO_VALUE)))
+        if _NO_VALUE not in col and not any(_has_key(rows, n) for n in names[:names.index(name)]):
+            return col
+    elif not any(_has_key(rows, n) for n in names):
+        return None
+    return [next((r[n] for n in names if n in r), None) for r in rows]
+
+
+def iter_priced_batches(shipments: Iterable[Dict[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        cents: bool = False, dedup: bool = False) -> Iterator[CostBatch]:
+    """Price shipment dicts chunk by chunk; only one chunk is held in memory."""
+    for chunk in _iter_chunks(shipments, chunk_size):
+        yield price_shipments(chunk, cents, dedup)
+
+
+def _iter_chunks(shipments: Iterable[Dict[str, Any]], chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    it = iter(shipments)
+    while True:
+        with stage("read") as timer:
+            chunk = list(itertools.islice(it, chunk_size))
+            timer.rows = len(chunk)
+        if not chunk:
+            return
+        yield chunk
+
+
+def price_shipments(shipments: List[Dict[str, Any]], cents: bool = False, dedup: bool = False) -> CostBatch:
+    *cols, hs_codes = (_column(shipments, names) for names in INPUT_FIELDS.values())
+    missing = [None] * len(shipments)
+    dates = _column(shipments, DATE_FIELDS) if FX_RATES is not None else None
+    return calculate_costs_batch(*(missing if c is None else c for c in cols), hs_codes=hs_codes,
+                                 cents=cents, dates=dates, dedup=dedup)
+
+
+class DedupStats:
+    """Rows vs distinct pricing inputs over batches priced with dedup=True.
+
+    Uniqueness is per batch (chunk), so a key repeated across chunks
+    counts once in each.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.unique = 0
+
+    def update(self, batch: CostBatch):
+        self.rows += len(batch)
+        self.unique += batch.unique if batch.unique is not None else len(batch)
+
+    def merge(self, other: "DedupStats") -> "DedupStats":
+        self.rows += other.rows
+        self.unique += other.unique
+        return self
+
+    @property
+    def ratio(self) -> float:
+        """Rows per priced input (1.0 = nothing shared)."""
+        return self.rows / self.unique if self.unique else 1.0
+
+    def report(self) -> str:
+        saved = 1.0 - self.unique / self.rows if self.rows else 0.0
+        return (f"Priced {self.unique:,} unique inputs for {self.rows:,} rows "
+                f"(dedup ratio {self.ratio:.2f}x, {saved:.1%} of rows reused)")
+
+
+# --- input validation ----------------------------------------------------------------
+#
+# validate_shipments() checks a chunk one column at a time before it is
+# priced. Label columns are checked once per distinct value, and a row
+# mask is only built for a column that actually holds a bad value;
+# amounts are checked as one float array. A clean chunk therefore costs a
+# few C-level passes and is passed on as is, while bad rows are split off
+# with reason codes instead of being coerced to defaults.
+
+_HS_CODE = re.compile(r"\d[\d. -]*\Z")
+_ISO_DATE = re.compile(r"\d{4}-\d\d-\d\d")
+_AMOUNT_REASONS = ("missing", "invalid", "nonfinite", "negative")
+# (rates_version(), destinations, categories); see known_labels()
+_VOCABULARY: Optional[tuple] = None
+
+
+def _is_date(value) -> bool:
+    """True for "YYYY-MM-DD..." values naming a real day (FX lookups compare the strings)."""
+    text = str(value)
+    if not _ISO_DATE.match(text):
+        return False
+    try:
+        datetime.fromisoformat(text[:10])
+    except ValueError:  # e.g. 2024-13-99
+        return False
+    return True
+
+
+def known_labels() -> tuple:
+    """(destinations, categories) the loaded rate tables know, lower-cased."""
+    global _VOCABULARY
+    version = rates_version()
+    if _VOCABULARY is None or _VOCABULARY[0] != version:
+        if RATE_FILE is not None:
+            dests, cats = RATE_FILE.destinations(), RATE_FILE.categories()
+        else:
+            dests = set(TAX_RATES) | set(CURRENCY) | {d for d, _ in DUTY_RATES}
+            cats = {c for _, c in DUTY_RATES}
+        if TARIFF_SCHEDULE is not None:
+            dests |= TARIFF_SCHEDULE.destinations()
+        _VOCABULARY = (version, frozenset(dests), frozenset(cats | set(CATEGORY_CLEARANCE_HOURS)))
+    return _VOCABULARY[1:]
+
+
+def _distinct(col) -> tuple:
+    """(column, set of its values); unhashable JSON values are replaced by their repr."""
+    try:
+        return col, set(col)
+    except TypeError:
+        col = [v if v is None or isinstance(v, (str, int, float)) else repr(v) for v in col]
+        return col, set(col)
+
+
+def _row_mask(col, values: set):
+    if np is not None:
+        return np.fromiter((v in values for v in col), dtype=bool, count=len(col))
+    return [v in values for v in col]
+
+
+def _label_checks(col, field: str, known: Optional[frozenset]) -> List[tuple]:
+    """(row mask, reason) pairs for a label column; `known` None accepts any string."""
+    col, distinct = _distinct(col)
+    checks = []
+    missing = {v for v in distinct if not v}
+    if missing:
+        checks.append((_row_mask(col, missing), f"missing_{field}"))
+    unknown = {v for v in distinct - missing
+               if not isinstance(v, str) or (known is not None and v.lower() not in known)}
+    if unknown:
+        checks.append((_row_mask(col, unknown), f"unknown_{field}"))
+    return checks
+
+
+def _amount_code(value) -> int:
+    # index into _AMOUNT_REASONS, plus one; 0 = fine
+    if value is None or value == "":
+        return 1
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return 2
+    if not math.isfinite(v):
+        return 3
+    return 4 if v < 0 else 0
+
+
+def _amount_checks(col, field: str, optional: bool = False) -> List[tuple]:
+    """(row mask, reason) pairs for an amount column; `optional` lets empty cells through as 0."""
+    if np is None:
+        codes = list(map(_amount_code, col))
+        found = set(codes)
+        masks = {k: [c == k for c in codes] for k in found if k}
+    else:
+        try:
+            v = np.asarray(col, dtype=np.float64).reshape(-1)
+        except (TypeError, ValueError):
+            codes = np.fromiter(map(_amount_code, col), dtype=np.int8, count=len(col))
+        else:
+            codes = np.zeros(len(v), dtype=np.int8)
+            with np.errstate(invalid="ignore"):
+                codes[v < 0] = 4
+            nonfinite = ~np.isfinite(v)
+            codes[nonfinite] = 3
+            # None converts to NaN; tell it apart from a real "nan"
+            for i in np.flatnonzero(np.isnan(v)).tolist():
+                if col[i] is None:
+                    codes[i] = 1
+        masks = {k: codes == k for k in range(1, len(_AMOUNT_REASONS) + 1)}
+        masks = {k: m for k, m in masks.items() if m.any()}
+    return [(mask, f"{_AMOUNT_REASONS[k - 1]}_{field}") for k, mask in sorted(masks.items())
+            if not (optional and k == 1)]
+
+
+def _valid_hs(code) -> bool:
+    text = str(code)
+    return bool(_HS_CODE.match(text)) and 2 <= sum(ch.isdigit() for ch in text) <= _MAX_HS_DIGITS
+
+
+def _fx_checks(dests: Optional[list], dates: Optional[list]) -> List[tuple]:
+    """Malformed dates, and destination/date pairs FX_RATES has no rate for."""
+    n = len(dests if dests is not None else dates)
+    checks = []
+    if dests is not None:
+        dests, _ = _distinct(dests)
+    if dates is not None:
+        dates, distinct = _distinct(dates)
+        bad = {v for v in distinct if v and not _is_date(v)}
+        if bad:
+            checks.append((_row_mask(dates, bad), "invalid_date"))
+    known, _ = known_labels()
+    target = reporting_currency()
+    today = now_iso()[:10]
+    pairs = list(zip(dests if dests is not None else itertools.repeat("italy", n),
+                     dates if dates is not None else itertools.repeat(None, n)))
+    missing = set()
+    for dest, day in set(pairs):
+        if not isinstance(dest, str) or dest.lower() not in known or (day and not _is_date(day)):
+            continue  # rejected for that already
+        try:
+            FX_RATES.cross_rate(_currency(dest.lower()), target, _fx_date(day) or today)
+        except ValueError:
+            missing.add((dest, day))
+    if missing:
+        checks.append((_row_mask(pairs, missing), "no_fx_rate"))
+    return checks
+
+
+def validate_shipments(shipments: List[Dict[str, Any]], start: int = 0) -> tuple:
+    """Split a chunk into (valid rows, rejected rows) before pricing.
+
+    Each rejected entry is (record, reasons, row): record is `start` plus
+    the row's 1-based position in the chunk, and reasons lists codes such
+    as "unknown_destination" or "negative_shipment_value". Columns absent
+    from the input keep their pricing defaults; an empty cell in a column
+    that is present is rejected, except shipping_cost (0) and hs_code.
+    Origins are free-form, as with --origin.
+    """
+    if not shipments:
+        return shipments, []
+    _load_numpy()
+    dests, cats = known_labels()
+    col = {field: _column(shipments, names) for field, names in INPUT_FIELDS.items()}
+    checks = []
+    if col["destination"] is not None:
+        checks += _label_checks(col["destination"], "destination", dests)
+    if col["origin"] is not None:
+        checks += _label_checks(col["origin"], "origin", None)
+    if col["product_category"] is not None:
+        checks += _label_checks(col["product_category"], "category", cats)
+    if col["shipment_value"] is not None:
+        checks += _amount_checks(col["shipment_value"], "shipment_value")
+    if col["shipping_cost"] is not None:
+        checks += _amount_checks(col["shipping_cost"], "shipping_cost", optional=True)
+    if col["hs_code"] is not None:
+        hs, distinct = _distinct(col["hs_code"])
+        bad = {v for v in distinct if v and not _valid_hs(v)}
+        if bad:
+            checks.append((_row_mask(hs, bad), "invalid_hs_code"))
+    if FX_RATES is not None:
+        checks += _fx_checks(col["destination"], _column(shipments, DATE_FIELDS))
+    if not checks:
+        return shipments, []
+    if np is not None:
+        bad = np.logical_or.reduce([mask for mask, _ in checks])
+        bad_idx = np.flatnonzero(bad).tolist()
+        valid = list(map(shipments.__getitem__, np.flatnonzero(~bad).tolist()))
+    else:
+        bad = [any(flags) for flags in zip(*(mask for mask, _ in checks))]
+        bad_idx = [i for i, b in enumerate(bad) if b]
+        valid = [row for row, b in zip(shipments, bad) if not b]
+    rejected = [(start + i + 1, [reason for mask, reason in checks if mask[i]], shipments[i]) for i in bad_idx]
+    return valid, rejected
+
+
+class ValidationStats:
+    """Rows checked by validate_shipments() and rejects per reason code."""
+
+    def __init__(self):
+        self.rows = 0
+        self.rejected = 0
+        self.reasons: Dict[str, int] = collections.Counter()
+
+    def update(self, rows: int, rejected: List[tuple]):
+        self.rows += rows
+        self.rejected += len(rejected)
+        for _, reasons, _ in rejected:
+            self.reasons.update(reasons)
+
+    def merge(self, other: "ValidationStats") -> "ValidationStats":
+        self.rows += other.rows
+        self.rejected += other.rejected
+        self.reasons.update(other.reasons)
+        return self
+
+    def report(self) -> str:
+        if not self.rejected:
+            return f"Validated {self.rows:,} rows, none rejected"
+        reasons = ", ".join(f"{code} {count:,}" for code, count in self.reasons.most_common())
+        return f"Rejected {self.rejected:,} of {self.rows:,} rows ({self.rejected / self.rows:.2%}): {reasons}"
+
+
+# --- streaming rollups ---------------------------------------------------------------
+
+# Input columns holding a shipment date ("2024-03-15", "2024-03-15T10:00:00Z")
+DATE_FIELDS = ("date", "shipment_date", "ship_date", "shipped_at")
+# Result columns summed per group
+ROLLUP_SUMS = ("import_duty", "tax", "base_compliance_fee", "total_landed_cost")
+ROLLUP_KEYS = ("destination", "origin", "product_category", "currency", "month")
+ROLLUP_QUANTILES = (0.5, 0.9, 0.99)
+_MAX_CLEARANCE_HOURS = 240
+
+
+def _month_column(shipments: List[Dict[str, Any]]) -> List[str]:
+    """YYYY-MM of each shipment's date column, "" when there is none."""
+    dates = _column(shipments, DATE_FIELDS)
+    if dates is None:
+        return [""] * len(shipments)
+    return [str(d)[:7] if d else "" for d in dates]
+
+
+class GroupAggregator:
+    """Single-pass rollup of priced batches by destination/category/month.
+
+    Each group keeps a row count, running sums of ROLLUP_SUMS and a histogram
+    of clearance hours. Hours are whole numbers in 4..240, so the histogram
+    gives exact quantiles in at most 237 counters. Memory grows with the
+    number of groups, never with rows, and aggregators built over separate
+    shards (e.g. --workers chunks) combine with merge().
+    """
+
+    def __init__(self, by: Sequence[str] = ("destination", "product_category", "month")):
+        by = tuple("product_category" if k == "category" else k for k in by)
+        unknown = [k for k in by if k not in ROLLUP_KEYS]
+        if unknown:
+            raise ValueError(f"cannot group by {', '.join(unknown)}; choose from "
+                             f"destination, origin, category, currency, month")
+        self.by = by
+        # key -> [count, *sums, Counter(hours)]
+        self.groups: Dict[tuple, list] = {}
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def _group(self, key: tuple) -> list:
+        state = self.groups.get(key)
+        if state is None:
+            state = self.groups[key] = [0] + [0.0] * len(ROLLUP_SUMS) + [collections.Counter()]
+        return state
+
+    def update(self, batch: CostBatch, shipments: Optional[List[Dict[str, Any]]] = None):
+        """Fold in a batch; `shipments` are its input rows, needed for "month"."""
+        n = len(batch)
+        if not n:
+            return
+        cols = batch.columns
+        months = _month_column(shipments) if shipments is not None else [""] * n
+        keys = [months if k == "month" else cols[k] for k in self.by]
+        if np is None:
+            sums = [cols[f] for f in ROLLUP_SUMS]
+            for i, key in enumerate(zip(*keys) if keys else itertools.repeat((), n)):
+                state = self._group(key)
+                state[0] += 1
+                for j, col in enumerate(sums, 1):
+                    state[j] += col[i]
+                state[-1][cols["estimated_clearance_hours"][i]] += 1
+            return
+        # keys as priced: currency is upper case, the others already normalized
+        factors = [_factorize(col, "", lambda v: v) for col in keys]
+        dims = tuple(len(labels) for labels, _ in factors) or (1,)
+        flat = (np.ravel_multi_index([codes for _, codes in factors], dims) if factors
+                else np.zeros(n, dtype=np.intp))
+        uniq, inv = np.unique(flat, return_inverse=True)
+        inv = inv.reshape(-1)
+        ng = len(uniq)
+        counts = np.bincount(inv, minlength=ng)
+        sums = [np.bincount(inv, weights=np.asarray(cols[f], dtype=np.float64), minlength=ng)
+                for f in ROLLUP_SUMS]
+        hours = np.clip(np.asarray(cols["estimated_clearance_hours"], dtype=np.intp), 0, _MAX_CLEARANCE_HOURS)
+        bins = _MAX_CLEARANCE_HOURS + 1
+        hist = np.bincount(inv * bins + hours, minlength=ng * bins).reshape(ng, bins)
+        label_codes = np.unravel_index(uniq, dims)
+        for g in range(ng):
+            key = tuple(labels[int(codes[g])] for (labels, _), codes in zip(factors, label_codes))
+            state = self._group(key)
+            state[0] += int(counts[g])
+            for j, s in enumerate(sums, 1):
+                state[j] += float(s[g])
+            row = hist[g]
+            for h in np.flatnonzero(row).tolist():
+                state[-1][h] += int(row[h])
+
+    def merge(self, other: "GroupAggregator") -> "GroupAggregator":
+        if other.by != self.by:
+            raise ValueError("cannot merge rollups grouped by different keys")
+        for key, theirs in other.groups.items():
+            state = self._group(key)
+            for j in range(len(ROLLUP_SUMS) + 1):
+                state[j] += theirs[j]
+            state[-1].update(theirs[-1])
+        return self
+
+    @property
+    def fields(self) -> tuple:
+        return (self.by + ("count",) + tuple(f"sum_{f}" for f in ROLLUP_SUMS)
+                + tuple(f"mean_{f}" for f in ROLLUP_SUMS) + ("mean_clearance_hours",)
+                + tuple(f"p{round(q * 100)}_clearance_hours" for q in ROLLUP_QUANTILES))
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        """One dict of `fields` per group, sorted by key."""
+        for key in sorted(self.groups):
+            count, *sums, hist = self.groups[key]
+            hours = sorted(hist.items())
+            mean_hours = sum(h * c for h, c in hours) / count
+            yield dict(zip(self.fields, key + (count,) + tuple(_round(s, 2) for s in sums)
+                           + tuple(_round(s / count, 2) for s in sums) + (_round(mean_hours, 2),)
+                           + tuple(_hist_quantile(hours, count, q) for q in ROLLUP_QUANTILES)))
+
+
+def _hist_quantile(hours: List[tuple], count: int, q: float) -> int:
+    """Nearest-rank quantile of sorted (value, count) pairs."""
+    rank = max(1, math.ceil(q * count))
+    seen = 0
+    for h, c in hours:
+        seen += c
+        if seen >= rank:
+            return h
+    return hours[-1][0]
+
+
+# --- port clearance simulation -------------------------------------------------------
+#
+# Each port is a FIFO queue in front of `officers` parallel servers, with
+# estimated_clearance_hours as the service time. Shipments must arrive in
+# time order per port. A min-heap of officer free times gives each arrival
+# its start time in O(log officers); because FIFO start times never
+# decrease, the shipments still waiting form a deque of start times, and
+# the queue depth seen by an arrival is its length after popping every
+# start <= now. Waits are kept as a histogram of whole minutes, so memory
+# stays flat however many shipments stream through.
+
+# Input columns holding an arrival time (ISO date/datetime or hours as a number)
+ARRIVAL_FIELDS = ("arrival", "arrival_time", "arrived_at") + DATE_FIELDS
+SIM_QUANTILES = (0.5, 0.9, 0.99)
+SIM_FIELDS = (("port", "officers", "shipments", "horizon_hours", "throughput_per_day", "utilization",
+               "mean_queue_depth", "max_queue_depth", "mean_wait_hours")
+              + tuple(f"p{round(q * 100)}_wait_hours" for q in SIM_QUANTILES) + ("max_wait_hours",))
+
+
+def _arrival_hours(values: Sequence) -> List[float]:
+    """Arrival times as hours since the epoch; naive datetimes are UTC."""
+    parsed: Dict[Any, float] = {}
+    out = []
+    for v in values:
+        hours = parsed.get(v)
+        if hours is None:
+            if v is None or v == "":
+                raise ValueError("shipment has no arrival time (arrival or date column)")
+            try:
+                hours = float(v)
+            except (TypeError, ValueError):
+                text = str(v)
+                dt = datetime.fromisoformat(text[:-1] + "+00:00" if text.endswith("Z") else text)
+                if dt.tzinfo is None:
+                    dt = dt.replace(tzinfo=timezone.utc)
+                hours = dt.timestamp() / 3600.0
+            parsed[v] = hours
+        out.append(hours)
+    return out
+
+
+class PortQueue:
+    """One port's customs queue; see the section comment."""
+
+    __slots__ = ("officers", "shipments", "first_arrival", "last_arrival", "last_departure",
+                 "total_wait", "total_service", "max_depth", "max_wait", "waits", "_free", "_waiting")
+
+    def __init__(self, officers: int = 1):
+        if officers < 1:
+            raise ValueError("a port needs at least one officer")
+        self.officers = officers
+        self.shipments = 0
+        self.first_arrival = self.last_arrival = self.last_departure = -math.inf
+        self.total_wait = self.total_service = self.max_wait = 0.0
+        self.max_depth = 0
+        self.waits: Dict[int, int] = collections.Counter()  # whole minutes -> shipments
+        self._free = [-math.inf] * officers
+        self._waiting: "collections.deque[float]" = collections.deque()
+
+    def feed(self, arrivals: Sequence[float], service: Sequence[float]):
+        """Simulate shipments arriving at `arrivals` (hours) in time order."""
+        free, waiting, waits = self._free, self._waiting, self.waits
+        popleft, push, replace = waiting.popleft, waiting.append, heapq.heapreplace
+        last, departure = self.last_arrival, self.last_departure
+        total_wait = total_service = 0.0
+        max_depth, max_wait = self.max_depth, self.max_wait
+        for t, hours in zip(arrivals, service):
+            if t < last:
+                raise ValueError(f"arrivals must be in time order per port ({t} after {last})")
+            last = t
+            while waiting and waiting[0] <= t:
+                popleft()
+            start = free[0]
+            if start > t:
+                wait = start - t
+                push(start)
+                if len(waiting) > max_depth:
+                    max_depth = len(waiting)
+                if wait > max_wait:
+                    max_wait = wait
+                total_wait += wait
+                waits[int(wait * 60.0 + 0.5)] += 1
+            else:
+                start = t
+                waits[0] += 1
+            end = start + hours
+            replace(free, end)
+            if end > departure:
+                departure = end
+            total_service += hours
+        if self.shipments == 0 and len(arrivals):
+            self.first_arrival = arrivals[0]
+        self.shipments += len(arrivals)
+        self.last_arrival, self.last_departure = last, departure
+        self.total_wait += total_wait
+        self.total_service += total_service
+        self.max_depth, self.max_wait = max_depth, max_wait
+
+    def summary(self) -> Dict[str, Any]:
+        n = self.shipments
+        horizon = self.last_departure - self.first_arrival if n else 0.0
+        waits = sorted(self.waits.items())
+        return {
+            "officers": self.officers,
+            "shipments": n,
+            "horizon_hours": _round(horizon, 2),
+            "throughput_per_day": _round(n / horizon * 24.0, 2) if horizon > 0 else 0.0,
+            "utilization": _round(self.total_service / (self.officers * horizon), 4) if horizon > 0 else 0.0,
+            # Little's law: time-average number waiting = total waiting time / horizon
+            "mean_queue_depth": _round(self.total_wait / horizon, 4) if horizon > 0 else 0.0,
+            "max_queue_depth": self.max_depth,
+            "mean_wait_hours": _round(self.total_wait / n, 4) if n else 0.0,
+            **{f"p{round(q * 100)}_wait_hours": _round(_hist_quantile(waits, n, q) / 60.0, 4) if n else 0.0
+               for q in SIM_QUANTILES},
+            "max_wait_hours": _round(self.max_wait, 4),
+        }
+
+
+def parse_officers(spec: str) -> tuple:
+    """"4" / "italy=6,india=10" / "2,india=10" -> (default, {port: officers})."""
+    default, ports = 1, {}
+    for part in (p.strip() for p in str(spec).split(",")):
+        if not part:
+            continue
+        name, sep, count = part.rpartition("=")
+        try:
+            n = int(count)
+        except ValueError:
+            raise ValueError(f"invalid officer count in {part!r}") from None
+        if n < 1:
+            raise ValueError(f"a port needs at least one officer, got {part!r}")
+        if sep:
+            ports[name.strip().lower()] = n
+        else:
+            default = n
+    return default, ports
+
+
+class ClearanceSimulator:
+    """Customs queues for every port in a stream of priced shipments.
+
+    The port is the shipment's `port` column, else its destination.
+    """
+
+    def __init__(self, officers: int = 1, ports: Optional[Dict[str, int]] = None):
+        self.officers = officers
+        self.port_officers = dict(ports or {})
+        self.ports: Dict[str, PortQueue] = {}
+
+    def feed(self, ports: Sequence[str], arrivals: Sequence[float], service: Sequence[float]):
+        """Feed columns of one chunk, split by port with input order kept."""
+        by_port: Dict[str, tuple] = {}
+        for port, t, hours in zip(ports, arrivals, service):
+            cols = by_port.get(port)
+            if cols is None:
+                cols = by_port[port] = ([], [])
+            cols[0].append(t)
+            cols[1].append(hours)
+        for port, (ts, hours) in by_port.items():
+            queue = self.ports.get(port)
+            if queue is None:
+                queue = self.ports[port] = PortQueue(self.port_officers.get(port, self.officers))
+            queue.feed(ts, hours)
+
+    def update(self, batch: CostBatch, shipments: List[Dict[str, Any]]):
+        self.feed(*simulation_columns(batch, shipments))
+
+    def rows(self) -> Iterator[Dict[str, Any]]:
+        """One SIM_FIELDS dict per port, sorted by port."""
+        for port in sorted(self.ports):
+            yield {"port": port, **self.ports[port].summary()}
+
+
+def simulation_columns(batch: CostBatch, shipments: List[Dict[str, Any]]) -> tuple:
+    """(ports, arrival hours, service hours) of a priced chunk."""
+    ports = _column(shipments, ("port",))
+    destinations = _tolist(batch.columns["destination"])
+    if ports is None:
+        ports = destinations
+    else:
+        ports = [(p or d).strip().lower() for p, d in zip(ports, destinations)]
+    arrivals = _column(shipments, ARRIVAL_FIELDS)
+    if arrivals is None:
+        raise ValueError("simulation needs an arrival time column "
+                         f"({', '.join(ARRIVAL_FIELDS)})")
+    return ports, _arrival_hours(arrivals), _tolist(batch.columns["estimated_clearance_hours"])
+
+
+# --- output writers -------------------------------------------------------------
+#
+# A BatchWriter streams CostBatch results to an open file. Text writers
+# render a whole batch to one string at a time (labels are escaped once
+# per distinct value, numbers are formatted column by column), which also
+# lets --workers processes render in parallel and hand the parent text.
+
+_LABEL_FIELDS = ("origin", "destination", "product_category", "currency", "reporting_currency")
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+
+def _csv_quote(value: str) -> str:
+    if any(ch in value for ch in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _json_number(value) -> str:
+    return json.dumps(value)
+
+
+def _text_columns(batch: CostBatch, quote) -> List[list]:
+    """batch.fields[1:] columns as lists of formatted strings."""
+    out = []
+    for name in batch.fields[1:]:
+        col = _tolist(batch.columns[name])
+        if name in _LABEL_FIELDS:
+            escaped = {v: quote(v) for v in set(col)}
+            out.append(list(map(escaped.__getitem__, col)))
+        elif quote is _csv_quote or all(map(math.isfinite, col)):
+            out.append(list(map(repr, col)))
+        else:  # json spells non-finite floats NaN/Infinity
+            out.append(list(map(_json_number, col)))
+    return out
+
+
+class BatchWriter:
+    """Base class for streaming CostBatch sinks.
+
+    Subclasses provide render() for one batch and optionally header,
+    separator (between non-empty batches) and footer text.
+    """
+
+    binary = False
+    separator = ""
+
+    def __init__(self, fh, resume: bool = False):
+        """With resume=True, fh continues an earlier run's output; no header."""
+        self.fh = fh
+        self.rows = 0
+        self._started = False
+        if resume:
+            return
+        header = self.header()
+        if header:
+            fh.write(header)
+
+    @classmethod
+    def check_available(cls):
+        """Raise ImportError if an optional dependency is missing."""
+
+    def header(self) -> str:
+        return ""
+
+    def footer(self) -> str:
+        return ""
+
+    @classmethod
+    def render(cls, batch: CostBatch) -> str:
+        raise NotImplementedError
+
+    def write(self, batch: CostBatch):
+        self.write_text(self.render(batch), len(batch))
+
+    def write_text(self, text: str, rows: int):
+        if not text:
+            return
+        if self._started and self.separator:
+            self.fh.write(self.separator)
+        self.fh.write(text)
+        self._started = True
+        self.rows += rows
+
+    def close(self):
+        footer = self.footer()
+        if footer:
+            self.fh.write(footer)
+
+
+class CsvBatchWriter(BatchWriter):
+    """CSV identical to write_csv() output, rendered column-wise."""
+
+    def header(self) -> str:
+        return ",".join(result_fields()) + "\r\n"
+
+    @classmethod
+    def render(cls, batch: CostBatch) -> str:
+        if not len(batch):
+            return ""
+        prefix = _csv_quote(batch.timestamp) + ","
+        lines = map(",".join, zip(*_text_columns(batch, _csv_quote)))
+        return prefix + ("\r\n" + prefix).join(lines) + "\r\n"
+
+
+def _json_objects(batch: CostBatch) -> Iterator[str]:
+    # same text as json.dumps(row, ensure_ascii=False)
+    template = "{" + ", ".join(f'"{k}": %s' for k in batch.fields) + "}"
+    quote = lambda v: json.dumps(v, ensure_ascii=False)
+    rows = zip(itertools.repeat(quote(batch.timestamp)), *_text_columns(batch, quote))
+    return (template % row for row in rows)
+
+
+class JsonlBatchWriter(BatchWriter):
+    """One JSON object per line."""
+
+    @classmethod
+    def render(cls, batch: CostBatch) -> str:
+        return "".join(obj + "\n" for obj in _json_objects(batch))
+
+
+class JsonArrayBatchWriter(BatchWriter):
+    """A single JSON array, streamed one batch at a time."""
+
+    separator = ",\n"
+
+    def header(self) -> str:
+        return "[\n"
+
+    def footer(self) -> str:
+        return "\n]\n" if self._started else "]\n"
+
+    @classmethod
+    def render(cls, batch: CostBatch) -> str:
+        return ",\n".join(_json_objects(batch))
+
+
+class RejectWriter(BatchWriter):
+    """validate_shipments() rejects as JSON Lines: record number, reason codes, input row."""
+
+    @classmethod
+    def render(cls, rejected: List[tuple]) -> str:
+        return "".join(json.dumps({"record": n, "reasons": reasons, "row": row}, ensure_ascii=False,
+                                  default=str) + "\n" for n, reasons, row in rejected)
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow/Parquet output needs pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+def _arrow_table(batch: CostBatch):
+    pa = _require_pyarrow()
+    arrays = {"timestamp": pa.array([batch.timestamp] * len(batch), pa.string())}
+    for name in batch.fields[1:]:
+        col = batch.columns[name]
+        if name in _LABEL_FIELDS:
+            arrays[name] = pa.array(_tolist(col), pa.string())
+        elif name == "estimated_clearance_hours":
+            arrays[name] = pa.array(col, pa.int64())
+        else:
+            arrays[name] = pa.array(col, pa.float64())
+    return pa.table(arrays)
+
+
+class _ColumnarBatchWriter(BatchWriter):
+    binary = True
+
+    @classmethod
+    def check_available(cls):
+        _require_pyarrow()
+
+    def __init__(self, fh, resume: bool = False):
+        if resume:
+            raise ValueError("Arrow/Parquet files cannot be appended to")
+        super().__init__(fh)
+        self._writer = None
+
+    def write(self, batch: CostBatch):
+        if not len(batch):
+            return
+        table = _arrow_table(batch)
+        if self._writer is None:
+            self._writer = self._open(table.schema)
+        self._writer.write_table(table)
+        self.rows += len(batch)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+class ParquetBatchWriter(_ColumnarBatchWriter):
+    """Apache Parquet file, one row group per batch (needs pyarrow)."""
+
+    def _open(self, schema):
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(self.fh, schema)
+
+
+class ArrowBatchWriter(_ColumnarBatchWriter):
+    """Arrow IPC file, one record batch per batch (needs pyarrow)."""
+
+    def _open(self, schema):
+        import pyarrow.ipc
+        return pyarrow.ipc.new_file(self.fh, schema)
+
+
+# Output format name -> writer class; register_writer() adds more
+WRITERS: Dict[str, type] = {
+    "csv": CsvBatchWriter,
+    "jsonl": JsonlBatchWriter,
+    "json": JsonArrayBatchWriter,
+    "parquet": ParquetBatchWriter,
+    "arrow": ArrowBatchWriter,
+}
+
+
+def register_writer(name: str, cls: type):
+    WRITERS[name] = cls
+
+
+_OUTPUT_SUFFIXES = {".ndjson": "jsonl", ".feather": "arrow", ".arrows": "arrow"}
+
+
+def writer_class(path: str, fmt: Optional[str] = None) -> type:
+    """Writer class for fmt, or for the file suffix when fmt is None."""
+    if not fmt:
+        suffix = Path(path).suffix.lower()
+        fmt = _OUTPUT_SUFFIXES.get(suffix, suffix[1:])
+    cls = WRITERS.get(fmt)
+    if cls is None:
+        raise ValueError(f"unknown output format {fmt!r} for {path}")
+    cls.check_available()
+    return cls
+
+
+def open_writer(path: str, fmt: Optional[str] = None) -> BatchWriter:
+    cls = writer_class(path, fmt)
+    if cls.binary:
+        return cls(open(path, "wb"))
+    return cls(open(path, "w", encoding="utf-8", newline="", buffering=OUTPUT_BUFFER_SIZE))
+
+
+def reopen_writer(path: str, fmt: Optional[str], offset: int, rows: int, started: bool,
+                  cls: Optional[type] = None) -> BatchWriter:
+    """Writer (of class `cls`, default by fmt) appending to `path` after cutting it back to `offset` bytes."""
+    cls = cls or writer_class(path, fmt)
+    if cls.binary:
+        raise ValueError(f"{path}: only text outputs (CSV, JSON Lines, JSON) can be resumed")
+    with open(path, "r+b") as fh:
+        fh.truncate(offset)
+    writer = cls(open(path, "a", encoding="utf-8", newline="", buffering=OUTPUT_BUFFER_SIZE), resume=True)
+    writer.rows, writer._started = rows, started
+    return writer
+
+
+# --- multi-process batch pricing ---------------------------------------------
+
+def _rate_tables() -> tuple:
+    # everything pricing reads; spawn/forkserver workers see only what is passed here
+    return (DUTY_RATES, TAX_RATES, CURRENCY, DEFAULT_DUTY, CATEGORY_CLEARANCE_HOURS, COMPLIANCE_FEE_RATE,
+            TARIFF_SCHEDULE, RATE_FILE, FX_RATES, REPORTING_CURRENCY, RULES)
+
+
+def _install_rate_tables(tables: tuple):
+    """Pool initializer: rate tables reach each worker once, not per task."""
+    global DUTY_RATES, TAX_RATES, CURRENCY, DEFAULT_DUTY, CATEGORY_CLEARANCE_HOURS, COMPLIANCE_FEE_RATE
+    global TARIFF_SCHEDULE, RATE_FILE, FX_RATES, REPORTING_CURRENCY, RULES
+    (DUTY_RATES, TAX_RATES, CURRENCY, DEFAULT_DUTY, CATEGORY_CLEARANCE_HOURS, COMPLIANCE_FEE_RATE,
+     TARIFF_SCHEDULE, RATE_FILE, FX_RATES, REPORTING_CURRENCY, RULES) = tables
+    _rates_changed()
+
+
+def _iter_raw_chunks(path: str, fmt: Optional[str], chunk_size: int) -> Iterator[tuple]:
+    """Yield (fmt, fieldnames, lines) without parsing; workers do the parsing.
+
+    CSV chunks are split on physical lines, so quoted fields must not
+    contain newlines.
+    """
+    with InputCursor(path, fmt) as cursor:
+        for fmt_, fieldnames, lines, _ in cursor.raw_chunks(chunk_size):
+            yield fmt_, fieldnames, lines
+
+
+def _price_raw_chunk(task: tuple) -> tuple:
+    fmt, fieldnames, lines, writer_classes, profile, group_by, cents, dedup, simulate, start = task
+    metrics = enable_metrics() if profile else None
+    with stage("read", len(lines)):
+        if fmt == "csv":
+            shipments = list(csv.DictReader(lines, fieldnames=fieldnames))
+        else:
+            shipments = [json.loads(line) for line in lines if line.strip()]
+    checked = None
+    if start is not None:
+        with stage("validate", len(shipments)):
+            valid, rejected = validate_shipments(shipments, start)
+        checked = ValidationStats()
+        checked.update(len(shipments), rejected)
+        checked = checked, RejectWriter.render(rejected)
+        shipments = valid
+    if not shipments:
+        return (0, [""] * len(writer_classes), metrics.snapshot() if metrics is not None else None,
+                None, None, None, checked)
+    batch = price_shipments(shipments, cents, dedup)
+    # text writers render here; binary sinks get the batch itself
+    with stage("render", len(batch)):
+        payloads = [batch if cls.binary else cls.render(batch) for cls in writer_classes]
+    rollup = None
+    if group_by is not None:
+        rollup = GroupAggregator(group_by)
+        with stage("rollup", len(batch)):
+            rollup.update(batch, shipments)
+    stats = None
+    if dedup:
+        stats = DedupStats()
+        stats.update(batch)
+    # the queues themselves run in the parent, which sees chunks in order
+    sim = simulation_columns(batch, shipments) if simulate else None
+    return len(batch), payloads, metrics.snapshot() if metrics is not None else None, rollup, stats, sim, checked
+
+
+def price_file_parallel(path: str, fmt: Optional[str], writer_classes: Sequence[type],
+                        chunk_size: int = DEFAULT_CHUNK_SIZE, workers: int = 2,
+                        ordered: bool = True, rollup: Optional[GroupAggregator] = None,
+                        cents: bool = False, dedup: Optional[DedupStats] = None,
+                        sim: Optional[ClearanceSimulator] = None,
+                        cursor: Optional[InputCursor] = None,
+                        validation: Optional[ValidationStats] = None,
+                        rejects: Optional[BatchWriter] = None) -> Iterator[tuple]:
+    """Price a shipment file on a process pool.
+
+    Yields (row_count, [payload per writer class]) per input chunk, where a
+    payload is rendered text, or the CostBatch for binary writers, in input
+    order unless ordered=False. At most 2 * workers chunks are in flight,
+    so memory stays bounded however large the file is. Workers roll up
+    their own chunks and the partial aggregates are merged into `rollup`.
+    Passing `dedup` prices each chunk's distinct inputs once and merges
+    the workers' counts into it. With `sim`, workers extract the simulation
+    columns and the parent feeds them to it in input order (implies ordered).
+    Given a `cursor`, chunks are read from it instead of `path`, and
+    cursor.committed is the input offset just past the last chunk yielded
+    (also implies ordered). With `validation`, workers drop the rows
+    validate_shipments() rejects; their counts are merged into it and the
+    rejected rows written to `rejects`, numbered from validation.rows on.
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+    profile = METRICS is not None
+    group_by = rollup.by if rollup is not None else None
+    ordered = ordered or sim is not None or cursor is not None
+    if cursor is not None:
+        chunks = cursor.raw_chunks(chunk_size)
+    else:
+        chunks = (c + (None,) for c in _iter_raw_chunks(path, fmt, chunk_size))
+    ends = collections.deque()  # input offset after each submitted chunk
+
+    def make_tasks():
+        records = validation.rows if validation is not None else None
+        for fmt_, names, lines, end in chunks:
+            ends.append(end)
+            start = records
+            if records is not None:
+                # count the records the worker will parse: csv skips empty lines, JSONL blank ones
+                if fmt_ == "csv":
+                    records += sum(1 for line in lines if line.rstrip("\r\n"))
+                else:
+                    records += sum(1 for line in lines if line.strip())
+            yield (fmt_, names, lines, tuple(writer_classes), profile, group_by, cents, dedup is not None,
+                   sim is not None, start)
+
+    tasks = make_tasks()
+    window = 2 * workers
+    with ProcessPoolExecutor(workers, initializer=_install_rate_tables,
+                             initargs=(_rate_tables(),)) as pool:
+        pending = collections.deque(pool.submit(_price_raw_chunk, t)
+                                    for t in itertools.islice(tasks, window))
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                done = [f for f in pending if f in finished]
+                for f in done:
+                    pending.remove(f)
+            for f in done:
+                n, payloads, worker_metrics, partial, stats, sim_cols, checked = f.result()
+                if worker_metrics is not None and METRICS is not None:
+                    METRICS.merge(worker_metrics)
+                if partial is not None:
+                    rollup.merge(partial)
+                if stats is not None:
+                    dedup.merge(stats)
+                if checked is not None:
+                    validation.merge(checked[0])
+                    if rejects is not None:
+                        rejects.write_text(checked[1], checked[0].rejected)
+                if sim_cols is not None:
+                    with stage("simulate", n):
+                        sim.feed(*sim_cols)
+                end = ends.popleft()
+                if cursor is not None:
+                    cursor.committed = end
+                yield n, payloads
+            for t in itertools.islice(tasks, len(done)):
+                pending.append(pool.submit(_price_raw_chunk, t))
+
+
+# --- checkpoints ----------------------------------------------------------------------
+#
+# A checkpointed --input run writes, every N rows and always at a chunk
+# boundary: the input offset just past the last chunk whose results are
+# on disk, the byte length of every output file, and the pickled rollup,
+# dedup and simulation state. Outputs are fsynced before the checkpoint
+# is written to a temporary file and renamed over the old one, so a
+# checkpoint never points past data that is not on disk. --resume cuts
+# each output back to its recorded length and re-reads from the recorded
+# offset, so rows written after the checkpoint are dropped and redone
+# exactly once.
+
+CHECKPOINT_VERSION = 1
+DEFAULT_CHECKPOINT_ROWS = 1_000_000
+
+
+def _job_signature(args) -> Dict[str, Any]:
+    """Settings a checkpoint must have been written with to be resumed."""
+    return {
+        "input": os.path.abspath(args.input),
+        "input_format": args.input_format,
+        "outputs": [[os.path.abspath(path), fmt] for path, fmt in _output_targets(args)],
+        "cents": args.cents,
+        "dedup": args.dedup,
+        "group_by": args.group_by if args.rollup else None,
+        "officers": args.officers if args.simulate else None,
+        "validate": bool(args.validate or args.rejects),
+        "rejects": os.path.abspath(args.rejects) if args.rejects else None,
+        "tables": [args.rates, args.tariffs, args.rules, args.fx_rates, args.report_currency],
+    }
+
+
+def write_checkpoint(path: str, job: Dict[str, Any], cursor: InputCursor, rows: int,
+                     writers: Sequence[BatchWriter], state: tuple):
+    import pickle
+    for w in writers:
+        w.fh.flush()
+        os.fsync(w.fh.fileno())
+    data = {
+        "version": CHECKPOINT_VERSION,
+        "job": job,
+        "input_offset": cursor.committed,
+        "fieldnames": cursor.fieldnames,
+        "rows": rows,
+        "outputs": [{"offset": w.fh.tell(), "rows": w.rows, "started": w._started} for w in writers],
+        "state": base64.b64encode(pickle.dumps(state)).decode("ascii"),
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(data, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+
+def read_checkpoint(path: str, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The checkpoint at `path` with its state unpickled, or None if there is none."""
+    import pickle
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+    except FileNotFoundError:
+        return None
+    if data.get("version") != CHECKPOINT_VERSION or data.get("job") != job:
+        raise ValueError(f"checkpoint {path} belongs to a different run; delete it to start over")
+    data["state"] = pickle.loads(base64.b64decode(data["state"]))
+    return data
+
+
+# --- incremental re-pricing --------------------------------------------------------
+#
+# A PricedStore keeps a book of shipments and their priced results in SQLite,
+# together with the effective rate behind every row: the duty rate of each
+# (destination, category, HS code), the tax rate and currency of each
+# destination, the clearance hours of each category and the compliance fee.
+# reprice() re-evaluates those keys against the live tables and re-prices
+# only the rows whose keys changed, through the indexes below.
+
+_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shipments (
+    id INTEGER PRIMARY KEY,
+    origin TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    product_category TEXT NOT NULL,
+    hs_code TEXT NOT NULL,
+    value REAL NOT NULL,
+    shipping REAL NOT NULL,
+    currency TEXT NOT NULL,
+    shipment_value REAL NOT NULL,
+    shipping_cost REAL NOT NULL,
+    duty_rate REAL NOT NULL,
+    import_duty REAL NOT NULL,
+    tax_rate REAL NOT NULL,
+    tax REAL NOT NULL,
+    base_compliance_fee REAL NOT NULL,
+    total_landed_cost REAL NOT NULL,
+    estimated_clearance_hours INTEGER NOT NULL,
+    priced_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS shipments_rate_key ON shipments (destination, product_category, hs_code);
+CREATE INDEX IF NOT EXISTS shipments_category ON shipments (product_category);
+CREATE TABLE IF NOT EXISTS rate_keys (
+    kind TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    product_category TEXT NOT NULL,
+    hs_code TEXT NOT NULL,
+    value,
+    PRIMARY KEY (kind, destination, product_category, hs_code)
+) WITHOUT ROWID;
+"""
+# Priced columns kept per row, in COST_FIELDS order
+_STORE_PRICED = COST_FIELDS[4:]
+# Columns of a reprice() change set
+CHANGE_FIELDS = (
+    "id", "destination", "product_category", "hs_code", "currency",
+    "old_duty_rate", "new_duty_rate", "old_tax_rate", "new_tax_rate",
+    "old_total_landed_cost", "new_total_landed_cost", "delta",
+)
+
+
+def _effective_rate(kind: str, destination: str, category: str, hs_code: str):
+    if kind == "duty":
+        if hs_code and TARIFF_SCHEDULE is not None:
+            rate = TARIFF_SCHEDULE.lookup(destination, hs_code)
+            if rate is not None:
+                return rate
+        return _base_duty_rate(destination, category)
+    if kind == "tax":
+        return _tax_rate(destination)
+    if kind == "currency":
+        return _currency(destination)
+    if kind == "clearance":
+        return float(CATEGORY_CLEARANCE_HOURS.get(category, 0.0))
+    if kind == "rules":
+        return RULES.fingerprint() if RULES is not None else ""
+    return COMPLIANCE_FEE_RATE
+
+
+class PricedStore:
+    """SQLite-backed book of priced shipments with delta re-pricing.
+
+    Rows get ids in insertion order. reprice() yields a change set of
+    CHANGE_FIELDS dicts for rows whose priced values moved and commits the
+    new prices, so running it twice in a row yields nothing the second time.
+    """
+
+    def __init__(self, path: str):
+        import sqlite3
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(_STORE_SCHEMA)
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT count(*) FROM shipments").fetchone()[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self.db.close()
+
+    def add(self, shipments: Iterable[Dict[str, Any]], chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+        """Price shipment dicts (INPUT_FIELDS names) and append them to the book."""
+        placeholders = ", ".join("?" * (len(_STORE_PRICED) + 7))
+        insert = (f"INSERT INTO shipments (origin, destination, product_category, hs_code, value, shipping, "
+                  f"{', '.join(_STORE_PRICED)}, priced_at) VALUES ({placeholders})")
+        added = 0
+        it = iter(shipments)
+        with self.db:
+            while True:
+                chunk = list(itertools.islice(it, chunk_size))
+                if not chunk:
+                    break
+                dest, origin, cat, values, shipping, hs = (_column(chunk, names) or [None] * len(chunk)
+                                                           for names in INPUT_FIELDS.values())
+                # raw inputs are kept so re-pricing never starts from rounded values
+                values = [float(v or 0.0) for v in values]
+                shipping = [float(v or 0.0) for v in shipping]
+                hs = [_normalize_hs(h) for h in hs]
+                batch = calculate_costs_batch(dest, origin, cat, values, shipping, hs_codes=hs)
+                cols = batch.columns
+                self.db.executemany(insert, zip(
+                    _tolist(cols["origin"]), _tolist(cols["destination"]), _tolist(cols["product_category"]),
+                    hs, values, shipping,
+                    *(_tolist(cols[k]) for k in _STORE_PRICED),
+                    itertools.repeat(batch.timestamp)))
+                added += len(chunk)
+            self._record_rate_keys()
+        return added
+
+    def _record_rate_keys(self):
+        """Snapshot the effective rate of any key that has no snapshot yet."""
+        keys = self.db.execute("""
+            SELECT DISTINCT 'duty', destination, product_category, hs_code FROM shipments
+            UNION SELECT DISTINCT 'tax', destination, '', '' FROM shipments
+            UNION SELECT DISTINCT 'currency', destination, '', '' FROM shipments
+            UNION SELECT DISTINCT 'clearance', '', product_category, '' FROM shipments
+            UNION SELECT 'fee', '', '', ''
+            UNION SELECT 'rules', '', '', ''
+            EXCEPT SELECT kind, destination, product_category, hs_code FROM rate_keys
+        """).fetchall()
+        self.db.executemany("INSERT INTO rate_keys VALUES (?, ?, ?, ?, ?)",
+                            [key + (_effective_rate(*key),) for key in keys])
+
+    def changed_rate_keys(self) -> List[tuple]:
+        """(kind, destination, category, hs_code, old, new) for every moved rate."""
+        changed = []
+        for kind, dest, cat, hs, old in self.db.execute("SELECT * FROM rate_keys"):
+            new = _effective_rate(kind, dest, cat, hs)
+            if new != old:
+                changed.append((kind, dest, cat, hs, old, new))
+        return changed
+
+    def reprice(self, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+        """Re-price rows hit by rate changes; yield their CHANGE_FIELDS dicts."""
+        changed = self.changed_rate_keys()
+        if not changed:
+            return
+        db = self.db
+        with db:
+            db.execute("CREATE TEMP TABLE IF NOT EXISTS changed_keys "
+                       "(kind TEXT, destination TEXT, product_category TEXT, hs_code TEXT)")
+            db.execute("CREATE TEMP TABLE IF NOT EXISTS affected (id INTEGER PRIMARY KEY)")
+            db.execute("DELETE FROM changed_keys")
+            db.execute("DELETE FROM affected")
+            db.executemany("INSERT INTO changed_keys VALUES (?, ?, ?, ?)", [c[:4] for c in changed])
+            # rules can depend on origin and value, which no key tracks
+            if any(c[0] in ("fee", "rules") for c in changed):
+                db.execute("INSERT INTO affected SELECT id FROM shipments")
+            else:
+                db.execute("""
+                    INSERT OR IGNORE INTO affected
+                    SELECT s.id FROM changed_keys k JOIN shipments s
+                      ON s.destination = k.destination AND s.product_category = k.product_category
+                     AND s.hs_code = k.hs_code
+                     WHERE k.kind = 'duty'
+                    UNION SELECT s.id FROM changed_keys k JOIN shipments s ON s.destination = k.destination
+                     WHERE k.kind IN ('tax', 'currency')
+                    UNION SELECT s.id FROM changed_keys k JOIN shipments s ON s.product_category = k.product_category
+                     WHERE k.kind = 'clearance'
+                """)
+            update = (f"UPDATE shipments SET {', '.join(f'{k} = ?' for k in _STORE_PRICED)}, "
+                      f"priced_at = ? WHERE id = ?")
+            select = (f"SELECT s.id, s.origin, s.destination, s.product_category, s.hs_code, s.value, s.shipping, "
+                      f"{', '.join('s.' + k for k in _STORE_PRICED)} FROM affected a "
+                      f"JOIN shipments s ON s.id = a.id WHERE a.id > ? ORDER BY a.id LIMIT ?")
+            p = {k: i for i, k in enumerate(_STORE_PRICED)}
+            last = 0
+            while True:
+                rows = db.execute(select, (last, chunk_size)).fetchall()
+                if not rows:
+                    break
+                last = rows[-1][0]
+                ids, origins, dests, cats, hs, values, shipping, *old = zip(*rows)
+                with stage("reprice", len(rows)):
+                    batch = calculate_costs_batch(dests, origins, cats, values, shipping, hs_codes=hs)
+                new = [_tolist(batch.columns[k]) for k in _STORE_PRICED]
+                moved = [i for i, pair in enumerate(zip(zip(*old), zip(*new))) if pair[0] != pair[1]]
+                db.executemany(update, [tuple(col[i] for col in new) + (batch.timestamp, ids[i]) for i in moved])
+                for i in moved:
+                    old_total, new_total = old[p["total_landed_cost"]][i], new[p["total_landed_cost"]][i]
+                    yield dict(zip(CHANGE_FIELDS, (
+                        ids[i], dests[i], cats[i], hs[i], new[p["currency"]][i],
+                        old[p["duty_rate"]][i], new[p["duty_rate"]][i],
+                        old[p["tax_rate"]][i], new[p["tax_rate"]][i],
+                        old_total, new_total, _round(new_total - old_total, 2),
+                    )))
+            db.executemany("UPDATE rate_keys SET value = ? WHERE kind = ? AND destination = ? "
+                           "AND product_category = ? AND hs_code = ?",
+                           [(c[5],) + c[:4] for c in changed])
+
+
+def _output_targets(args) -> List[tuple]:
+    pairs = (("csv", args.csv), ("jsonl", args.jsonl), ("json", args.output),
+             ("parquet", args.parquet), ("arrow", args.arrow))
+    return [(path, fmt) for fmt, path in pairs if path]
+
+
+def _progress(rows: int):
+    if METRICS is not None:
+        METRICS.count("rows", rows)
+        METRICS.count("chunks")
+        METRICS.publish()
+
+
+@contextlib.contextmanager
+def _batch_writers(targets: List[tuple], stdout: bool = True,
+                   resume: Optional[List[Dict[str, Any]]] = None) -> Iterator[List[BatchWriter]]:
+    """Open a writer per (path, fmt) target, or JSON Lines on stdout if none.
+
+    `resume` holds a checkpoint's per-output state; those files are
+    continued instead of rewritten.
+    """
+    for path, fmt in targets:
+        writer_class(path, fmt)  # fail before any output file is created
+    writers: List[BatchWriter] = []
+    try:
+        for i, (path, fmt) in enumerate(targets):
+            if resume is not None:
+                out = resume[i]
+                writers.append(reopen_writer(path, fmt, out["offset"], out["rows"], out["started"]))
+            else:
+                writers.append(open_writer(path, fmt))
+        if not writers and stdout:
+            writers.append(JsonlBatchWriter(sys.stdout))
+        yield writers
+    finally:
+        for w in writers:
+            w.close()
+            if w.fh is not sys.stdout:
+                w.fh.close()
+
+
+@contextlib.contextmanager
+def _reject_writer(path: Optional[str], resume: Optional[Dict[str, Any]] = None) -> Iterator[Optional[RejectWriter]]:
+    """RejectWriter on `path` (continued from a checkpoint's `resume` state), or None."""
+    if path is None:
+        yield None
+        return
+    if resume is not None:
+        writer = reopen_writer(path, None, resume["offset"], resume["rows"], resume["started"], RejectWriter)
+    else:
+        writer = RejectWriter(open(path, "w", encoding="utf-8", newline="", buffering=OUTPUT_BUFFER_SIZE))
+    try:
+        yield writer
+    finally:
+        writer.close()
+        writer.fh.close()
+
+
+def _write_records(path: str, fields: Sequence[str], records: Iterable[Dict[str, Any]]) -> int:
+    """Write dicts as CSV (*.csv) or JSON Lines; return the record count."""
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        if path.lower().endswith(".csv"):
+            writer = csv.DictWriter(fh, fieldnames=fields)
+            writer.writeheader()
+            emit = writer.writerow
+        else:
+            emit = lambda record: fh.write(json.dumps(record) + "\n")
+        for record in records:
+            emit(record)
+            count += 1
+    return count
+
+
+def run_input(args) -> int:
+    targets = _output_targets(args)
+    rollup = GroupAggregator([k.strip() for k in args.group_by.split(",")]) if args.rollup else None
+    dedup = DedupStats() if args.dedup else None
+    sim = ClearanceSimulator(*parse_officers(args.officers)) if args.simulate else None
+    validation = ValidationStats() if args.validate or args.rejects else None
+    rows = 0
+    job = _job_signature(args) if args.checkpoint else None
+    saved = read_checkpoint(args.checkpoint, job) if args.resume else None
+    if saved is not None:
+        rows = saved["rows"]
+        rollup, dedup, sim, validation = saved["state"]
+        print(f"Resuming after {rows} rows from {args.checkpoint}", file=sys.stderr)
+    cursor = InputCursor(args.input, args.input_format, *((saved["input_offset"], saved["fieldnames"])
+                                                          if saved is not None else ()))
+    since_checkpoint = 0
+
+    def committed(n: int):
+        nonlocal rows, since_checkpoint
+        rows += n
+        _progress(n)
+        since_checkpoint += n
+        if job is not None and since_checkpoint >= args.checkpoint_every:
+            outputs = writers + [rejects] if rejects is not None else writers
+            with stage("checkpoint"):
+                write_checkpoint(args.checkpoint, job, cursor, rows, outputs, (rollup, dedup, sim, validation))
+            since_checkpoint = 0
+
+    outputs = saved["outputs"] if saved is not None else None
+    with cursor, _batch_writers(targets, stdout=rollup is None and sim is None,
+                                resume=outputs) as writers, \
+            _reject_writer(args.rejects, outputs[len(targets)] if outputs and args.rejects else None) as rejects:
+        if args.workers > 1:
+            for n, payloads in price_file_parallel(args.input, args.input_format, [type(w) for w in writers],
+                                                   args.chunk_size, args.workers, ordered=not args.unordered,
+                                                   rollup=rollup, cents=args.cents, dedup=dedup, sim=sim,
+                                                   cursor=cursor, validation=validation, rejects=rejects):
+                with stage("write", n):
+                    for w, payload in zip(writers, payloads):
+                        if isinstance(payload, str):
+                            w.write_text(payload, n)
+                        else:
+                            w.write(payload)
+                committed(n)
+        else:
+            for chunk in _iter_chunks(cursor, args.chunk_size):
+                if validation is not None:
+                    with stage("validate", len(chunk)):
+                        valid, rejected = validate_shipments(chunk, validation.rows)
+                    validation.update(len(chunk), rejected)
+                    if rejects is not None and rejected:
+                        rejects.write(rejected)
+                    chunk = valid
+                    if not chunk:
+                        cursor.committed = cursor.offset
+                        continue
+                batch = price_shipments(chunk, args.cents, dedup is not None)
+                if dedup is not None:
+                    dedup.update(batch)
+                with stage("write", len(batch)):
+                    for w in writers:
+                        w.write(batch)
+                if rollup is not None:
+                    with stage("rollup", len(batch)):
+                        rollup.update(batch, chunk)
+                if sim is not None:
+                    with stage("simulate", len(batch)):
+                        sim.update(batch, chunk)
+                cursor.committed = cursor.offset
+                committed(len(batch))
+    if job is not None and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)  # finished; nothing left to resume
+    for path, _ in targets:
+        print(f"Wrote {rows} rows to {path}")
+    if rollup is not None:
+        groups = _write_records(args.rollup, rollup.fields, rollup.rows())
+        print(f"Wrote {groups} groups to {args.rollup}")
+    if sim is not None:
+        ports = _write_records(args.simulate, SIM_FIELDS, sim.rows())
+        print(f"Wrote {ports} port queues to {args.simulate}")
+    if args.rejects:
+        print(f"Wrote {validation.rejected} rejected rows to {args.rejects}")
+    # stderr, so JSON Lines on stdout stays clean
+    if dedup is not None:
+        print(dedup.report(), file=sys.stderr)
+    if validation is not None:
+        print(validation.report(), file=sys.stderr)
+    return 0
+
+
+def run_sweep(args) -> int:
+    axes = {"destination": [args.destination], "origin": [args.origin], "product_category": [args.category],
+            "shipment_value": [args.value], "shipping_cost": [args.shipping]}
+    for spec in args.sweep:
+        field, values = parse_sweep_axis(spec)
+        axes[field] = values
+    grid = SweepGrid(*axes.values())
+    reducer = SweepReducer(args.reduce) if args.reduce else None
+    targets = _output_targets(args)
+    with _batch_writers(targets, stdout=reducer is None) as writers:
+        for batch in grid.batches(args.chunk_size):
+            with stage("write", len(batch)):
+                for w in writers:
+                    w.write(batch)
+            if reducer is not None:
+                reducer.update(batch)
+            _progress(len(batch))
+    for path, _ in targets:
+        print(f"Wrote {len(grid)} rows to {path}")
+    if reducer is not None:
+        print(json.dumps(reducer.result(), indent=2))
+    return 0
+
+
+def run_store(args) -> int:
+    with PricedStore(args.store) as store:
+        if args.input:
+            added = store.add(read_shipments(args.input, args.input_format), args.chunk_size)
+            print(f"Stored {added} rows in {args.store}")
+        if not args.reprice:
+            return 0
+        changes = store.reprice(args.chunk_size)
+        if not args.changes:
+            for change in changes:
+                print(json.dumps(change))
+            return 0
+        count = _write_records(args.changes, CHANGE_FIELDS, changes)
+        print(f"Wrote {count} changed rows to {args.changes}")
+    return 0
+
+
+# --- HTTP quoting service ----------------------------------------------------------
+
+def _coerce_shipment(obj) -> Dict[str, Any]:
+    """Canonical INPUT_FIELDS keys with numeric amounts; ValueError if unusable.
+
+    Missing amounts are 0, as in --input; NaN, infinite and negative ones
+    are rejected (see validate_shipments()).
+    """
+    if not isinstance(obj, dict):
+        raise ValueError("shipment must be a JSON object")
+    row = {key: next((obj[n] for n in names if n in obj), None) for key, names in INPUT_FIELDS.items()}
+    for key in ("destination", "origin", "product_category"):
+        if row[key] is not None and not isinstance(row[key], str):
+            raise ValueError(f"{key} must be a string")
+    for key in ("shipment_value", "shipping_cost"):
+        code = _amount_code(row[key])
+        if code > 1:
+            raise ValueError(f"{key} must be a finite, non-negative number")
+        row[key] = float(row[key]) if code == 0 else 0.0
+    return row
+
+
+class QuoteBatcher:
+    """Collects concurrent quote() calls and prices them in one batch.
+
+    A batch is flushed when max_batch requests are waiting or max_wait
+    seconds after the first one arrived, whichever comes first.
+    """
+
+    def __init__(self, max_batch: int = 256, max_wait: float = 0.002):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.requests = 0
+
+    async def quote(self, shipment: Dict[str, Any]) -> Dict[str, Any]:
+        import asyncio
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((shipment, future))
+        if len(self._pending) >= self.max_batch:
+            self.flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        self.batches += 1
+        self.requests += len(pending)
+        try:
+            rows = price_shipments([shipment for shipment, _ in pending]).rows()
+            for (_, future), row in zip(pending, rows):
+                if not future.done():
+                    future.set_result(row)
+        except Exception as exc:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(exc)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+_HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class QuoteServer:
+    """Minimal HTTP/1.1 JSON quoting endpoint (stdlib asyncio only).
+
+    POST /quote   body: one shipment object, or a list of them
+    GET  /health  batcher statistics
+    """
+
+    max_body = 1 << 20
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080,
+                 max_batch: int = 256, max_wait: float = 0.002):
+        self.host = host
+        self.port = port
+        self.batcher = QuoteBatcher(max_batch, max_wait)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> tuple:
+        import asyncio
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.host, self.port = self._server.sockets[0].getsockname()[:2]
+        return self.host, self.port
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        import asyncio
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                method, _, rest = lines[0].partition(" ")
+                path, _, version = rest.partition(" ")
+                headers = {}
+                for line in lines[1:]:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and version.upper() != "HTTP/1.0")
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    status, payload, keep_alive = 400, {"error": "bad Content-Length"}, False
+                elif length > self.max_body:
+                    status, payload, keep_alive = 413, {"error": "request body too large"}, False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    status, payload = await self._dispatch(method, path, body)
+                try:
+                    data = json.dumps(payload, allow_nan=False).encode("utf-8")
+                except ValueError:  # a non-finite result; browsers cannot parse NaN
+                    status, data = 500, b'{"error": "quote is not a finite number"}'
+                writer.write(
+                    f"HTTP/1.1 {status} {_HTTP_REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> tuple:
+        path = path.split("?", 1)[0]
+        if path == "/health":
+            return (200, dict(status="ok", **self.batcher.stats())) if method == "GET" else (405, {"error": "use GET"})
+        if path != "/quote":
+            return 404, {"error": f"no route {path}"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            obj = json.loads(body or b"null")
+            if isinstance(obj, list):
+                shipments = [_coerce_shipment(o) for o in obj]
+            else:
+                shipments = [_coerce_shipment(obj)]
+        except ValueError as exc:
+            return 400, {"error": str(exc)}
+        import asyncio
+        try:
+            quotes = await asyncio.gather(*(self.batcher.quote(s) for s in shipments))
+        except Exception as exc:
+            return 500, {"error": str(exc)}
+        return 200, quotes if isinstance(obj, list) else quotes[0]
+
+
+def serve_http(address: str, max_batch: int = 256, max_wait: float = 0.002):
+    """Run a QuoteServer on "[host:]port" until interrupted."""
+    import asyncio  # only --http needs it; it is slow to import
+    host, _, port = address.rpartition(":")
+    server = QuoteServer(host or "127.0.0.1", int(port), max_batch, max_wait)
+
+    async def run():
+        host, port = await server.start()
+        print(f"Serving quotes on http://{host}:{port}/quote", flush=True)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+# --- CLI daemon ----------------------------------------------------------------------
+#
+# One request per connection. The client (run_client() in
+# trade_compliance_client.py) sends its cwd and argv joined by
+# NULs and shuts down its write side; the daemon runs main(argv) in that
+# directory with stdout/stderr captured and answers b"<code> <len(stdout)>\n"
+# followed by stdout and stderr. Requests run one at a time and each
+# starts from the daemon's built-in rate tables.
+
+def _serve_request(request: bytes, pristine: tuple) -> bytes:
+    cwd, *argv = request.decode("utf-8", "surrogateescape").split("\0")
+    out, err = io.StringIO(), io.StringIO()
+    home = os.getcwd()
+    try:
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            try:
+                os.chdir(cwd or home)
+                code = main(argv)
+            except SystemExit as exc:
+                if exc.code is None or isinstance(exc.code, int):
+                    code = exc.code
+                else:
+                    print(exc.code, file=sys.stderr)
+                    code = 1
+            except Exception:
+                traceback.print_exc()
+                code = 1
+    finally:
+        os.chdir(home)
+        _install_rate_tables(pristine)
+    stdout = out.getvalue().encode("utf-8", "surrogateescape")
+    return b"%d %d\n" % (code or 0, len(stdout)) + stdout + err.getvalue().encode("utf-8", "surrogateescape")
+
+
+def serve_daemon(path: str, rates: Optional[str] = None, tariffs: Optional[str] = None):
+    """Answer trade_compliance_client.py requests on a Unix socket until interrupted.
+
+    `rates` and `tariffs` are loaded up front; requests naming the same
+    files reuse them until the files change.
+    """
+    global _WARM_TABLES
+    import socket
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)  # stale socket of a daemon that died
+        else:
+            raise OSError(f"a daemon is already serving on {path}")
+        finally:
+            probe.close()
+    _WARM_TABLES = {}
+    pristine = _rate_tables()
+    if rates:
+        load_rate_file(rates)
+    if tariffs:
+        load_tariff_schedule(tariffs)
+    _install_rate_tables(pristine)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen(64)
+        print(f"Serving on {path} (set {SOCKET_ENV}={path} and run trade_compliance_client.py)", file=sys.stderr)
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                try:
+                    chunks = []
+                    while True:
+                        data = conn.recv(1 << 16)
+                        if not data:
+                            break
+                        chunks.append(data)
+                    conn.sendall(_serve_request(b"".join(chunks), pristine))
+                except OSError:
+                    pass  # client went away
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
+        _WARM_TABLES = None
+
+
+def build_parser():
+    p = argparse.ArgumentParser(description="Trade Compliance CLI")
+    p.add_argument("--destination", "-d", choices=list(TAX_RATES), default="italy")
+    p.add_argument("--origin", "-o", default="india")
+    p.add_argument("--category", "-c", choices=["textiles", "machinery", "pharmaceuticals", "automotive", "food", "electronics"], default="electronics")
+    p.add_argument("--value", "-v", type=float, default=50000.0)
+    p.add_argument("--shipping", "-s", type=float, default=500.0)
+    p.add_argument("--hs-code", type=str, default="", help="HS code for --tariffs lookup")
+    p.add_argument("--tariffs", type=str, help="load HS-code tariff schedule (CSV/JSONL: destination,hs_code,rate)")
+    p.add_argument("--rates", type=str, help="use a compiled binary rate file")
+    p.add_argument("--rules", type=str, metavar="PATH",
+                   help="FTA/surcharge/clearance rule file (CSV/JSONL: kind,value,origin,destination,category,...)")
+    p.add_argument("--fx-rates", type=str, metavar="PATH",
+                   help="dated FX table (CSV/JSONL: date,currency,rate[,base]); adds reporting_* columns")
+    p.add_argument("--report-currency", type=str, metavar="CODE",
+                   help="currency of the reporting_* columns (default: the FX table's base)")
+    p.add_argument("--fx-date", type=str, metavar="YYYY-MM-DD",
+                   help="FX as-of date for single runs (default: today; --input uses each row's date)")
+    p.add_argument("--compile-rates", type=str, metavar="PATH", help="compile rate tables (and --tariffs) to PATH")
+    p.add_argument("--export-bundle", type=str, metavar="PATH",
+                   help="write rate tables and --rules as a JSON quote bundle for app.js to PATH")
+    p.add_argument("--json", action="store_true", help="print JSON to stdout")
+    p.add_argument("--output", "-O", type=str, help="write JSON to file")
+    p.add_argument("--csv", type=str, help="write batch CSV")
+    p.add_argument("--batch", action="store_true", help="run demo batch")
+    p.add_argument("--input", "-i", type=str, help="price shipments from a CSV/JSONL file ('-' for stdin)")
+    p.add_argument("--input-format", choices=["csv", "jsonl"], help="input format (default: from file suffix)")
+    p.add_argument("--jsonl", type=str, help="write JSON Lines to file (with --input)")
+    p.add_argument("--parquet", type=str, help="write Parquet to file (with --input; needs pyarrow)")
+    p.add_argument("--arrow", type=str, help="write an Arrow IPC file (with --input; needs pyarrow)")
+    p.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows priced per chunk")
+    p.add_argument("--workers", "-w", type=int, default=1, help="worker processes for --input (default: 1)")
+    p.add_argument("--checkpoint", type=str, metavar="PATH",
+                   help="--input: save progress to PATH every --checkpoint-every rows (removed when done)")
+    p.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_ROWS, metavar="N",
+                   help="rows between checkpoints (default: %(default)s)")
+    p.add_argument("--resume", action="store_true",
+                   help="continue from --checkpoint if it exists (text outputs only)")
+    p.add_argument("--validate", action="store_true",
+                   help="--input: check each chunk's columns and skip invalid rows (report on stderr)")
+    p.add_argument("--rejects", type=str, metavar="PATH",
+                   help="write rows failing --validate to PATH as JSON Lines with reason codes (implies --validate)")
+    p.add_argument("--dedup", action="store_true",
+                   help="--input: price identical rows of a chunk once and report the dedup ratio")
+    p.add_argument("--unordered", action="store_true", help="with --workers, emit chunks as they finish")
+    p.add_argument("--profile", action="store_true", help="print a per-stage time breakdown to stderr")
+    p.add_argument("--metrics-out", type=str, metavar="PATH", help="write metrics (JSON for *.json, else Prometheus text)")
+    p.add_argument("--cents", action="store_true",
+                   help="price in integer minor units with basis-point rates (single runs and --input)")
+    p.add_argument("--rollup", type=str, metavar="PATH",
+                   help="with --input, write per-group totals, means and clearance quantiles (CSV or JSONL)")
+    p.add_argument("--group-by", default="destination,category,month",
+                   help="--rollup keys from destination, origin, category, currency, month "
+                        "(month needs a date column; default: %(default)s)")
+    p.add_argument("--simulate", type=str, metavar="PATH",
+                   help="with --input, simulate customs queues per port and write their stats (CSV or JSONL); "
+                        "rows need an arrival or date column, in time order per port")
+    p.add_argument("--officers", default="1", metavar="SPEC",
+                   help="--simulate officers per port: N, PORT=N, ... (default: %(default)s)")
+    p.add_argument("--sweep", action="append", metavar="AXIS=VALUES",
+                   help="price a what-if grid; AXIS is destination, origin, category, value or shipping, "
+                        "VALUES a comma list or start:stop:step (repeatable; other axes use the single-run flags)")
+    p.add_argument("--reduce", nargs="?", const="total_landed_cost", metavar="FIELD",
+                   help="with --sweep, print count/min/max/mean/argmin/argmax of FIELD (default: total_landed_cost)")
+    p.add_argument("--store", type=str, metavar="DB", help="SQLite book of priced shipments (--input adds rows)")
+    p.add_argument("--reprice", action="store_true", help="with --store, re-price rows hit by rate changes")
+    p.add_argument("--changes", type=str, help="--reprice change set file (CSV or JSONL; default: stdout)")
+    p.add_argument("--serve", type=str, metavar="SOCKET",
+                   help=f"run a daemon on a Unix socket; with {SOCKET_ENV}=SOCKET, "
+                        "trade_compliance_client.py forwards single quotes to it")
+    p.add_argument("--http", type=str, metavar="[HOST:]PORT", help="serve POST /quote over HTTP")
+    p.add_argument("--max-batch", type=int, default=256, help="--http: max requests priced per batch")
+    p.add_argument("--max-wait-ms", type=float, default=2.0, help="--http: max time a request waits for its batch")
+    return p
+
+
+def main(argv=None):
+    p = build_parser()
+    args = p.parse_args(argv)
+    if not (args.profile or args.metrics_out):
+        return _run(p, args)
+    metrics = enable_metrics()
+    try:
+        return _run(p, args)
+    finally:
+        disable_metrics()
+        if args.profile:
+            print(metrics.report(), file=sys.stderr)
+        if args.metrics_out:
+            metrics.dump(args.metrics_out)
+
+
+def _run(p: argparse.ArgumentParser, args) -> int:
+    if args.serve:
+        try:
+            serve_daemon(args.serve, args.rates, args.tariffs)
+        except (OSError, KeyError, ValueError) as exc:
+            p.error(f"cannot serve on {args.serve}: {exc}")
+        return 0
+    if args.rates:
+        try:
+            load_rate_file(args.rates)
+        except (OSError, ValueError) as exc:
+            p.error(f"cannot load rates from {args.rates}: {exc}")
+    if args.tariffs:
+        try:
+            load_tariff_schedule(args.tariffs)
+        except (OSError, KeyError, ValueError) as exc:
+            p.error(f"cannot load tariffs from {args.tariffs}: {exc}")
+    if args.rules:
+        try:
+            load_rules(args.rules)
+        except (OSError, KeyError, ValueError) as exc:
+            p.error(f"cannot load rules from {args.rules}: {exc}")
+    if (args.report_currency or args.fx_date) and not args.fx_rates:
+        p.error("--report-currency and --fx-date need --fx-rates")
+    if args.fx_rates:
+        try:
+            load_fx_rates(args.fx_rates)
+        except (OSError, KeyError, ValueError) as exc:
+            p.error(f"cannot load FX rates from {args.fx_rates}: {exc}")
+        set_reporting_currency(args.report_currency)
+    if args.compile_rates:
+        if RATE_FILE is not None:
+            p.error("--compile-rates reads the built-in tables; drop --rates")
+        size = compile_rates(args.compile_rates, TARIFF_SCHEDULE)
+        print(f"Wrote {size} bytes of compiled rates to {args.compile_rates}")
+        return 0
+    if args.export_bundle:
+        try:
+            size = export_quote_bundle(args.export_bundle)
+        except (OSError, ValueError) as exc:
+            p.error(f"cannot export quote bundle to {args.export_bundle}: {exc}")
+        print(f"Wrote {size} bytes of quote tables to {args.export_bundle}")
+        return 0
+    if args.http:
+        if args.max_batch < 1 or args.max_wait_ms < 0:
+            p.error("--max-batch must be positive and --max-wait-ms non-negative")
+        try:
+            serve_http(args.http, args.max_batch, args.max_wait_ms / 1000.0)
+        except (OSError, ValueError) as exc:
+            p.error(f"cannot serve on {args.http}: {exc}")
+        return 0
+    if args.rollup and not args.input:
+        p.error("--rollup needs --input")
+    if (args.validate or args.rejects) and (not args.input or args.store):
+        p.error("--validate and --rejects work with --input (without --store)")
+    if args.simulate:
+        if not args.input:
+            p.error("--simulate needs --input")
+        try:
+            parse_officers(args.officers)
+        except ValueError as exc:
+            p.error(str(exc))
+    if args.cents and (args.sweep or args.store or args.http or args.batch):
+        p.error("--cents works with single runs and --input")
+    if args.reduce and not args.sweep:
+        p.error("--reduce needs --sweep")
+    if args.sweep:
+        if args.chunk_size < 1:
+            p.error("--chunk-size must be positive")
+        try:
+            return run_sweep(args)
+        except (ImportError, ValueError) as exc:
+            p.error(str(exc))
+    if args.reprice and not args.store:
+        p.error("--reprice needs --store")
+    if args.store:
+        import sqlite3
+        if not (args.input or args.reprice):
+            p.error("--store needs --input and/or --reprice")
+        if args.chunk_size < 1:
+            p.error("--chunk-size must be positive")
+        try:
+            return run_store(args)
+        except (OSError, sqlite3.Error, ValueError) as exc:
+            p.error(str(exc))
+    if args.input:
+        if args.chunk_size < 1:
+            p.error("--chunk-size must be positive")
+        if args.workers < 1:
+            p.error("--workers must be positive")
+        if args.resume and not args.checkpoint:
+            p.error("--resume needs --checkpoint")
+        if args.checkpoint:
+            if args.checkpoint_every < 1:
+                p.error("--checkpoint-every must be positive")
+            if args.input == "-":
+                p.error("--checkpoint needs a file --input, not stdin")
+            if not _output_targets(args) and not (args.rollup or args.simulate):
+                p.error("--checkpoint needs file outputs; stdout cannot be resumed")
+            if args.parquet or args.arrow:
+                p.error("--checkpoint works with --csv/--jsonl outputs, not Parquet/Arrow")
+        try:
+            return run_input(args)
+        except (ImportError, ValueError) as exc:
+            p.error(str(exc))
+    if args.batch:
+        rows = generate_demo()
+        if args.csv:
+            write_csv(Path(args.csv), rows)
+            print(f"Wrote CSV to {args.csv}")
+        if args.output:
+            write_json(Path(args.output), rows)
+            print(f"Wrote JSON to {args.output}")
+        if args.json and not args.output:
+            print(json.dumps(rows, indent=2))
+        return 0
+
+    tc = TradeCompliance(args.destination, args.origin, args.category, args.value, args.shipping, args.hs_code)
+    try:
+        if args.cents:
+            # no pretty form: amounts are in minor units and rates in basis points
+            costs = tc.calculate_costs_cents(args.fx_date)
+            print(json.dumps(costs, indent=2))
+            if args.output:
+                write_json(Path(args.output), costs)
+                print(f"Wrote JSON to {args.output}")
+            return 0
+        if args.json:
+            print(json.dumps(tc.calculate_costs(args.fx_date), indent=2))
+        else:
+            print(tc.to_pretty(args.fx_date))
+        if args.output:
+            write_json(Path(args.output), tc.calculate_costs(args.fx_date))
+            print(f"Wrote JSON to {args.output}")
+    except ValueError as exc:  # no FX rate for the date
+        p.error(str(exc))
     return 0
 
 
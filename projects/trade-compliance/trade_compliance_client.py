@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+trade_compliance_client.py
+
+Fast command-line entry point for trade_compliance.py. With
+TRADE_COMPLIANCE_SOCKET set it forwards single-quote invocations to a
+`trade_compliance.py --serve` daemon and relays the answer; otherwise, or
+when no daemon answers, it imports trade_compliance (byte-compiled once
+into __pycache__, unlike a __main__ script) and runs it in-process.
+
+    TRADE_COMPLIANCE_SOCKET=/tmp/tc.sock python trade_compliance_client.py -d india --value 1000
+"""
+
+import os
+import sys
+
+# Same as trade_compliance.SOCKET_ENV; not imported, that is the point
+SOCKET_ENV = "TRADE_COMPLIANCE_SOCKET"
+# Modes that must run in the calling process: servers, stdin input, and
+# file/batch jobs whose output the daemon would have to buffer whole (-i too)
+_LOCAL_ONLY = ("--serve", "--http", "--input", "--batch", "--sweep", "--store", "--reprice")
+
+
+def _runs_locally(argv) -> bool:
+    for arg in argv:
+        if arg == "-" or (arg.startswith("-i") and not arg.startswith("--")):
+            return True
+        name = arg.split("=", 1)[0]
+        # argparse also accepts unambiguous prefixes such as --inp
+        if len(name) > 2 and name.startswith("--") and any(flag.startswith(name) for flag in _LOCAL_ONLY):
+            return True
+    return False
+
+
+def run_client(path: str, argv) -> "int | None":
+    """Run argv on a --serve daemon and relay its output and exit code.
+
+    Returns None when the daemon is unreachable or argv must run locally
+    (see _LOCAL_ONLY), so the caller can fall back to main(). Only the C
+    socket module is imported, keeping the client's startup short.
+    """
+    argv = list(argv)
+    if _runs_locally(argv):
+        return None
+    import _socket
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        sock.settimeout(1.0)
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    chunks = []
+    try:
+        sock.settimeout(None)
+        sock.sendall("\0".join([os.getcwd()] + argv).encode("utf-8", "surrogateescape"))
+        sock.shutdown(_socket.SHUT_WR)
+        while True:
+            data = sock.recv(1 << 16)
+            if not data:
+                break
+            chunks.append(data)
+    except OSError:
+        return None
+    finally:
+        sock.close()
+    header, _, body = b"".join(chunks).partition(b"\n")
+    if not header:
+        return None
+    code, out_len = map(int, header.split())
+    sys.stdout.flush()
+    sys.stdout.buffer.write(body[:out_len])
+    sys.stdout.flush()
+    sys.stderr.buffer.write(body[out_len:])
+    return code
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        code = run_client(path, argv)
+        if code is not None:
+            return code
+    import trade_compliance
+    return trade_compliance.main(argv)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())